@@ -0,0 +1,281 @@
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pandas as pd
+from ast import literal_eval
+from pathlib import Path
+import hashlib
+import json
+import uuid
+import os
+
+# Tabla de chunks compartida por todos los artefactos (un fichero Parquet por escritura)
+CHUNK_TABLE = 'chunks/chunk_table'
+
+# Columnas de listas de contextos que se guardan como referencias a la tabla de chunks
+CHUNK_COLUMNS = ['retrieved_contexts']
+
+def chunk_id(text):
+    """
+    Identificador de un chunk: hash SHA-256 de su contenido.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class ChunkTable:
+    """
+    Tabla de chunks direccionada por contenido. Cada texto se guarda una sola vez aunque
+    aparezca en muchos artefactos. Las altas se escriben como ficheros Parquet nuevos
+    dentro de la carpeta, por lo que nunca se reescribe lo ya guardado.
+    """
+
+    def __init__(self, path=CHUNK_TABLE):
+        """
+        Args:
+            path (str): Carpeta de la tabla de chunks.
+        """
+        self.path = Path(path)
+        self._ids = None
+
+    def _dataset(self):
+        # Lista explícita de partes: los temporales de otra escritura en curso no se leen
+        parts = sorted(str(p) for p in self.path.glob('*.parquet'))
+        return ds.dataset(parts, format='parquet') if parts else None
+
+    def ids(self):
+        """
+        Devuelve el conjunto de identificadores almacenados (solo se lee esa columna).
+        """
+        if self._ids is None:
+            dataset = self._dataset()
+            self._ids = set(dataset.to_table(columns=['chunk_id']).column('chunk_id').to_pylist()) if dataset else set()
+        return self._ids
+
+    def add(self, contents, metadatas=None):
+        """
+        Añade los chunks que aún no están en la tabla.
+
+        Args:
+            contents (List[str]): Textos de los chunks.
+            metadatas (List[dict]): Metadatos de cada chunk (opcional).
+
+        Returns:
+            List[str]: Identificadores de los chunks, en el mismo orden.
+        """
+        metadatas = metadatas or [None] * len(contents)
+        ids = [chunk_id(text) for text in contents]
+        known = self.ids()
+
+        new = {}
+        for i, text, metadata in zip(ids, contents, metadatas):
+            if i not in known and i not in new:
+                new[i] = (text, json.dumps(metadata, ensure_ascii=False) if metadata is not None else None)
+
+        if new:
+            self.path.mkdir(parents=True, exist_ok=True)
+            table = pa.table({
+                'chunk_id': list(new),
+                'content': [text for text, _ in new.values()],
+                'metadata': pa.array([metadata for _, metadata in new.values()], type=pa.string()),
+            })
+            # Escritura atómica: un fichero a medias nunca queda visible en la tabla. El temporal
+            # empieza por '.', que el descubrimiento de ficheros de pyarrow también ignora
+            name = f'part-{uuid.uuid4().hex}.parquet'
+            tmp = self.path / f'.{name}.tmp'
+            pq.write_table(table, tmp)
+            os.replace(tmp, self.path / name)
+            known.update(new)
+
+        return ids
+
+    def get(self, ids):
+        """
+        Lee de la tabla únicamente los chunks solicitados.
+
+        Args:
+            ids (Iterable[str]): Identificadores de los chunks.
+
+        Returns:
+            dict: Identificador -> (contenido, metadatos).
+        """
+        ids = list(set(ids))
+        dataset = self._dataset()
+        if not ids or dataset is None:
+            return {}
+        table = dataset.to_table(filter=ds.field('chunk_id').isin(ids))
+        return {
+            i: (content, json.loads(metadata) if metadata is not None else None)
+            for i, content, metadata in zip(*(table.column(c).to_pylist() for c in ['chunk_id', 'content', 'metadata']))
+        }
+
+def _contents(contexts):
+    """
+    Separa una lista de contextos (textos, Document o diccionarios) en textos y metadatos.
+    """
+    contents, metadatas = [], []
+    for context in contexts:
+        if isinstance(context, str):
+            contents.append(context)
+            metadatas.append(None)
+        elif isinstance(context, dict):
+            contents.append(context['content'])
+            metadatas.append(context.get('metadata'))
+        else:
+            contents.append(context.page_content)
+            metadatas.append(context.metadata)
+    return contents, metadatas
+
+def write_artifact(df, path, chunk_table=None, export=()):
+    """
+    Guarda el resultado de una etapa como Parquet. Las columnas de contextos se guardan
+    como listas de identificadores de la tabla de chunks compartida.
+
+    Args:
+        df (DataFrame): Resultado de la etapa. Las columnas de contextos pueden contener
+            textos, objetos Document o diccionarios {'content', 'metadata'}.
+        path (str): Ruta del artefacto sin extensión.
+        chunk_table (ChunkTable): Tabla de chunks (por defecto, CHUNK_TABLE).
+        export (Iterable[str]): Vistas adicionales a generar: 'json' y/o 'csv'.
+    """
+    chunk_table = chunk_table or ChunkTable()
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    table_df = df.copy()
+    for column in CHUNK_COLUMNS:
+        if column in table_df.columns:
+            # Una sola alta en la tabla por artefacto (un único fichero Parquet nuevo)
+            rows = [_contents(contexts) for contexts in table_df[column]]
+            flat_ids = chunk_table.add([text for contents, _ in rows for text in contents],
+                                       [metadata for _, metadatas in rows for metadata in metadatas])
+            ids, start = [], 0
+            for contents, _ in rows:
+                ids.append(flat_ids[start:start + len(contents)])
+                start += len(contents)
+            # La columna de identificadores ocupa la posición de la original
+            loc = table_df.columns.get_loc(column)
+            table_df = table_df.drop(columns=column)
+            table_df.insert(loc, f'{column}_ids', ids)
+
+    table = pa.Table.from_pandas(table_df, preserve_index=False)
+    pq.write_table(table, f'{path}.parquet.tmp')
+    os.replace(f'{path}.parquet.tmp', f'{path}.parquet')
+
+    if export:
+        export_views(path, export, chunk_table)
+
+def read_artifact(path, columns=None, chunk_table=None, with_metadata=False):
+    """
+    Lee un artefacto. Solo se cargan las columnas pedidas y solo los chunks que referencian.
+    Si no existe la versión Parquet, se lee el CSV antiguo interpretando las listas.
+
+    Args:
+        path (str): Ruta del artefacto sin extensión.
+        columns (List[str]): Columnas a leer (por defecto, todas).
+        chunk_table (ChunkTable): Tabla de chunks (por defecto, CHUNK_TABLE).
+        with_metadata (bool): Si es True, los contextos se devuelven como diccionarios
+            {'content', 'metadata'} en lugar de textos.
+
+    Returns:
+        DataFrame: Datos del artefacto.
+    """
+    path = Path(path)
+    if not Path(f'{path}.parquet').exists():
+        return _read_csv(path, columns)
+
+    schema = pq.read_schema(f'{path}.parquet')
+    names = columns or [name.removesuffix('_ids') if name.removesuffix('_ids') in CHUNK_COLUMNS else name
+                        for name in schema.names]
+    stored = [f'{name}_ids' if name in CHUNK_COLUMNS else name for name in names]
+    table = pq.read_table(f'{path}.parquet', columns=stored, memory_map=True)
+    df = table.to_pandas()
+    # Las listas se devuelven como listas de Python, igual que en el CSV interpretado
+    for name in stored:
+        if pa.types.is_list(table.schema.field(name).type):
+            df[name] = table.column(name).to_pylist()
+
+    chunk_table = chunk_table or ChunkTable()
+    for name in names:
+        if name in CHUNK_COLUMNS:
+            ids = df.pop(f'{name}_ids')
+            chunks = chunk_table.get(i for row in ids for i in row)
+            if with_metadata:
+                df[name] = [[{'content': chunks[i][0], 'metadata': chunks[i][1]} for i in row] for row in ids]
+            else:
+                df[name] = [[chunks[i][0] for i in row] for row in ids]
+    return df[names]
+
+def _read_csv(path, columns=None):
+    """
+    Lee un artefacto en el formato CSV antiguo (listas guardadas como texto).
+    """
+    df = pd.read_csv(f'{path}.csv', usecols=columns)
+    df = df.drop(columns=[c for c in df.columns if c.startswith('Unnamed')])
+    for column in CHUNK_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].apply(literal_eval)
+    return df
+
+def list_artifacts(directory):
+    """
+    Devuelve las rutas (sin extensión) de los artefactos de una carpeta, en Parquet o CSV.
+    """
+    directory = Path(directory)
+    stems = {p.with_suffix('') for p in directory.glob('*.parquet')}
+    stems |= {p.with_suffix('') for p in directory.glob('*.csv')}
+    return sorted(stems)
+
+def export_views(path, formats=('json', 'csv'), chunk_table=None):
+    """
+    Genera las vistas legibles de un artefacto con el formato de los ficheros anteriores:
+    JSON con una entrada 'test_N' por fila y CSV con las listas de contextos como texto.
+
+    Args:
+        path (str): Ruta del artefacto sin extensión.
+        formats (Iterable[str]): 'json' y/o 'csv'.
+        chunk_table (ChunkTable): Tabla de chunks (por defecto, CHUNK_TABLE).
+    """
+    if 'json' in formats:
+        df = read_artifact(path, chunk_table=chunk_table, with_metadata=True)
+        for column in CHUNK_COLUMNS:
+            if column in df.columns:
+                df[column] = [
+                    [c if c['metadata'] is not None else c['content'] for c in contexts]
+                    for contexts in df[column]
+                ]
+        records = json.loads(df.to_json(orient='records', force_ascii=False))
+        with open(f'{path}.json', 'w', encoding='utf-8') as f:
+            json.dump({f'test_{i + 1}': entry for i, entry in enumerate(records)}, f, ensure_ascii=False, indent=4)
+
+    if 'csv' in formats:
+        read_artifact(path, chunk_table=chunk_table).to_csv(f'{path}.csv', index=False)
+
+def convert_directory(directory, chunk_table=None):
+    """
+    Convierte los artefactos CSV de una carpeta al formato Parquet. Si existe el JSON
+    correspondiente con metadatos de los contextos, estos se guardan en la tabla de chunks.
+    """
+    chunk_table = chunk_table or ChunkTable()
+    for path in list_artifacts(directory):
+        if Path(f'{path}.parquet').exists():
+            continue
+        df = _read_csv(path)
+
+        json_path = Path(f'{path}.json')
+        if json_path.exists():
+            with open(json_path, encoding='utf-8') as f:
+                entries = list(json.load(f).values())
+            # Los JSON de recuperación guardan cada contexto con sus metadatos
+            if len(entries) == len(df) and all(isinstance(c, dict) for e in entries for c in e.get('retrieved_contexts', [])):
+                df['retrieved_contexts'] = [e['retrieved_contexts'] for e in entries]
+            for column in ['query', 'id_context']:
+                if column not in df.columns and len(entries) == len(df) and all(column in e for e in entries):
+                    df[column] = [e[column] for e in entries]
+
+        write_artifact(df, path, chunk_table)
+        print(f'Convertido: {path}.parquet')
+
+if __name__ == '__main__':
+    # Conversión de los resultados existentes al formato Parquet
+    for directory in ['faiss_contexts', 'reranking', 'llm_responses']:
+        if Path(directory).exists():
+            convert_directory(directory)
@@ -0,0 +1,157 @@
+import sys
+sys.path.append("../prototype/llm_agent")
+from langchain_huggingface import HuggingFaceEmbeddings
+from embedding_cache import CachedEmbeddings
+from vector_store import load_store, RefinedIndex, VECTORS_FILE
+from faiss_indexes import INDEX_CONFIGS, create_index, resolve_config
+import pandas as pd
+import numpy as np
+import tempfile
+import faiss
+import time
+import os
+
+def measure_index(index, queries, ground_truth, k, repeats=5):
+    """
+    Mide recall@k, latencia por consulta y rendimiento en lote de un índice.
+
+    Args:
+        index (faiss.Index): Índice a evaluar.
+        queries (np.ndarray): Embeddings de las preguntas.
+        ground_truth (np.ndarray): Resultados exactos del índice plano (n_queries x k).
+        k (int): Número de documentos recuperados.
+        repeats (int): Repeticiones de cada consulta para estabilizar la latencia.
+
+    Returns:
+        dict: Métricas obtenidas.
+    """
+    # Calentamiento
+    index.search(queries[:1], k)
+
+    latencies = []
+    for _ in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query[None, :], k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    _, indices = index.search(queries, k)
+    batch_time = time.perf_counter() - start
+
+    recall = np.mean([
+        len(set(found) & set(expected)) / k
+        for found, expected in zip(indices, ground_truth)
+    ])
+
+    return {
+        "recall": round(float(recall), 5),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 4),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 4),
+        "qps_batch": round(len(queries) / batch_time, 1),
+        # Memoria del índice; los vectores originales de 'refine' se leen de disco y no se cuentan
+        "memory_mb": round(faiss.serialize_index(index.index if isinstance(index, RefinedIndex) else index).nbytes
+                           / 2 ** 20, 3),
+    }
+
+if __name__ == '__main__':
+    csv_files = {
+        "full": "data/preguntas_wikipedia_jaen_full.csv",
+        "512": "data/preguntas_wikipedia_jaen_512.csv",
+        "1024": "data/preguntas_wikipedia_jaen_1024.csv",
+    }
+
+    model_list = [
+        ['minilm', 'paraphrase-multilingual-MiniLM-L12-v2'],
+        ['mpnet', 'paraphrase-multilingual-mpnet-base-v2']
+    ]
+    size_list = ["full", "512", "1024"]
+    k_list = [5, 10, 20]
+
+    # Variantes evaluadas frente al índice plano de referencia
+    benchmark_configs = [
+        ['flat_ip', INDEX_CONFIGS['flat_ip']],
+        ['hnsw_ef32', {**INDEX_CONFIGS['hnsw'], 'ef_search': 32}],
+        ['hnsw_ef64', INDEX_CONFIGS['hnsw']],
+        ['hnsw_ef128', {**INDEX_CONFIGS['hnsw'], 'ef_search': 128}],
+        ['ivf_nprobe4', {**INDEX_CONFIGS['ivf'], 'nprobe': 4}],
+        ['ivf_nprobe16', INDEX_CONFIGS['ivf']],
+        ['ivf_nprobe64', {**INDEX_CONFIGS['ivf'], 'nprobe': 64}],
+        # Índices comprimidos, sin y con reordenación con los vectores originales leídos de disco
+        ['sq_fp16', INDEX_CONFIGS['sq_fp16']],
+        ['sq8', INDEX_CONFIGS['sq8']],
+        ['sq8_refine2', {**INDEX_CONFIGS['sq8'], 'refine': 2}],
+        ['pq', INDEX_CONFIGS['pq']],
+        ['pq_refine4', {**INDEX_CONFIGS['pq'], 'refine': 4}],
+        ['pq_refine10', {**INDEX_CONFIGS['pq'], 'refine': 10}],
+        ['pca128', {**INDEX_CONFIGS['pca'], 'dim': 128}],
+        ['pca256', INDEX_CONFIGS['pca']],
+        ['pca256_refine4', {**INDEX_CONFIGS['pca'], 'refine': 4}],
+        ['pca256_sq8', {**INDEX_CONFIGS['pca'], 'base': 'sq8'}],
+        ['pca256_sq8_refine4', {**INDEX_CONFIGS['pca'], 'base': 'sq8', 'refine': 4}],
+    ]
+
+    results = []
+
+    for model_name, model_path in model_list:
+        model_kwargs = {'device': 'cuda'}
+        encode_kwargs = {'normalize_embeddings': True}
+        embed_model = HuggingFaceEmbeddings(
+            model_name=f'sentence-transformers/{model_path}',  # Ruta sustituida
+            model_kwargs=model_kwargs,
+            encode_kwargs=encode_kwargs,
+        )
+        embed_model = CachedEmbeddings(embed_model)  # Caché de embeddings en disco
+
+        for size in size_list:
+            # El índice plano ya construido sirve de referencia y de fuente de vectores
+            persist_dir = f"storage/faiss_index_{model_name}_{size}"
+            vectorstore = load_store(persist_dir, embed_model)
+            flat_index = vectorstore.index
+            vectors = flat_index.reconstruct_n(0, flat_index.ntotal)
+
+            questions = pd.read_csv(csv_files[size])['question'].tolist()
+            queries = np.asarray(embed_model.embed_documents(questions), dtype=np.float32)
+
+            ground_truth = {k: flat_index.search(queries, k)[1] for k in k_list}
+
+            for k in k_list:
+                results.append({
+                    "model": model_name, "size": size, "index": "flat", "k": k,
+                    "build_s": 0.0, **measure_index(flat_index, queries, ground_truth[k], k)
+                })
+
+            # Vectores originales en disco, como los guarda StoreWriter para los índices con 'refine'.
+            # Se escriben en cada ejecución en una carpeta temporal, a partir del índice actual
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                vectors_path = os.path.join(tmp_dir, VECTORS_FILE)
+                np.ascontiguousarray(vectors, dtype=np.float32).tofile(vectors_path)
+
+                for index_name, config in benchmark_configs:
+                    config = resolve_config(config, len(vectors), vectors.shape[1])
+
+                    start = time.perf_counter()
+                    index = create_index(config, vectors.shape[1], train_vectors=vectors)
+                    index.add(vectors)
+                    build_time = time.perf_counter() - start
+                    if config.get('refine'):
+                        index = RefinedIndex(index, vectors_path, config['refine'])
+
+                    for k in k_list:
+                        results.append({
+                            "model": model_name, "size": size, "index": index_name, "k": k,
+                            "build_s": round(build_time, 3), **measure_index(index, queries, ground_truth[k], k)
+                        })
+                    print(f'COMPLETADO: {model_name} {size} {index_name}')
+                    del index
+
+    os.makedirs("stats", exist_ok=True)
+    results_df = pd.DataFrame(results)
+    # Memoria relativa al índice plano del mismo modelo y tamaño de chunk
+    flat_memory = results_df[results_df['index'] == 'flat'].groupby(['model', 'size'])['memory_mb'].first()
+    results_df['memory_ratio'] = (
+        results_df['memory_mb'] / results_df.set_index(['model', 'size']).index.map(flat_memory)
+    ).round(4)
+    results_df.to_csv("stats/index_benchmark.csv", index=False)
+    print(results_df)
@@ -0,0 +1,405 @@
+import sys
+sys.path.append("../prototype/llm_agent")
+from langchain_huggingface import HuggingFaceEmbeddings
+from sentence_transformers import CrossEncoder
+from vector_store import load_store
+from bm25_index import BM25Index
+from retriever import Retriever
+from prefetch import RetrievalCache
+from context_metrics import context_scores, PRECISION, RECALL
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import multiprocessing
+import pandas as pd
+import numpy as np
+import argparse
+import platform
+import resource
+import hashlib
+import json
+import time
+import re
+import os
+
+# Modelos de embeddings de cada almacén (el nombre de la carpeta indica cuál se usó)
+MODELS = {
+    'minilm': 'paraphrase-multilingual-MiniLM-L12-v2',
+    'mpnet': 'paraphrase-multilingual-mpnet-base-v2'
+}
+
+RERANKER = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+# Etapas medidas por separado, en orden de ejecución
+STAGES = ['embed', 'search', 'fetch', 'rerank']
+
+BASELINE_FILE = 'stats/retrieval_baseline.json'
+OUTPUT_FILE = 'stats/retrieval_benchmark.json'
+
+# Efecto de la caché semántica en la calidad (--cache-quality). prototype/llm_agent/tools.py
+# solo activa un umbral (CACHE_THRESHOLD) si estos resultados con MPNet no muestran pérdidas
+CACHE_QUALITY_FILE = 'stats/cache_quality.csv'
+
+# Umbrales de similitud de la caché semántica cuyo efecto en la calidad se mide (--cache-quality)
+CACHE_THRESHOLDS = [0.8, 0.85, 0.9, 0.95]
+
+STORE_PATTERN = re.compile(r'faiss_index_(?P<model>[a-z]+)_(?P<size>full|\d+)(?:_(?P<index>\w+))?$')
+
+def current_rss_mb():
+    """Memoria residente actual del proceso (Linux), o NaN si no se puede leer."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return float('nan')
+
+def peak_rss_mb():
+    """
+    Pico de memoria residente del proceso desde su inicio. Nunca disminuye, por lo que
+    solo describe un almacén si este se mide en un proceso propio (ver run_benchmark).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return peak / 2 ** 20 if platform.system() == 'Darwin' else peak / 2 ** 10
+
+def summarize(latencies):
+    """
+    Resume una lista de latencias en milisegundos.
+
+    Returns:
+        dict: Media y percentiles 50, 95 y 99.
+    """
+    values = np.asarray(latencies, dtype=np.float64)
+    return {
+        'mean_ms': round(float(values.mean()), 4),
+        'p50_ms': round(float(np.percentile(values, 50)), 4),
+        'p95_ms': round(float(np.percentile(values, 95)), 4),
+        'p99_ms': round(float(np.percentile(values, 99)), 4),
+    }
+
+def time_query(retriever, query):
+    """
+    Ejecuta la recuperación de una consulta midiendo cada etapa.
+
+    Returns:
+        Tuple[dict, list]: Milisegundos por etapa e identificadores de los documentos devueltos.
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    embedding = retriever.embed(query)
+    timings['embed'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ids = retriever.search(query, embedding)
+    timings['search'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ids, texts, _ = retriever.fetch(ids)
+    timings['fetch'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    order = retriever.rerank(query, texts)
+    timings['rerank'] = time.perf_counter() - start
+
+    return {stage: seconds * 1000 for stage, seconds in timings.items()}, [ids[i] for i in order]
+
+def benchmark_store(retriever, questions, warmup=3, repeats=5):
+    """
+    Mide las etapas de la recuperación sobre todas las preguntas de un almacén.
+
+    Args:
+        retriever (Retriever): Recuperador del almacén.
+        questions (List[str]): Preguntas de evaluación.
+        warmup (int): Consultas iniciales que no se miden (carga perezosa, cachés).
+        repeats (int): Pasadas completas sobre las preguntas.
+
+    Returns:
+        dict: Percentiles por etapa y en total, memoria y huella de los resultados.
+    """
+    for query in questions[:warmup]:
+        retriever.retrieve(query)
+
+    latencies = {stage: [] for stage in STAGES + ['total']}
+    results = {}
+    for _ in range(repeats):
+        for query in questions:
+            timings, top_ids = time_query(retriever, query)
+            for stage, ms in timings.items():
+                latencies[stage].append(ms)
+            latencies['total'].append(sum(timings.values()))
+            results[query] = top_ids
+
+    # Huella de los documentos devueltos: cambia si la recuperación deja de dar los mismos resultados
+    digest = hashlib.sha256(json.dumps([results[q] for q in questions]).encode('utf-8')).hexdigest()
+
+    return {
+        'queries': len(questions) * repeats,
+        'stages': {stage: summarize(values) for stage, values in latencies.items()},
+        'rss_mb': round(current_rss_mb(), 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'results_digest': digest,
+        'top_ids': {q: results[q] for q in questions},
+    }
+
+def cache_quality(retriever, questions, reference_contexts, thresholds=CACHE_THRESHOLDS):
+    """
+    Mide el efecto en la calidad de reutilizar resultados con la caché semántica
+    (prefetch.RetrievalCache). Las preguntas se hacen en orden con una caché por umbral:
+    una pregunta cuyo embedding se parece lo suficiente al de una anterior recibe los
+    resultados de aquella. Se comparan con la recuperación sin caché mediante la
+    precisión y el recall de contexto sin LLM (context_metrics.py).
+
+    Args:
+        retriever (Retriever): Recuperador sin caché.
+        questions (List[str]): Preguntas de evaluación.
+        reference_contexts (List[str]): Contexto de referencia de cada pregunta.
+        thresholds (List[float]): Umbrales de similitud a evaluar.
+
+    Returns:
+        List[dict]: Por umbral, aciertos de la caché y métricas con y sin ella (en todas
+            las preguntas y solo en las servidas desde la caché).
+    """
+    embeddings = [retriever.embed(q) for q in questions]
+    fresh = [retriever.retrieve(q) for q in questions]
+    references = [[text] for text in reference_contexts]
+    fresh_scores = context_scores(fresh, references)
+
+    rows = []
+    for threshold in thresholds:
+        cache = RetrievalCache(max_entries=len(questions) + 1, threshold=threshold)
+        served, hits = [], []
+        for query, embedding, results in zip(questions, embeddings, fresh):
+            cached, _ = cache.lookup(query, lambda: embedding)
+            hits.append(cached is not None)
+            if cached is None:
+                cache.put(query, embedding, results)
+            served.append(cached if cached is not None else results)
+
+        cached_scores = context_scores(served, references)
+        hit_rows = np.asarray(hits)
+        row = {'threshold': threshold, 'hits': int(hit_rows.sum()), 'hit_rate': round(float(hit_rows.mean()), 4)}
+        for metric, name in [(PRECISION, 'precision'), (RECALL, 'recall')]:
+            row[f'{name}_fresh'] = round(float(fresh_scores[metric].mean()), 4)
+            row[f'{name}_cached'] = round(float(cached_scores[metric].mean()), 4)
+            # Efecto en las preguntas servidas desde la caché (el resto no cambia)
+            row[f'{name}_hits_fresh'] = round(float(fresh_scores[metric][hit_rows].mean()), 4) if hit_rows.any() else None
+            row[f'{name}_hits_cached'] = round(float(cached_scores[metric][hit_rows].mean()), 4) if hit_rows.any() else None
+        rows.append(row)
+    return rows
+
+def compare(current, baseline, tolerance=0.10, min_delta_ms=0.5, memory_tolerance=0.10):
+    """
+    Compara un benchmark con la línea base. Una etapa empeora si su p50 o su p95 crece
+    más de la tolerancia relativa y además más de min_delta_ms (para no reaccionar al
+    ruido de las etapas muy rápidas).
+
+    Args:
+        current (dict): Resultados actuales (salida de run_benchmark).
+        baseline (dict): Resultados de referencia con el mismo formato.
+        tolerance (float): Aumento relativo de latencia permitido.
+        min_delta_ms (float): Aumento absoluto mínimo para considerar una regresión.
+        memory_tolerance (float): Aumento relativo permitido de la memoria.
+
+    Returns:
+        DataFrame: Una fila por almacén y métrica con el cambio y si es una regresión.
+    """
+    rows = []
+    for store, result in current['stores'].items():
+        base = baseline.get('stores', {}).get(store)
+        if base is None:
+            continue
+
+        for stage, stats in result['stages'].items():
+            if stage not in base['stages']:
+                continue
+            for metric in ['p50_ms', 'p95_ms']:
+                new, old = stats[metric], base['stages'][stage][metric]
+                rows.append({
+                    'store': store, 'metric': f'{stage}_{metric}', 'baseline': old, 'current': new,
+                    'change': round(new / old - 1, 4) if old else np.nan,
+                    'regression': new > old * (1 + tolerance) and new - old > min_delta_ms,
+                })
+
+        # Las líneas base anteriores no incluyen la memoria atribuible al almacén
+        for metric in ['peak_rss_mb', 'store_rss_mb']:
+            if metric not in result or metric not in base:
+                continue
+            new, old = result[metric], base[metric]
+            rows.append({
+                'store': store, 'metric': metric, 'baseline': old, 'current': new,
+                'change': round(new / old - 1, 4) if old else np.nan,
+                'regression': new > old * (1 + memory_tolerance),
+            })
+
+        # Los resultados distintos no son una regresión de rendimiento, pero se indican
+        overlap = np.mean([
+            len(set(ids) & set(base['top_ids'].get(q, []))) / max(len(ids), 1)
+            for q, ids in result['top_ids'].items()
+        ])
+        rows.append({
+            'store': store, 'metric': 'top_k_overlap', 'baseline': 1.0, 'current': round(float(overlap), 4),
+            'change': round(float(overlap) - 1, 4), 'regression': False,
+        })
+    return pd.DataFrame(rows, columns=['store', 'metric', 'baseline', 'current', 'change', 'regression'])
+
+def measure_store(persist_dir, model_name, size, device='cpu', warmup=3, repeats=5, models=None,
+                  cache_thresholds=None):
+    """
+    Carga un almacén con sus modelos y mide su recuperación.
+
+    Args:
+        persist_dir (str): Carpeta del almacén.
+        model_name (str): Clave del modelo de embeddings (ver MODELS).
+        size (str): Tamaño de chunk, que indica el fichero de preguntas.
+        device (str): Dispositivo de los modelos.
+        warmup (int): Consultas de calentamiento.
+        repeats (int): Pasadas sobre las preguntas.
+        models (dict): Modelos ya cargados que se reutilizan entre almacenes (opcional).
+        cache_thresholds (List[float]): Umbrales de la caché semántica cuyo efecto en la
+            calidad se mide (ver cache_quality); None para no medirlo.
+
+    Returns:
+        dict: Resultados de benchmark_store con la memoria atribuible al almacén.
+    """
+    models = {} if models is None else models
+    if 'reranker' not in models:
+        models['reranker'] = CrossEncoder(RERANKER, device=device)
+    if model_name not in models:
+        models[model_name] = HuggingFaceEmbeddings(
+            model_name=f'sentence-transformers/{MODELS[model_name]}',  # Ruta sustituida
+            model_kwargs={'device': device},
+            encode_kwargs={'normalize_embeddings': True},
+        )
+    embed_model = models[model_name]
+
+    # Memoria del almacén: diferencia de memoria residente entre antes de cargarlo y el final de las consultas
+    rss_before = current_rss_mb()
+    vector_store = load_store(persist_dir, embed_model)
+    bm25_index = BM25Index.load(persist_dir) if BM25Index.exists(persist_dir) else None
+    retriever = Retriever(vector_store, embed_model, models['reranker'], bm25_index)
+
+    questions_df = pd.read_csv(f'data/preguntas_wikipedia_jaen_{size}.csv')
+    questions = questions_df['question'].tolist()
+    result = benchmark_store(retriever, questions, warmup, repeats)
+    result['store_rss_mb'] = round(current_rss_mb() - rss_before, 1)
+    if cache_thresholds:
+        result['cache_quality'] = cache_quality(retriever, questions,
+                                                questions_df['reference_contexts'].fillna('').tolist(),
+                                                cache_thresholds)
+    result['model'], result['size'], result['bm25'] = model_name, size, bm25_index is not None
+    return result
+
+def run_benchmark(storage_dir, stores=None, device='cpu', warmup=3, repeats=5, isolate=True,
+                  cache_thresholds=None):
+    """
+    Ejecuta el benchmark sobre todos los almacenes de una carpeta. Por defecto cada almacén
+    se mide en un proceso nuevo, de modo que su pico de memoria no incluye el de los
+    almacenes anteriores.
+
+    Args:
+        storage_dir (str): Carpeta con los almacenes (faiss_index_{modelo}_{tamaño}[_{tipo}]).
+        stores (List[str]): Nombres de los almacenes a medir (por defecto, todos).
+        device (str): Dispositivo de los modelos (el agente usa 'cpu').
+        warmup (int): Consultas de calentamiento por almacén.
+        repeats (int): Pasadas sobre las preguntas por almacén.
+        isolate (bool): Medir cada almacén en su propio proceso. Si es False los modelos se
+            cargan una vez y peak_rss_mb es el pico acumulado de todos los almacenes medidos.
+        cache_thresholds (List[float]): Umbrales de la caché semántica a evaluar (ver cache_quality).
+
+    Returns:
+        dict: Metadatos de la ejecución y resultados por almacén.
+    """
+    models = {}
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'device': device,
+            'warmup': warmup,
+            'repeats': repeats,
+            'isolated': isolate,
+        },
+        'stores': {},
+    }
+
+    for persist_dir in sorted(Path(storage_dir).iterdir()):
+        match = STORE_PATTERN.match(persist_dir.name)
+        if not match or (stores and persist_dir.name not in stores):
+            continue
+        args = (str(persist_dir), match['model'], match['size'], device, warmup, repeats)
+        kwargs = {'cache_thresholds': cache_thresholds}
+
+        try:
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(measure_store, *args, **kwargs).result()
+            else:
+                result = measure_store(*args, models=models, **kwargs)
+        except FileNotFoundError as e:
+            print(f'OMITIDO: {persist_dir.name} ({e})')
+            continue
+        report['stores'][persist_dir.name] = result
+
+        total = result['stages']['total']
+        print(f"COMPLETADO: {persist_dir.name} (p50 {total['p50_ms']:.1f} ms, p95 {total['p95_ms']:.1f} ms, "
+              f"pico de memoria {result['peak_rss_mb']:.0f} MB, almacén {result['store_rss_mb']:.0f} MB)")
+    return report
+
+def save_json(data, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark por etapas de la recuperación del agente.")
+    parser.add_argument("--storage", default="storage", help="Carpeta de los almacenes.")
+    parser.add_argument("--stores", nargs='+', help="Almacenes a medir (por defecto, todos).")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-isolate", action="store_true",
+                        help="Medir todos los almacenes en este proceso (más rápido, pero el pico de memoria es acumulado).")
+    parser.add_argument("--cache-quality", nargs='*', type=float, metavar="UMBRAL",
+                        help=f"Medir el efecto en la calidad de la caché semántica (por defecto con {CACHE_THRESHOLDS}).")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar el resultado como nueva línea base.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Aumento relativo de latencia permitido.")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Aumento absoluto mínimo de una regresión.")
+    args = parser.parse_args()
+
+    cache_thresholds = None if args.cache_quality is None else (args.cache_quality or CACHE_THRESHOLDS)
+    report = run_benchmark(args.storage, args.stores, args.device, args.warmup, args.repeats, not args.no_isolate,
+                           cache_thresholds)
+    save_json(report, args.output)
+    print(f'Resultados guardados en {args.output}')
+
+    if cache_thresholds:
+        quality = pd.DataFrame([
+            {'store': store, **row}
+            for store, result in report['stores'].items()
+            for row in result.get('cache_quality', [])
+        ])
+        print(quality.to_string(index=False))
+        quality.to_csv(CACHE_QUALITY_FILE, index=False)
+        print(f'Efecto de la caché en la calidad guardado en {CACHE_QUALITY_FILE}')
+
+    if args.save_baseline:
+        save_json(report, args.baseline)
+        print(f'Línea base actualizada en {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        comparison = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        print(comparison.to_string(index=False))
+
+        # Puerta de regresión: código de salida distinto de cero si alguna métrica empeora
+        regressions = comparison[comparison['regression']]
+        if not regressions.empty:
+            print(f'REGRESIÓN: {len(regressions)} métricas empeoran respecto a la línea base')
+            sys.exit(1)
+        print('Sin regresiones respecto a la línea base')
+    else:
+        print(f'No existe la línea base {args.baseline}; use --save-baseline para crearla')
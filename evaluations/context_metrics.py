@@ -0,0 +1,139 @@
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+from artifacts import ChunkTable, list_artifacts, read_artifact
+from pathlib import Path
+import pandas as pd
+import numpy as np
+
+# Nombres de las métricas, iguales a los de RAGAS para mantener el formato de los resultados
+PRECISION = 'non_llm_context_precision_with_reference'
+RECALL = 'non_llm_context_recall'
+
+def similarity_tensor(retrieved_contexts, reference_contexts, workers=-1):
+    """
+    Calcula la similitud de Levenshtein normalizada entre cada contexto recuperado y cada
+    contexto de referencia de todas las preguntas. Las cadenas se comparan en bloque: una
+    llamada a rapidfuzz por referencia distinta, con todos los contextos que la acompañan.
+
+    Args:
+        retrieved_contexts (List[List[str]]): Contextos recuperados de cada pregunta.
+        reference_contexts (List[List[str]]): Contextos de referencia de cada pregunta.
+        workers (int): Hilos de rapidfuzz (-1 para usar todos los núcleos).
+
+    Returns:
+        np.ndarray: Tensor Q x R x F con NaN donde no hay contexto (R recuperados, F referencias).
+    """
+    n_retrieved = max((len(c) for c in retrieved_contexts), default=0)
+    n_reference = max((len(c) for c in reference_contexts), default=0)
+    sim = np.full((len(retrieved_contexts), n_retrieved, n_reference), np.nan)
+
+    # Agrupar los contextos recuperados por referencia para compararlos sin duplicados
+    groups = {}
+    for q, (retrieved, references) in enumerate(zip(retrieved_contexts, reference_contexts)):
+        for j, reference in enumerate(references):
+            groups.setdefault(reference, {}).setdefault((q, j), retrieved)
+
+    for reference, targets in groups.items():
+        unique = list(dict.fromkeys(c for retrieved in targets.values() for c in retrieved))
+        # Los contextos van en las filas: rapidfuzz reparte las filas entre los hilos
+        scores = process.cdist(unique, [reference], scorer=Levenshtein.normalized_similarity,
+                               dtype=np.float64, workers=workers)[:, 0]
+        position = {c: i for i, c in enumerate(unique)}
+        for (q, j), retrieved in targets.items():
+            sim[q, :len(retrieved), j] = scores[[position[c] for c in retrieved]]
+    return sim
+
+def context_scores(retrieved_contexts, reference_contexts, threshold=0.5, workers=-1):
+    """
+    Calcula la precisión y el recall de contexto sin LLM con la misma definición que
+    NonLLMContextPrecisionWithReference y NonLLMContextRecall de RAGAS.
+
+    - Precisión: cada contexto recuperado es relevante si su mayor similitud con alguna
+      referencia es >= threshold; se devuelve la precisión media (average precision).
+    - Recall: fracción de referencias cuya mayor similitud con algún contexto recuperado
+      es > threshold.
+
+    Args:
+        retrieved_contexts (List[List[str]]): Contextos recuperados de cada pregunta.
+        reference_contexts (List[List[str]]): Contextos de referencia de cada pregunta.
+        threshold (float): Umbral de similitud.
+        workers (int): Hilos de rapidfuzz.
+
+    Returns:
+        DataFrame: Una fila por pregunta con ambas métricas (NaN si faltan contextos).
+    """
+    retrieved_contexts = [list(c) for c in retrieved_contexts]
+    reference_contexts = [list(c) for c in reference_contexts]
+    sim = similarity_tensor(retrieved_contexts, reference_contexts, workers)
+
+    n_retrieved = np.array([len(c) for c in retrieved_contexts])
+    n_reference = np.array([len(c) for c in reference_contexts])
+    valid = (n_retrieved > 0) & (n_reference > 0)
+
+    with np.errstate(invalid='ignore'):
+        filled = np.where(np.isnan(sim), -np.inf, sim)
+
+        # Precisión media sobre los veredictos de cada posición del ranking
+        verdicts = (filled.max(axis=2, initial=-np.inf) >= threshold).astype(np.float64)
+        ranks = np.arange(1, verdicts.shape[1] + 1)
+        numerator = (np.cumsum(verdicts, axis=1) / ranks * verdicts).sum(axis=1)
+        precision = numerator / (verdicts.sum(axis=1) + 1e-10)
+
+        # Recall sobre las referencias existentes
+        found = filled.max(axis=1, initial=-np.inf) > threshold
+        mask = np.arange(sim.shape[2]) < n_reference[:, None]
+        recall = (found & mask).sum(axis=1) / np.maximum(n_reference, 1)
+
+    return pd.DataFrame({
+        PRECISION: np.where(valid, precision, np.nan),
+        RECALL: np.where(valid, recall, np.nan),
+    })
+
+def check_parity(input_dir, evaluated_dir, n_rows=24, chunk_table=None):
+    """
+    Compara las métricas calculadas con las guardadas por la evaluación con RAGAS.
+
+    Args:
+        input_dir (str): Carpeta de artefactos de contextos.
+        evaluated_dir (str): Carpeta con las métricas de RAGAS (CSV con decimal "'").
+        n_rows (int): Preguntas evaluadas de cada fichero.
+
+    Returns:
+        DataFrame: Diferencia máxima por fichero y métrica.
+    """
+    chunk_table = chunk_table or ChunkTable()
+    paths = [p for p in list_artifacts(input_dir) if (Path(evaluated_dir) / f'{p.name}.csv').exists()]
+    dfs = [
+        read_artifact(p, columns=['retrieved_contexts', 'reference_contexts'], chunk_table=chunk_table).iloc[:n_rows]
+        for p in paths
+    ]
+    if not dfs:
+        return pd.DataFrame(columns=['file', PRECISION, RECALL])
+
+    # Todas las preguntas de todos los ficheros se puntúan en una sola pasada
+    df = pd.concat(dfs, ignore_index=True)
+    references = df['reference_contexts'].fillna("").apply(lambda text: [text])
+    scores = context_scores(df['retrieved_contexts'], references).round(5)
+    offsets = np.cumsum([0] + [len(d) for d in dfs])
+
+    rows = []
+    for path, start, end in zip(paths, offsets[:-1], offsets[1:]):
+        expected = pd.read_csv(Path(evaluated_dir) / f'{path.name}.csv', decimal="'")
+        row = {'file': path.name}
+        for metric in [PRECISION, RECALL]:
+            computed = scores[metric].to_numpy()[start:end]
+            stored = expected[metric].to_numpy(dtype=np.float64)
+            diff = np.abs(computed - stored)
+            diff[np.isnan(computed) != np.isnan(stored)] = 1.0  # NaN en solo uno de los dos
+            row[metric] = float(np.nanmax(diff, initial=0.0))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+if __name__ == '__main__':
+    # Comprobación de paridad con los resultados guardados de RAGAS
+    for input_dir, evaluated_dir in [('faiss_contexts', 'faiss_evaluated'), ('reranking', 'reranking_evaluated')]:
+        report = check_parity(input_dir, evaluated_dir)
+        mismatches = report[(report[PRECISION] > 1e-5) | (report[RECALL] > 1e-5)]
+        print(f'{evaluated_dir}: {len(report)} ficheros comparados, {len(mismatches)} con diferencias')
+        if not mismatches.empty:
+            print(mismatches.to_string(index=False))
@@ -1,126 +1,250 @@
 import pandas as pd
+import numpy as np
 import nltk
 import matplotlib.pyplot as plt
 import seaborn as sns
 from transformers import AutoTokenizer
 from nltk.tokenize import word_tokenize
-
-# Descargar recursos de NLTK si no están disponibles
-nltk.download("punkt")
-
-# Cargar el dataset generado desde Wikipedia
-df = pd.read_csv("data/wikipedia_jaen.csv")  # Alternativamente: pd.read_parquet("dataset.parquet")
-
-# Rellenar valores nulos en el contenido
-df["content"] = df["content"].fillna("")
-
-# Tokenización con NLTK
-df["num_tokens_nltk"] = df["content"].apply(lambda x: len(word_tokenize(str(x))))
-
-# Tokenización con modelos de Hugging Face (MPNet y MiniLM)
-mpnet_tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
-df["num_tokens_mpnet"] = df["content"].apply(lambda x: len(mpnet_tokenizer.tokenize(x)))
-
-minilm_tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-df["num_tokens_minilm"] = df["content"].apply(lambda x: len(minilm_tokenizer.tokenize(x)))
-
-# Función para calcular estadísticas descriptivas de una columna
-def calcular_estadisticas(columna, name):
-    return pd.DataFrame([{
-        "Nombre": name,
-        "Moda": columna.mode()[0] if not columna.mode().empty else None,
-        "Media": columna.mean(),
-        "Mediana": columna.median(),
-        "Mínimo": columna.min(),
-        "Máximo": columna.max(),
-        "Desviación estándar": columna.std(),
-        "Varianza": columna.var(),
-        "Cuartil 1 (Q1)": columna.quantile(0.25),
-        "Cuartil 2 (Q2 - Mediana)": columna.quantile(0.50),
-        "Cuartil 3 (Q3)": columna.quantile(0.75),
-        "Percentil 5%": columna.quantile(0.05),
-        "Percentil 95%": columna.quantile(0.95),
-    }])
-
-# Eliminar valores atípicos usando IQR
-def filtrar_outliers(columna):
-    q1 = columna.quantile(0.25)
-    q3 = columna.quantile(0.75)
+from multiprocessing import Pool
+import os
+
+# Tokenizadores de los modelos de embeddings evaluados
+TOKENIZERS = {
+    'mpnet': 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2',
+    'minilm': 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2',
+}
+
+# Recuento de tokens por artículo, reutilizable por el troceado y la indexación
+TOKEN_COUNTS_FILE = 'stats/token_counts.csv'
+
+# Longitud máxima de entrada de los modelos de sentence-transformers evaluados
+MAX_SEQ_LENGTH = 128
+
+# Nombre de cada recuento en las tablas y gráficas
+COLUMN_NAMES = {
+    'num_tokens_nltk': 'NLTK',
+    'num_tokens_mpnet': 'MPNet',
+    'num_tokens_minilm': 'MiniLM',
+}
+
+def _count_words(text):
+    return len(word_tokenize(text))
+
+def count_words(texts, n_process=1):
+    """
+    Cuenta las palabras de cada texto con NLTK, opcionalmente en varios procesos.
+
+    Args:
+        texts (List[str]): Textos a tokenizar.
+        n_process (int): Número de procesos.
+
+    Returns:
+        np.ndarray: Número de palabras por texto.
+    """
+    if n_process > 1:
+        with Pool(n_process) as pool:
+            counts = pool.map(_count_words, texts, chunksize=64)
+    else:
+        counts = [_count_words(text) for text in texts]
+    return np.asarray(counts, dtype=np.int64)
+
+def count_tokens(texts, tokenizer, batch_size=256):
+    """
+    Cuenta los tokens de cada texto con llamadas por lotes al tokenizador rápido.
+    No se añaden tokens especiales, igual que con tokenizer.tokenize.
+
+    Args:
+        texts (List[str]): Textos a tokenizar.
+        tokenizer: Tokenizador de Hugging Face.
+        batch_size (int): Textos por llamada.
+
+    Returns:
+        np.ndarray: Número de tokens por texto.
+    """
+    counts = []
+    for start in range(0, len(texts), batch_size):
+        encoded = tokenizer(
+            texts[start:start + batch_size],
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+            verbose=False,
+        )
+        counts.extend(len(ids) for ids in encoded['input_ids'])
+    return np.asarray(counts, dtype=np.int64)
+
+def compute_token_counts(df, tokenizers, n_process=1):
+    """
+    Calcula el número de caracteres, palabras y tokens de cada artículo.
+
+    Args:
+        df (DataFrame): Artículos con columnas 'title' y 'content'.
+        tokenizers (dict): Nombre del modelo -> tokenizador.
+        n_process (int): Procesos para la tokenización con NLTK.
+
+    Returns:
+        DataFrame: Recuentos por artículo, con el mismo id que los documentos indexados.
+    """
+    texts = df['content'].fillna('').astype(str).tolist()
+    counts = pd.DataFrame({
+        'id': np.arange(1, len(df) + 1),
+        'title': df['title'].tolist(),
+        'num_chars': [len(text) for text in texts],
+        'num_tokens_nltk': count_words(texts, n_process),
+    })
+    for name, tokenizer in tokenizers.items():
+        counts[f'num_tokens_{name}'] = count_tokens(texts, tokenizer)
+    return counts
+
+def save_token_counts(counts, path=TOKEN_COUNTS_FILE):
+    counts.to_csv(path, index=False)
+
+def load_token_counts(path=TOKEN_COUNTS_FILE):
+    """
+    Carga los recuentos de tokens por artículo, o None si aún no se han calculado.
+    """
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path)
+
+def filtrar_outliers(counts):
+    """
+    Sustituye por NaN los valores atípicos de cada columna según el criterio IQR.
+    """
+    q1 = counts.quantile(0.25)
+    q3 = counts.quantile(0.75)
     iqr = q3 - q1
-    return columna[(columna >= q1 - 1.5 * iqr) & (columna <= q3 + 1.5 * iqr)]
-
-# Calcular estadísticas originales y sin outliers
-stats_df = pd.concat([
-    calcular_estadisticas(df["num_tokens_nltk"], "NLTK - Original"),
-    calcular_estadisticas(df["num_tokens_mpnet"], "MPNet - Original"),
-    calcular_estadisticas(df["num_tokens_minilm"], "MiniLM - Original"),
-    calcular_estadisticas(filtrar_outliers(df["num_tokens_nltk"]).dropna(), "NLTK - Sin outliers"),
-    calcular_estadisticas(filtrar_outliers(df["num_tokens_mpnet"]).dropna(), "MPNet - Sin outliers"),
-    calcular_estadisticas(filtrar_outliers(df["num_tokens_minilm"]).dropna(), "MiniLM - Sin outliers"),
-], ignore_index=True)
-
-# Guardar estadísticas en CSV
-stats_df.to_csv("stats/token_stats.csv", index=False)
-
-# Histograma con valores originales
-plt.figure(figsize=(7, 5))
-sns.histplot(df["num_tokens_nltk"], bins=30, kde=True, color="blue", label="NLTK", alpha=0.5)
-sns.histplot(df["num_tokens_mpnet"], bins=30, kde=True, color="green", label="MPNet", alpha=0.5)
-sns.histplot(df["num_tokens_minilm"], bins=30, kde=True, color="red", label="MiniLM", alpha=0.5)
-plt.xlabel("Número de tokens")
-plt.ylabel("Frecuencia")
-plt.title("Distribución del número de tokens (Original)")
-plt.legend()
-plt.savefig("stats/histograma_tokens.png")
-plt.close()
-
-# Boxplot con valores originales
-plt.figure(figsize=(7, 5))
-sns.boxplot(data=df[["num_tokens_nltk", "num_tokens_mpnet", "num_tokens_minilm"]],
-            palette=["blue", "green", "red"])
-plt.xticks([0, 1, 2], ["NLTK", "MPNet", "MiniLM"])
-plt.title("Boxplot de longitudes de tokens (Original)")
-plt.ylabel("Número de tokens")
-plt.savefig("stats/boxplot_tokens.png")
-plt.close()
-
-# Filtrar outliers para visualización limpia
-df_filtrado = df.copy()
-df_filtrado["num_tokens_nltk"] = filtrar_outliers(df["num_tokens_nltk"])
-df_filtrado["num_tokens_mpnet"] = filtrar_outliers(df["num_tokens_mpnet"])
-df_filtrado["num_tokens_minilm"] = filtrar_outliers(df["num_tokens_minilm"])
-
-# Histograma sin outliers
-plt.figure(figsize=(7, 5))
-sns.histplot(df_filtrado["num_tokens_nltk"].dropna(), bins=30, kde=True, color="blue", label="NLTK", alpha=0.5)
-sns.histplot(df_filtrado["num_tokens_mpnet"].dropna(), bins=30, kde=True, color="green", label="MPNet", alpha=0.5)
-sns.histplot(df_filtrado["num_tokens_minilm"].dropna(), bins=30, kde=True, color="red", label="MiniLM", alpha=0.5)
-plt.title("Distribución del número de tokens (Sin outliers)")
-plt.xlabel("Número de tokens")
-plt.ylabel("Frecuencia")
-plt.legend()
-plt.savefig("stats/histograma_sin_outliers.png")
-plt.close()
-
-# Boxplot sin outliers
-plt.figure(figsize=(7, 5))
-sns.boxplot(data=df_filtrado[["num_tokens_nltk", "num_tokens_mpnet", "num_tokens_minilm"]],
-            palette=["blue", "green", "red"])
-plt.xticks([0, 1, 2], ["NLTK", "MPNet", "MiniLM"])
-plt.title("Boxplot de longitudes de tokens (Sin outliers)")
-plt.ylabel("Número de tokens")
-plt.savefig("stats/boxplot_sin_outliers.png")
-plt.close()
-
-# Mostrar características de tokenizadores
-print("Características de los tokenizadores:")
-print("\nMPNet:\n", mpnet_tokenizer)
-print("\nMiniLM:\n", minilm_tokenizer)
-
-# Ejemplo práctico de tokenización
-ejemplo_texto = "Jaén es una ciudad histórica con una gran tradición cultural."
-print("\nEjemplo de tokenización:")
-print("Texto original:", ejemplo_texto)
-print("Tokens NLTK:", word_tokenize(ejemplo_texto))
-print("Tokens MPNet:", mpnet_tokenizer.tokenize(ejemplo_texto))
-print("Tokens MiniLM:", minilm_tokenizer.tokenize(ejemplo_texto))
+    return counts.where((counts >= q1 - 1.5 * iqr) & (counts <= q3 + 1.5 * iqr))
+
+def calcular_estadisticas(counts, suffix):
+    """
+    Calcula las estadísticas descriptivas de todas las columnas a la vez.
+    Los NaN (valores atípicos filtrados) se ignoran.
+
+    Args:
+        counts (DataFrame): Recuentos, una columna por tokenizador.
+        suffix (str): Sufijo del nombre de cada fila ('Original' o 'Sin outliers').
+
+    Returns:
+        DataFrame: Una fila de estadísticas por columna.
+    """
+    values = counts.to_numpy(dtype=np.float64)
+    quantiles = np.nanquantile(values, [0.25, 0.50, 0.75, 0.05, 0.95], axis=0)
+    variance = np.nanvar(values, axis=0, ddof=1)
+
+    return pd.DataFrame({
+        "Nombre": [f"{COLUMN_NAMES[c]} - {suffix}" for c in counts.columns],
+        "Moda": counts.mode().iloc[0].to_numpy(),
+        "Media": np.nanmean(values, axis=0),
+        "Mediana": np.nanmedian(values, axis=0),
+        "Mínimo": np.nanmin(values, axis=0),
+        "Máximo": np.nanmax(values, axis=0),
+        "Desviación estándar": np.sqrt(variance),
+        "Varianza": variance,
+        "Cuartil 1 (Q1)": quantiles[0],
+        "Cuartil 2 (Q2 - Mediana)": quantiles[1],
+        "Cuartil 3 (Q3)": quantiles[2],
+        "Percentil 5%": quantiles[3],
+        "Percentil 95%": quantiles[4],
+    })
+
+def chunk_size_report(counts, model_name, size, max_seq_length=MAX_SEQ_LENGTH):
+    """
+    Estima cuántos tokens tendrán los chunks de un tamaño dado para un modelo y sugiere
+    el tamaño máximo en caracteres que cabe en su longitud de entrada.
+
+    Args:
+        counts (DataFrame): Recuentos por artículo (ver compute_token_counts).
+        model_name (str): Modelo ('mpnet' o 'minilm').
+        size (str): Tamaño de chunk en caracteres, o 'full' para artículos completos.
+        max_seq_length (int): Longitud máxima de entrada del modelo.
+
+    Returns:
+        dict: Tokens estimados, fracción truncada y tamaño sugerido.
+    """
+    column = f'num_tokens_{model_name}'
+    valid = counts[counts[column] > 0]
+    chars_per_token = valid['num_chars'] / valid[column]
+
+    # Se usa el percentil 5 de caracteres por token para que casi todos los chunks quepan
+    suggested_size = int(max_seq_length * chars_per_token.quantile(0.05))
+
+    if size == 'full':
+        tokens = valid[column]
+    else:
+        tokens = int(size) / chars_per_token
+    return {
+        'estimated_tokens': float(tokens.median()),
+        'truncated_fraction': float((tokens > max_seq_length).mean()),
+        'suggested_size': suggested_size,
+    }
+
+def plot_distributions(counts, counts_filtrado):
+    """
+    Genera los histogramas y boxplots de los recuentos originales y sin outliers.
+    """
+    columns = list(COLUMN_NAMES)
+    labels = list(COLUMN_NAMES.values())
+    colors = ["blue", "green", "red"]
+
+    for data, title, hist_file, box_file in [
+        (counts, "Original", "histograma_tokens.png", "boxplot_tokens.png"),
+        (counts_filtrado, "Sin outliers", "histograma_sin_outliers.png", "boxplot_sin_outliers.png"),
+    ]:
+        # Histograma
+        plt.figure(figsize=(7, 5))
+        for column, label, color in zip(columns, labels, colors):
+            sns.histplot(data[column].dropna(), bins=30, kde=True, color=color, label=label, alpha=0.5)
+        plt.xlabel("Número de tokens")
+        plt.ylabel("Frecuencia")
+        plt.title(f"Distribución del número de tokens ({title})")
+        plt.legend()
+        plt.savefig(f"stats/{hist_file}")
+        plt.close()
+
+        # Boxplot
+        plt.figure(figsize=(7, 5))
+        sns.boxplot(data=data[columns], palette=colors)
+        plt.xticks([0, 1, 2], labels)
+        plt.title(f"Boxplot de longitudes de tokens ({title})")
+        plt.ylabel("Número de tokens")
+        plt.savefig(f"stats/{box_file}")
+        plt.close()
+
+if __name__ == '__main__':
+    # Descargar recursos de NLTK si no están disponibles
+    nltk.download("punkt")
+
+    # Cargar el dataset generado desde Wikipedia
+    df = pd.read_csv("data/wikipedia_jaen.csv")  # Alternativamente: pd.read_parquet("dataset.parquet")
+
+    # Tokenización por lotes con los tokenizadores rápidos de Hugging Face (MPNet y MiniLM)
+    tokenizers = {name: AutoTokenizer.from_pretrained(path, use_fast=True) for name, path in TOKENIZERS.items()}
+    counts = compute_token_counts(df, tokenizers, n_process=os.cpu_count() or 1)
+    save_token_counts(counts)
+
+    # Calcular estadísticas originales y sin outliers
+    token_columns = counts[list(COLUMN_NAMES)]
+    token_columns_filtrado = filtrar_outliers(token_columns)
+    stats_df = pd.concat([
+        calcular_estadisticas(token_columns, "Original"),
+        calcular_estadisticas(token_columns_filtrado, "Sin outliers"),
+    ], ignore_index=True)
+
+    # Guardar estadísticas en CSV
+    stats_df.to_csv("stats/token_stats.csv", index=False)
+
+    plot_distributions(token_columns, token_columns_filtrado)
+
+    # Mostrar características de tokenizadores
+    print("Características de los tokenizadores:")
+    print("\nMPNet:\n", tokenizers['mpnet'])
+    print("\nMiniLM:\n", tokenizers['minilm'])
+
+    # Ejemplo práctico de tokenización
+    ejemplo_texto = "Jaén es una ciudad histórica con una gran tradición cultural."
+    print("\nEjemplo de tokenización:")
+    print("Texto original:", ejemplo_texto)
+    print("Tokens NLTK:", word_tokenize(ejemplo_texto))
+    print("Tokens MPNet:", tokenizers['mpnet'].tokenize(ejemplo_texto))
+    print("Tokens MiniLM:", tokenizers['minilm'].tokenize(ejemplo_texto))
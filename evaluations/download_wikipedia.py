@@ -1,107 +1,335 @@
-import requests
+import aiohttp
+import asyncio
+import argparse
+import hashlib
+import email.utils
+import time
 import pandas as pd
+import json
+import os
 import re
 import mwparserfromhell
 
-# Crear un DataFrame vacío para almacenar los artículos
-articles_df = pd.DataFrame(columns=["title", "content", "categories"])
+API_URL = "https://es.wikipedia.org/w/api.php"
+
+# Respuestas de la API guardadas en disco (permiten repetir la descarga sin red)
+CACHE_DIR = "cache/wikipedia"
+
+# Progreso de la descarga, para reanudarla si se interrumpe. El fichero de progreso solo
+# guarda títulos; el texto de los artículos se añade a un JSON Lines por categoría raíz.
+CHECKPOINT_FILE = "cache/wikipedia_checkpoint.json"
+CHECKPOINT_VERSION = 2
+
+# Conexiones simultáneas con la API y títulos por petición de contenido
+MAX_CONNECTIONS = 8
+TITLES_PER_REQUEST = 20
+
+USER_AGENT = "AsistentesVirtualesPersonasMayores/1.0 (ssc00022@red.ujaen.es)"
 
 # Lista de categorías que se excluirán de la exploración
-exclude_categories = [
+exclude_categories = {
     "Casa de Alburquerque",
     "Río Guadalquivir",
     "Río Segura",
     "Ríos de Sierra Morena",
     "Reino de Murcia"
-]
-
-def fetch_article(title):
-    """Descarga el contenido plano de un artículo desde Wikipedia."""
-    url = "https://es.wikipedia.org/w/api.php"
-    params = {
-        "action": "query",
-        "format": "json",
-        "prop": "extracts",
-        "explaintext": True,
-        "titles": title
-    }
+}
+
+class CacheMiss(Exception):
+    """Respuesta no disponible en la caché en modo sin conexión."""
+
+def retry_after(value, default):
+    """
+    Segundos de espera indicados en la cabecera Retry-After, que puede ser un número de
+    segundos o una fecha HTTP. Si falta o no se puede interpretar se usa el valor por defecto.
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        pages = data.get('query', {}).get('pages', {})
-        for page_id, page_content in pages.items():
-            if "extract" in page_content and page_content["extract"].strip():
-                return {
-                    "title": page_content["title"],
-                    "content": page_content["extract"]
-                }
-            else:
-                print(f"El artículo '{title}' no tiene contenido.")
-    except requests.RequestException as e:
-        print(f"Error al descargar el artículo '{title}': {e}")
-    return None
-
-def add_article(title, content, category, articles_df):
-    """Agrega un artículo nuevo al DataFrame."""
-    print(f"Importando artículo: {title}\nCategoría: {category}")
-    new_row = pd.DataFrame([{
-        "title": title,
-        "content": content,
-        "categories": [category]
-    }])
-    return pd.concat([articles_df, new_row], ignore_index=True)
-
-def update_article(title, category, articles_df):
-    """Actualiza las categorías asociadas a un artículo ya incluido."""
-    idx = articles_df[articles_df["title"] == title].index[0]
-    current_categories = set(articles_df.at[idx, "categories"])
-    print(f"Actualizando categorías para '{title}'. Categorías existentes: {current_categories}")
-    current_categories.add(category)
-    articles_df.at[idx, "categories"] = list(current_categories)
-    return articles_df
-
-def explore_category(category, visited_categories, articles_df):
-    """Explora una categoría y sus subcategorías recursivamente."""
-    if category in visited_categories or category in exclude_categories:
-        print(f"Ignorando categoría ya visitada: {category}")
-        return articles_df
-    visited_categories.add(category)
-
-    url = "https://es.wikipedia.org/w/api.php"
-    params = {
-        "action": "query",
-        "format": "json",
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+class WikipediaClient:
+    """
+    Cliente asíncrono de la API de MediaWiki con un número limitado de conexiones,
+    reintentos y caché de respuestas en disco. En modo sin conexión solo se usan las
+    respuestas guardadas, lo que permite reproducir una descarga sin acceso a la red.
+    """
+
+    def __init__(self, session, api_url=API_URL, cache_dir=CACHE_DIR, offline=False,
+                 max_connections=MAX_CONNECTIONS, retries=5):
+        self.session = session
+        self.api_url = api_url
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.retries = retries
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.requests = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, params):
+        # La clave no incluye la URL: una réplica local responde igual que la API real
+        key = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    async def get(self, params):
+        """Realiza una petición a la API, usando la caché si la respuesta ya se descargó."""
+        params = {"format": "json", "formatversion": "2", **params}
+        path = self.cache_path(params)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        if self.offline:
+            raise CacheMiss(f"Respuesta no disponible sin conexión: {params}")
+
+        # Un primer intento y hasta self.retries reintentos
+        for attempt in range(self.retries + 1):
+            delay = 2 ** attempt
+            try:
+                async with self.semaphore:
+                    self.requests += 1
+                    async with self.session.get(self.api_url, params=params) as response:
+                        # Ante limitación de peticiones se respeta el tiempo indicado por el servidor
+                        if response.status == 429 or response.status >= 500:
+                            delay = retry_after(response.headers.get("Retry-After"), delay)
+                        response.raise_for_status()
+                        data = await response.json(content_type=None)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Los errores del cliente (4xx salvo 429) no se resuelven reintentando
+                if isinstance(e, aiohttp.ClientResponseError) and e.status != 429 and e.status < 500:
+                    raise
+                if attempt == self.retries:
+                    raise
+                print(f"Error en la petición ({e}), reintentando en {delay}s...")
+                await asyncio.sleep(delay)
+
+        # Escritura atómica para no dejar respuestas a medias en la caché
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        return data
+
+    async def query(self, params):
+        """Recorre todas las páginas de una consulta siguiendo los tokens de continuación."""
+        results = []
+        continuation = {}
+        while True:
+            data = await self.get({"action": "query", **params, **continuation})
+            results.append(data.get("query", {}))
+            if "continue" not in data:
+                return results
+            continuation = data["continue"]
+
+def load_checkpoint(path):
+    """
+    Carga el progreso guardado o crea uno vacío. Los miembros de cada categoría se
+    comparten entre categorías raíz; los artículos descargados se guardan por raíz.
+    """
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        # El formato anterior guardaba el texto de los artículos: solo se conservan las categorías
+        if checkpoint.get("version") == CHECKPOINT_VERSION:
+            return checkpoint
+        return {"version": CHECKPOINT_VERSION, "members": checkpoint.get("members", {}), "articles": {}}
+    return {"version": CHECKPOINT_VERSION, "members": {}, "articles": {}}
+
+def save_checkpoint(checkpoint, path):
+    """Guarda el progreso de forma atómica."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def contents_path(checkpoint_path, root):
+    """Fichero JSON Lines con el texto de los artículos descargados para una categoría raíz."""
+    key = hashlib.sha256(root.encode("utf-8")).hexdigest()[:12]
+    return f"{os.path.splitext(checkpoint_path)[0]}_{key}.jsonl"
+
+def load_contents(path):
+    """Lee los artículos ya descargados: título -> (título de la página, contenido o None)."""
+    contents = {}
+    if not os.path.exists(path):
+        return contents
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break  # Línea incompleta de una ejecución interrumpida
+            contents[entry["title"]] = (entry["page_title"], entry["content"])
+    return contents
+
+async def fetch_members(client, category):
+    """Obtiene todos los miembros de una categoría como pares (ns, título)."""
+    pages = await client.query({
         "list": "categorymembers",
         "cmtitle": f"Categoría:{category}",
         "cmlimit": "max"
-    }
-    try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        for member in response.json().get("query", {}).get("categorymembers", []):
-            title = member["title"]
-            ns = member["ns"]
-
-            if ns == 0:  # Artículo
-                if title in articles_df["title"].values:
-                    articles_df = update_article(title, category, articles_df)
-                else:
-                    article = fetch_article(title)
-                    if article:
-                        articles_df = add_article(article["title"], article["content"], category, articles_df)
-            elif ns == 14:  # Subcategoría
-                subcat = title.replace("Categoría:", "")
-                if subcat not in exclude_categories:
-                    print(f"Explorando subcategoría: {subcat}")
-                    articles_df = explore_category(subcat, visited_categories, articles_df)
-                else:
-                    print(f"Ignorando categoría excluida: {subcat}")
-            elif ns == 100:  # Portal
-                print(f"Ignorando portal: {title}")
-    except requests.RequestException as e:
-        print(f"Error al explorar categoría '{category}': {e}")
-    return articles_df
+    })
+    return [[member["ns"], member["title"]] for page in pages for member in page.get("categorymembers", [])]
+
+async def crawl_categories(client, root, checkpoint, checkpoint_path):
+    """
+    Recorre el grafo de categorías por niveles, descargando en paralelo los miembros
+    de todas las categorías de un mismo nivel.
+    """
+    members = checkpoint["members"]
+    pending = {root} - exclude_categories
+    seen = set(pending)
+
+    while pending:
+        # Las categorías ya presentes en el progreso guardado no se vuelven a pedir
+        todo = sorted(c for c in pending if c not in members)
+        if todo:
+            print(f"Explorando {len(todo)} categorías...")
+            results = await asyncio.gather(*(fetch_members(client, c) for c in todo))
+            members.update(zip(todo, results))
+            save_checkpoint(checkpoint, checkpoint_path)
+
+        # Siguiente nivel: subcategorías no vistas ni excluidas
+        pending = {
+            title.replace("Categoría:", "", 1)
+            for category in pending
+            for ns, title in members[category]
+            if ns == 14
+        } - seen - exclude_categories
+        seen |= pending
+    return members
+
+def order_articles(members, root):
+    """
+    Recorre las categorías en profundidad con el mismo orden que la exploración
+    recursiva original y devuelve los artículos en orden de descubrimiento junto
+    con todas las categorías en las que aparecen.
+
+    Returns:
+        dict: Título -> lista de categorías.
+    """
+    articles = {}
+    visited = set()
+    if root in exclude_categories:
+        return articles
+
+    stack = [root]
+    visited.add(root)
+    iterators = [iter(members.get(root, []))]
+
+    while iterators:
+        try:
+            ns, title = next(iterators[-1])
+        except StopIteration:
+            iterators.pop()
+            stack.pop()
+            continue
+
+        if ns == 0:  # Artículo
+            categories = articles.setdefault(title, {})
+            categories[stack[-1]] = None
+        elif ns == 14:  # Subcategoría
+            subcat = title.replace("Categoría:", "", 1)
+            if subcat not in visited and subcat not in exclude_categories:
+                visited.add(subcat)
+                stack.append(subcat)
+                iterators.append(iter(members.get(subcat, [])))
+
+    return {title: list(categories) for title, categories in articles.items()}
+
+async def fetch_batch(client, titles):
+    """
+    Descarga el texto plano de varios artículos. La API puede devolver solo parte de
+    los extractos en cada respuesta, por lo que se siguen los tokens de continuación.
+
+    Returns:
+        dict: Título solicitado -> (título de la página, contenido o None).
+    """
+    pages = await client.query({
+        "prop": "extracts",
+        "explaintext": 1,
+        "exlimit": "max",
+        "titles": "|".join(titles)
+    })
+
+    normalized = {}
+    extracts = {}
+    for page in pages:
+        normalized.update({n["to"]: n["from"] for n in page.get("normalized", [])})
+        for content in page.get("pages", []):
+            extract = content.get("extract")
+            if extract and extract.strip():
+                extracts[content["title"]] = extract
+
+    result = {title: (title, None) for title in titles}
+    for page_title, extract in extracts.items():
+        result[normalized.get(page_title, page_title)] = (page_title, extract)
+    return result
+
+async def fetch_articles(client, titles, root, checkpoint, checkpoint_path):
+    """
+    Descarga por lotes los artículos que aún no están en el progreso guardado. Cada lote
+    se añade al fichero de contenidos de la raíz y el progreso solo registra sus títulos,
+    de modo que guardar el progreso no reescribe los textos ya descargados.
+    """
+    path = contents_path(checkpoint_path, root)
+    contents = load_contents(path)
+    # Solo cuentan como descargados los títulos registrados cuyo texto llegó a escribirse
+    done = [t for t in checkpoint["articles"].get(root, []) if t in contents]
+    checkpoint["articles"][root] = done
+    contents = {t: contents[t] for t in done}
+
+    pending = [t for t in titles if t not in contents]
+    batches = [pending[i:i + TITLES_PER_REQUEST] for i in range(0, len(pending), TITLES_PER_REQUEST)]
+    print(f"Artículos por descargar: {len(pending)} ({len(batches)} lotes)")
+
+    tasks = [asyncio.ensure_future(fetch_batch(client, batch)) for batch in batches]
+    with open(path, "a", encoding="utf-8") as f:
+        for n_done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            for title, (page_title, content) in (await task).items():
+                contents[title] = (page_title, content)
+                done.append(title)
+                f.write(json.dumps({"title": title, "page_title": page_title, "content": content},
+                                   ensure_ascii=False) + "\n")
+                if content is None:
+                    print(f"El artículo '{title}' no tiene contenido.")
+            if n_done % 10 == 0 or n_done == len(tasks):
+                f.flush()
+                os.fsync(f.fileno())
+                save_checkpoint(checkpoint, checkpoint_path)
+                print(f"Lotes descargados: {n_done}/{len(tasks)}")
+    return contents
+
+async def crawl(root, api_url=API_URL, cache_dir=CACHE_DIR, checkpoint_path=CHECKPOINT_FILE,
+                offline=False, max_connections=MAX_CONNECTIONS):
+    """
+    Descarga todos los artículos de una categoría y sus subcategorías.
+
+    Returns:
+        DataFrame: Artículos con título, contenido y categorías.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={"User-Agent": USER_AGENT}) as session:
+        client = WikipediaClient(session, api_url, cache_dir, offline, max_connections)
+        members = await crawl_categories(client, root, checkpoint, checkpoint_path)
+        article_categories = order_articles(members, root)
+        contents = await fetch_articles(client, list(article_categories), root, checkpoint, checkpoint_path)
+        print(f"Peticiones realizadas a la API: {client.requests}")
+
+    rows = [
+        {"title": contents[title][0], "content": contents[title][1], "categories": categories}
+        for title, categories in article_categories.items()
+        if contents[title][1] is not None
+    ]
+    return pd.DataFrame(rows, columns=["title", "content", "categories"])
 
 def clean_text(text):
     """Limpia el texto eliminando etiquetas y caracteres no deseados."""
@@ -119,14 +347,23 @@ def remove_irrelevant_sections(text):
 
 # Punto de entrada del script
 if __name__ == "__main__":
-    initial_category = "Provincia de Jaén"
-    visited_categories = set()
-    articles_df = explore_category(initial_category, visited_categories, articles_df)
+    parser = argparse.ArgumentParser(description="Descarga los artículos de Wikipedia sobre la provincia de Jaén.")
+    parser.add_argument("--category", default="Provincia de Jaén", help="Categoría inicial.")
+    parser.add_argument("--api-url", default=API_URL, help="URL de la API (p. ej. una réplica local).")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Carpeta de la caché de respuestas.")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE, help="Fichero de progreso.")
+    parser.add_argument("--offline", action="store_true", help="Usar solo respuestas de la caché.")
+    parser.add_argument("--max-connections", type=int, default=MAX_CONNECTIONS)
+    parser.add_argument("--output", default="data/wikipedia_jaen.csv")
+    args = parser.parse_args()
+
+    articles_df = asyncio.run(crawl(args.category, args.api_url, args.cache_dir, args.checkpoint,
+                                    args.offline, args.max_connections))
 
     # Limpiar el contenido de los artículos
     articles_df['content'] = articles_df['content'].apply(remove_irrelevant_sections)
     articles_df['content'] = articles_df['content'].apply(clean_text)
 
     # Exportar el resultado a CSV
-    articles_df.to_csv("data/wikipedia_jaen.csv", index=False, encoding="utf-8")
-    print("Exploración completada. Artículos guardados en 'wikipedia_jaen.csv'.")
+    articles_df.to_csv(args.output, index=False, encoding="utf-8")
+    print(f"Exploración completada. {len(articles_df)} artículos guardados en '{args.output}'.")
@@ -0,0 +1,171 @@
+from langchain_core.embeddings import Embeddings
+import numpy as np
+import threading
+import hashlib
+import fcntl
+import json
+import os
+import re
+
+CACHE_DIR = 'cache/embeddings'
+
+class EmbeddingCache:
+    """
+    Caché de embeddings en disco direccionada por contenido. Cada modelo tiene su propia
+    carpeta con un fichero de vectores float32 (leído con memmap) y un fichero de claves
+    (hash del texto) en el mismo orden. Solo se añaden filas, nunca se reescriben.
+    """
+
+    def __init__(self, model_id, cache_dir=CACHE_DIR):
+        """
+        Args:
+            model_id (str): Identificador del modelo y de sus parámetros de codificación.
+            cache_dir (str): Carpeta raíz de la caché.
+        """
+        slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_id)[:80]
+        digest = hashlib.sha256(model_id.encode('utf-8')).hexdigest()[:12]
+        self.path = os.path.join(cache_dir, f'{slug}_{digest}')
+        os.makedirs(self.path, exist_ok=True)
+
+        self.vectors_path = os.path.join(self.path, 'vectors.f32')
+        self.keys_path = os.path.join(self.path, 'keys.txt')
+        self.meta_path = os.path.join(self.path, 'meta.json')
+        self.lock = threading.Lock()
+
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+
+        self.rows = {}
+        self._vectors = None
+        self._load_keys()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _load_keys(self):
+        """
+        Carga el índice de claves. Solo cuentan las líneas completas y las filas presentes
+        en ambos ficheros; los restos de una escritura interrumpida se eliminan en put.
+        """
+        self.rows = {}
+        if not os.path.exists(self.keys_path) or self.dim is None:
+            return
+        with open(self.keys_path, encoding='utf-8') as f:
+            keys = [line[:-1] for line in f if line.endswith('\n')]
+        n_vectors = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+        self.rows = {k: i for i, k in enumerate(keys[:n_vectors])}
+        self._vectors = None
+
+    def _repair(self):
+        """
+        Deja ambos ficheros con el mismo número de filas completas antes de añadir otras
+        (con el bloqueo de fichero tomado). Una escritura interrumpida puede dejar vectores
+        sin clave o una clave sin salto de línea; si se añadiera detrás, las claves nuevas
+        quedarían asociadas a filas de otros textos.
+        """
+        keys_size = os.path.getsize(self.keys_path) if os.path.exists(self.keys_path) else 0
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        n_keys, keys_end = 0, 0
+        if keys_size:
+            with open(self.keys_path, 'rb') as f:
+                data = f.read()
+            keys_end = data.rfind(b'\n') + 1
+            n_keys = data.count(b'\n', 0, keys_end)
+        n_rows = min(n_keys, vectors_size // (4 * self.dim))
+
+        if n_rows < n_keys:
+            keys_end = len(b''.join(data[:keys_end].splitlines(keepends=True)[:n_rows]))
+        if keys_end != keys_size:
+            os.truncate(self.keys_path, keys_end)
+        if vectors_size != n_rows * 4 * self.dim:
+            os.truncate(self.vectors_path, n_rows * 4 * self.dim)
+
+    def vectors(self):
+        """
+        Devuelve los vectores almacenados proyectados en memoria.
+        """
+        if self._vectors is None or len(self._vectors) < len(self.rows):
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.rows), self.dim)) \
+                if self.rows else np.empty((0, self.dim or 0), dtype=np.float32)
+        return self._vectors
+
+    def get(self, texts):
+        """
+        Busca los embeddings de una lista de textos.
+
+        Returns:
+            Tuple[dict, list]: Embeddings encontrados por posición y posiciones no encontradas.
+        """
+        with self.lock:
+            rows = [self.rows.get(self.key(text)) for text in texts]
+            vectors = self.vectors()
+        found = {i: np.array(vectors[row]) for i, row in enumerate(rows) if row is not None}
+        missing = [i for i, row in enumerate(rows) if row is None]
+        return found, missing
+
+    def put(self, texts, vectors):
+        """
+        Añade nuevos embeddings a la caché. El bloqueo de fichero permite que varios
+        procesos compartan la misma caché.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock, open(os.path.join(self.path, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim}, f)
+
+            # Otro proceso puede haber añadido filas desde la última lectura
+            self._repair()
+            self._load_keys()
+            new = {}
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                if key not in self.rows and key not in new:
+                    new[key] = vector
+            if not new:
+                return
+
+            # Primero los vectores y después las claves: una clave solo existe si su vector está escrito
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.stack(list(new.values())).astype(np.float32).tobytes())
+            with open(self.keys_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(f'{key}\n' for key in new))
+            self._load_keys()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envoltorio de un modelo de embeddings de LangChain que consulta la caché en disco
+    y solo ejecuta el codificador para los textos que no se han visto antes.
+    """
+
+    def __init__(self, embeddings, cache_dir=CACHE_DIR, model_id=None):
+        """
+        Args:
+            embeddings: Modelo de embeddings de LangChain (p. ej. HuggingFaceEmbeddings).
+            cache_dir (str): Carpeta raíz de la caché.
+            model_id (str): Identificador del modelo; por defecto se deriva del nombre y
+                de los parámetros de codificación.
+        """
+        self.embeddings = embeddings
+        if model_id is None:
+            encode_kwargs = json.dumps(getattr(embeddings, 'encode_kwargs', {}), sort_keys=True)
+            model_id = f"{getattr(embeddings, 'model_name', type(embeddings).__name__)}|{encode_kwargs}"
+        self.cache = EmbeddingCache(model_id, cache_dir)
+
+    def embed_documents(self, texts):
+        found, missing = self.cache.get(texts)
+        if missing:
+            unique = list(dict.fromkeys(texts[i] for i in missing))
+            computed = np.asarray(self.embeddings.embed_documents(unique), dtype=np.float32)
+            self.cache.put(unique, computed)
+            by_text = dict(zip(unique, computed))
+            found.update({i: by_text[texts[i]] for i in missing})
+        return [found[i].tolist() for i in range(len(texts))]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,159 @@
+import pandas as pd
+from datasets import Dataset
+from ragas.metrics import NonLLMContextPrecisionWithReference, NonLLMContextRecall
+from ragas.metrics.base import MetricWithEmbeddings
+from ragas import evaluate
+from langchain_huggingface import HuggingFaceEmbeddings
+from ragas.embeddings import LangchainEmbeddingsWrapper
+from artifacts import ChunkTable, read_artifact
+from context_metrics import context_scores
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import threading
+import time
+
+# Modelos usados para los embeddings
+MODELS = {
+    'minilm': 'paraphrase-multilingual-MiniLM-L12-v2',
+    'mpnet': 'paraphrase-multilingual-mpnet-base-v2'
+}
+
+# Columnas de los artefactos necesarias para las métricas
+EVAL_COLUMNS = ['question', 'retrieved_contexts', 'reference', 'reference_contexts']
+
+def default_metrics():
+    return [NonLLMContextPrecisionWithReference(), NonLLMContextRecall()]
+
+class EvalRunner:
+    """
+    Evalúa muchos ficheros de contextos con una única instancia de cada modelo de
+    embeddings, compartida entre hilos. Los modelos se cargan solo si alguna métrica
+    los necesita (las métricas sin LLM por defecto no los usan).
+
+    Por defecto se usa la implementación propia de las métricas sin LLM (context_metrics),
+    que puntúa todas las preguntas de todos los ficheros en una sola pasada.
+    """
+
+    def __init__(self, metrics_factory=default_metrics, device='cuda', max_workers=4, n_rows=24, native=True):
+        """
+        Args:
+            metrics_factory (Callable): Devuelve las métricas de RAGAS (una lista nueva por fichero).
+            device (str): Dispositivo de los modelos de embeddings.
+            max_workers (int): Ficheros evaluados en paralelo.
+            n_rows (int): Preguntas evaluadas de cada fichero (las de la base de conocimiento).
+            native (bool): Si es True, se usan las métricas propias en lugar de ragas.evaluate.
+        """
+        self.metrics_factory = metrics_factory
+        self.device = device
+        self.max_workers = max_workers
+        self.n_rows = n_rows
+        self.native = native
+        self.chunk_table = ChunkTable()
+        self.lock = threading.Lock()
+        self.models = {}
+
+    def embeddings(self, model_key):
+        """
+        Devuelve el modelo de embeddings, cargándolo la primera vez.
+        """
+        with self.lock:
+            if model_key not in self.models:
+                embed_model = HuggingFaceEmbeddings(
+                    model_name=f'sentence-transformers/{MODELS[model_key]}',  # Ruta sustituida
+                    model_kwargs={'device': self.device},
+                    encode_kwargs={'normalize_embeddings': True},
+                )
+                self.models[model_key] = LangchainEmbeddingsWrapper(embed_model)
+            return self.models[model_key]
+
+    def load(self, path):
+        """
+        Lee las columnas necesarias de un artefacto y las prepara para RAGAS.
+        """
+        df = read_artifact(path, columns=EVAL_COLUMNS, chunk_table=self.chunk_table)
+        df = df.iloc[:self.n_rows].reset_index(drop=True)
+        df['reference'] = df['reference'].fillna("")
+        df['reference_contexts'] = df['reference_contexts'].fillna("").apply(lambda text: [text])
+        return df
+
+    def evaluate(self, df, model_key):
+        """
+        Aplica las métricas sobre un DataFrame ya preparado.
+
+        Returns:
+            DataFrame: Métricas por pregunta.
+        """
+        metrics = self.metrics_factory()
+        embeddings = None
+        if any(isinstance(metric, MetricWithEmbeddings) for metric in metrics):
+            embeddings = self.embeddings(model_key)
+
+        results = evaluate(
+            dataset=Dataset.from_pandas(df),
+            metrics=metrics,
+            embeddings=embeddings,
+            show_progress=False
+        )
+        return pd.DataFrame(results.scores).round(5)
+
+    def _run_job(self, path, model_key):
+        df = self.load(path)
+        score_df = self.evaluate(df, model_key)
+        return pd.concat([df['question'], score_df], axis=1)
+
+    def _run_native(self, jobs):
+        """
+        Lee todos los ficheros en paralelo y los puntúa juntos: los contextos repetidos
+        entre ficheros se comparan una sola vez.
+        """
+        paths = [path for path, _ in jobs]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            dfs = list(executor.map(self.load, paths))
+        if not dfs:
+            return {}
+
+        df = pd.concat(dfs, ignore_index=True)
+        scores = context_scores(df['retrieved_contexts'], df['reference_contexts']).round(5)
+
+        results = {}
+        start = 0
+        for path, part in zip(paths, dfs):
+            end = start + len(part)
+            results[path] = pd.concat([part['question'], scores.iloc[start:end].reset_index(drop=True)], axis=1)
+            start = end
+        return results
+
+    def run(self, jobs, output_dir):
+        """
+        Evalúa en paralelo una lista de ficheros y escribe todos los resultados al final.
+
+        Args:
+            jobs (List[Tuple[Path, str]]): Pares (artefacto, clave del modelo de embeddings).
+            output_dir (Path): Carpeta de salida (un CSV por artefacto).
+
+        Returns:
+            DataFrame: Media de cada métrica por fichero.
+        """
+        output_dir = Path(output_dir)
+        output_dir.mkdir(exist_ok=True)
+        start = time.perf_counter()
+
+        if self.native:
+            results = self._run_native(jobs)
+        else:
+            results = {}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(self._run_job, path, model_key): path for path, model_key in jobs}
+                for future in as_completed(futures):
+                    path = futures[future]
+                    results[path] = future.result()
+                    print(f'Evaluado {path.name} ({len(results)}/{len(jobs)})')
+
+        summary = []
+        for path, final_df in sorted(results.items()):
+            output_file = output_dir / f'{path.name}.csv'
+            final_df.to_csv(output_file, index=False, sep=',', decimal="'")
+            summary.append({'file': path.name, **final_df.drop(columns='question').mean().to_dict()})
+
+        print(f'{len(results)} ficheros evaluados en {time.perf_counter() - start:.1f} s y guardados en {output_dir}')
+        return pd.DataFrame(summary)
@@ -0,0 +1,494 @@
+from vector_store import INDEX_FILE, DOCSTORE_FILE, VECTORS_FILE, VECTOR_IDS_FILE, SQLiteDocstore
+from shards import SHARDS_FILE, read_manifest, write_manifest
+from bm25_index import BM25Index, STATS_FILE, corpus_stats
+from datetime import datetime, timezone
+import numpy as np
+import hashlib
+import shutil
+import faiss
+import json
+import math
+import zlib
+import ast
+import os
+
+# Configuraciones de índice disponibles. Los embeddings se normalizan, por lo que
+# el producto interno equivale a la similitud coseno.
+INDEX_CONFIGS = {
+    'flat': {'type': 'flat'},
+    'flat_ip': {'type': 'flat_ip'},
+    'hnsw': {'type': 'hnsw', 'M': 32, 'ef_construction': 200, 'ef_search': 64},
+    'ivf': {'type': 'ivf', 'nlist': None, 'nprobe': 16},
+    # Índices comprimidos: cuantización escalar a 16 u 8 bits, cuantización de producto
+    # (M subvectores de nbits) y reducción con PCA a dim dimensiones sobre un índice base L2.
+    # Con 'refine': f se recuperan f·k candidatos y se reordenan con los vectores originales,
+    # que se guardan aparte (vectors.f32) y se leen de disco con mmap.
+    'sq_fp16': {'type': 'sq_fp16'},
+    'sq8': {'type': 'sq8'},
+    'pq': {'type': 'pq', 'M': None, 'nbits': 8},
+    'pca': {'type': 'pca', 'dim': 256, 'base': 'flat'},
+}
+
+# Índices que se entrenan con una muestra de los vectores antes de añadirlos
+TRAINED_TYPES = {'ivf', 'sq8', 'pq', 'pca'}
+
+# Índices base admitidos tras la reducción con PCA. PCAMatrix centra los datos, por lo que
+# el producto interno de los vectores proyectados ya no equivale al coseno; la distancia L2
+# sí se conserva (con vectores normalizados, ||x - q||² = 2 - 2·cos), así que el índice base usa L2.
+PCA_BASE_TYPES = {'flat', 'sq_fp16', 'sq8'}
+
+# Índices que comparan los vectores con distancia L2 (el resto usa producto interno)
+L2_TYPES = {'flat', 'pca'}
+
+CONFIG_FILE = 'index_config.json'
+
+# Manifiesto de los almacenes actualizados con incremental_index.py
+MANIFEST_FILE = 'index_manifest.json'
+
+# Tamaño de la muestra con la que se entrenan los índices durante la construcción incremental
+TRAIN_SIZE = 20000
+
+
+def resolve_config(config, n_vectors, d=None):
+    """
+    Completa los parámetros que dependen del tamaño del corpus o de la dimensión.
+
+    Args:
+        config (dict): Configuración del índice.
+        n_vectors (int): Número de vectores que se van a indexar.
+        d (int): Dimensión de los embeddings (necesaria para PQ y PCA).
+
+    Returns:
+        dict: Copia de la configuración con los parámetros resueltos.
+    """
+    config = dict(config)
+    if config['type'] == 'ivf':
+        if not config.get('nlist'):
+            # Regla habitual de FAISS: unas 4·sqrt(n) listas, con al menos 39 vectores por lista
+            config['nlist'] = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+        config['nprobe'] = min(config.get('nprobe', 1), config['nlist'])
+    elif config['type'] == 'pq':
+        # Por defecto un subvector de 8 dimensiones por byte de código (32 veces menos que float32)
+        config['M'] = config.get('M') or d // 8
+        # Cada centroide necesita unos 39 vectores de entrenamiento: con corpus pequeños se reduce nbits
+        config['nbits'] = max(1, min(config.get('nbits', 8), int(math.log2(max(2, n_vectors // 39)))))
+    elif config['type'] == 'pca':
+        if config.get('base', 'flat') not in PCA_BASE_TYPES:
+            raise ValueError(f"Índice base no soportado tras PCA: {config['base']}")
+        config['dim'] = min(config['dim'], d or config['dim'], n_vectors)
+    return config
+
+
+def create_index(config, d, train_vectors=None):
+    """
+    Crea un índice FAISS vacío según la configuración indicada.
+
+    Args:
+        config (dict): Configuración del índice (ver INDEX_CONFIGS).
+        d (int): Dimensión de los embeddings.
+        train_vectors (np.ndarray): Vectores de entrenamiento (necesarios para IVF).
+
+    Returns:
+        faiss.Index: Índice listo para añadir vectores.
+    """
+    index_type = config['type']
+    index = _new_index(config, d)
+
+    if not index.is_trained:
+        if train_vectors is None:
+            raise ValueError(f"El índice '{index_type}' necesita vectores de entrenamiento")
+        index.train(np.asarray(train_vectors, dtype=np.float32))
+
+    apply_search_params(index, config)
+    return index
+
+
+def _new_index(config, d, metric=faiss.METRIC_INNER_PRODUCT):
+    """
+    Construye un índice FAISS vacío y sin entrenar. metric solo se aplica a los índices
+    cuantizados (el índice 'flat' es siempre L2 y 'flat_ip' producto interno).
+    """
+    index_type = config['type']
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(d)
+    elif index_type == 'flat_ip':
+        index = faiss.IndexFlatIP(d)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, config['M'], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config['ef_construction']
+    elif index_type == 'ivf':
+        quantizer = faiss.IndexFlatIP(d)
+        index = faiss.IndexIVFFlat(quantizer, d, config['nlist'], faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'sq_fp16':
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, metric)
+    elif index_type == 'sq8':
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, metric)
+    elif index_type == 'pq':
+        index = faiss.IndexPQ(d, config['M'], config['nbits'], faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'pca':
+        # La PCA y el índice base se entrenan juntos al entrenar el IndexPreTransform
+        pca = faiss.PCAMatrix(d, config['dim'])
+        base = _new_index({'type': config.get('base', 'flat')}, config['dim'], metric=faiss.METRIC_L2)
+        index = faiss.IndexPreTransform(pca, base)
+    else:
+        raise ValueError(f"Tipo de índice no soportado: {index_type}")
+    return index
+
+
+def apply_search_params(index, config):
+    """
+    Aplica los parámetros de búsqueda (efSearch, nprobe) guardados en la configuración.
+    """
+    if config['type'] == 'hnsw':
+        index.hnsw.efSearch = config['ef_search']
+    elif config['type'] == 'ivf':
+        faiss.extract_index_ivf(index).nprobe = config['nprobe']
+
+
+def distance_strategy(config):
+    """
+    Devuelve la estrategia de distancia de LangChain asociada al índice.
+    """
+    return 'COSINE' if config['type'] in L2_TYPES else 'MAX_INNER_PRODUCT'
+
+
+class StoreWriter:
+    """
+    Construye un almacén vectorial de forma incremental: los vectores se añaden al índice
+    FAISS y los documentos al docstore SQLite a medida que llegan, sin mantener el corpus
+    en memoria. Los índices que requieren entrenamiento (IVF, SQ8, PQ, PCA) se entrenan al
+    final con una muestra uniforme de todo el corpus (muestreo de reservorio), no con los
+    primeros artículos del CSV; mientras tanto los vectores se vuelcan a un fichero temporal.
+    """
+
+    def __init__(self, persist_dir, config, train_size=TRAIN_SIZE, with_ids=False, seed=0):
+        """
+        Args:
+            persist_dir (str): Carpeta de destino del almacén.
+            config (dict): Configuración del índice (ver INDEX_CONFIGS).
+            train_size (int): Tamaño de la muestra de entrenamiento del índice.
+            with_ids (bool): Guardar cada vector con el identificador indicado en add
+                (IndexIDMap2) en lugar de su posición, como en los fragmentos.
+            seed (int): Semilla del muestreo de entrenamiento.
+        """
+        self.persist_dir = persist_dir
+        self.config = dict(config)
+        self.train_size = train_size
+        self.with_ids = with_ids
+        self.trained = self.config['type'] in TRAINED_TYPES
+        self.index = None
+        self.next_id = 0
+
+        # Muestra de entrenamiento y número de vectores vistos
+        self.rng = np.random.default_rng(seed)
+        self.sample = None
+        self.seen = 0
+
+        os.makedirs(persist_dir, exist_ok=True)
+        self.docstore_path = os.path.join(persist_dir, DOCSTORE_FILE)
+        if os.path.exists(self.docstore_path + '.tmp'):
+            os.remove(self.docstore_path + '.tmp')
+        self.docstore = SQLiteDocstore(self.docstore_path + '.tmp', read_only=False)
+
+        # Vectores originales para reordenar los candidatos de un índice comprimido; los
+        # índices entrenados también los usan para añadirlos tras el entrenamiento
+        self.vectors_path = os.path.join(persist_dir, VECTORS_FILE)
+        keep_vectors = self.config.get('refine') or self.trained
+        self.vectors_file = open(self.vectors_path + '.tmp', 'wb') if keep_vectors else None
+        self.vector_ids = []
+
+    def add(self, docs, vectors, ids=None):
+        """
+        Añade un lote de documentos con sus embeddings.
+
+        Args:
+            docs (List[Document]): Documentos del lote.
+            vectors: Embeddings de los documentos.
+            ids (List[int]): Identificadores de los documentos (por defecto, consecutivos).
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if ids is None:
+            ids = list(range(self.next_id, self.next_id + len(docs)))
+        self.next_id = max(self.next_id, max(ids, default=-1) + 1)
+
+        self.docstore.add(dict(zip(ids, docs)))
+        if self.vectors_file is not None:
+            self.vectors_file.write(np.ascontiguousarray(vectors).tobytes())
+            self.vector_ids.extend(ids)
+
+        if self.trained:
+            self._update_sample(vectors)
+            return
+        if self.index is None:
+            self.config = resolve_config(self.config, len(vectors), vectors.shape[1])
+            self.index = self._wrap(create_index(self.config, vectors.shape[1]))
+        self._add_vectors(vectors, ids)
+
+    def _update_sample(self, vectors):
+        """
+        Muestreo de reservorio: tras ver n vectores, cada uno está en la muestra con
+        probabilidad train_size / n.
+        """
+        if self.sample is None:
+            self.sample = np.empty((self.train_size, vectors.shape[1]), dtype=np.float32)
+        n_fill = max(0, min(len(vectors), self.train_size - self.seen))
+        self.sample[self.seen:self.seen + n_fill] = vectors[:n_fill]
+        positions = self.seen + np.arange(n_fill, len(vectors))
+        slots = (self.rng.random(len(positions)) * (positions + 1)).astype(np.int64)
+        for i in np.flatnonzero(slots < self.train_size):
+            self.sample[slots[i]] = vectors[n_fill + i]
+        self.seen += len(vectors)
+
+    def _wrap(self, index):
+        return faiss.IndexIDMap2(index) if self.with_ids else index
+
+    def _add_vectors(self, vectors, ids):
+        if self.with_ids:
+            self.index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+        else:
+            self.index.add(vectors)
+
+    def _train_and_fill(self, batch_size=10000):
+        """
+        Entrena el índice con la muestra y le añade todos los vectores volcados a disco.
+        """
+        train_vectors = self.sample[:min(self.seen, self.train_size)]
+        d = train_vectors.shape[1]
+        self.config = resolve_config(self.config, self.seen, d)
+        self.index = self._wrap(create_index(self.config, d, train_vectors=train_vectors))
+        self.sample = None
+
+        self.vectors_file.flush()
+        vectors = np.memmap(self.vectors_path + '.tmp', dtype=np.float32, mode='r').reshape(-1, d)
+        for start in range(0, len(vectors), batch_size):
+            self._add_vectors(np.array(vectors[start:start + batch_size]),
+                              self.vector_ids[start:start + batch_size])
+        del vectors
+
+    def close(self):
+        """
+        Escribe el índice y la configuración y publica el docstore.
+
+        Returns:
+            faiss.Index: Índice construido.
+        """
+        if not self.seen and self.index is None:
+            raise ValueError(f"No se ha añadido ningún documento a {self.persist_dir}")
+        if self.trained:
+            self._train_and_fill()
+
+        # La búsqueda MMR reconstruye vectores, lo que en IVF requiere el mapa directo
+        if self.config['type'] == 'ivf':
+            faiss.extract_index_ivf(self.index).make_direct_map()
+
+        faiss.write_index(self.index, os.path.join(self.persist_dir, INDEX_FILE))
+        self.docstore.connection.close()
+        os.replace(self.docstore_path + '.tmp', self.docstore_path)
+
+        # Un manifiesto incremental anterior ya no describe el almacén reconstruido
+        manifest_path = os.path.join(self.persist_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        if self.vectors_file is not None:
+            self.vectors_file.close()
+            if not self.config.get('refine'):
+                os.remove(self.vectors_path + '.tmp')
+            else:
+                os.replace(self.vectors_path + '.tmp', self.vectors_path)
+            # Con identificadores propios, la fila de cada vector se busca por su identificador
+            if self.config.get('refine') and self.with_ids:
+                np.save(os.path.join(self.persist_dir, VECTOR_IDS_FILE), np.asarray(self.vector_ids, dtype=np.int64))
+        save_index_config(self.persist_dir, self.config, self.index)
+        return self.index
+
+
+def shard_name(doc, n_shards, shard_by='hash'):
+    """
+    Asigna un documento a un fragmento. Todos los chunks de un artículo van al mismo.
+
+    Args:
+        doc (Document): Chunk con los metadatos de su artículo.
+        n_shards (int): Número de fragmentos.
+        shard_by (str): 'hash' reparte los artículos por el hash del título (fragmentos
+            equilibrados); 'category' por el de su primera categoría, de modo que los
+            artículos de una misma categoría comparten fragmento.
+
+    Returns:
+        str: Nombre del fragmento.
+    """
+    if shard_by == 'category':
+        categories = doc.metadata.get('categories') or []
+        if isinstance(categories, str):
+            # En el CSV las categorías se guardan como la representación de una lista
+            categories = ast.literal_eval(categories) if categories.startswith('[') else [categories]
+        key = categories[0] if categories else ''
+    elif shard_by == 'hash':
+        key = doc.metadata.get('title') or doc.page_content
+    else:
+        raise ValueError(f"Criterio de fragmentación no soportado: {shard_by}")
+    return f"shard_{zlib.crc32(str(key).encode('utf-8')) % n_shards:03d}"
+
+
+class ShardedStoreWriter:
+    """
+    Construye un almacén repartido en fragmentos (ver prototype/llm_agent/shards.py), con
+    la misma interfaz que StoreWriter. Cada fragmento es un almacén completo (índice FAISS,
+    docstore e índice BM25) que guarda los identificadores globales de sus chunks, y el
+    manifiesto shards.json enumera los fragmentos publicados junto con las estadísticas
+    BM25 del corpus completo, con las que se puntúan todos los fragmentos.
+
+    Cada construcción escribe los fragmentos en carpetas con una versión nueva. Los que
+    tienen exactamente el mismo contenido que en el manifiesto anterior se descartan, de
+    modo que los procesos en ejecución solo recargan los fragmentos que han cambiado.
+    """
+
+    def __init__(self, persist_dir, config, n_shards, shard_by='hash', train_size=TRAIN_SIZE):
+        """
+        Args:
+            persist_dir (str): Carpeta del almacén fragmentado.
+            config (dict): Configuración del índice de cada fragmento (ver INDEX_CONFIGS).
+            n_shards (int): Número de fragmentos.
+            shard_by (str): Criterio de reparto ('hash' o 'category', ver shard_name).
+            train_size (int): Tamaño de la muestra de entrenamiento de cada índice.
+        """
+        self.persist_dir = persist_dir
+        self.config = dict(config)
+        self.n_shards = n_shards
+        self.shard_by = shard_by
+        self.train_size = train_size
+        self.version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        self.writers = {}
+        self.digests = {}
+        self.next_id = 0
+        os.makedirs(persist_dir, exist_ok=True)
+
+    def add(self, docs, vectors, ids=None):
+        """
+        Reparte un lote de documentos con sus embeddings entre los fragmentos.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if ids is None:
+            ids = list(range(self.next_id, self.next_id + len(docs)))
+        self.next_id = max(self.next_id, max(ids, default=-1) + 1)
+
+        groups = {}
+        for position, doc in enumerate(docs):
+            groups.setdefault(shard_name(doc, self.n_shards, self.shard_by), []).append(position)
+
+        for name, positions in groups.items():
+            if name not in self.writers:
+                path = os.path.join(self.persist_dir, f'{name}.{self.version}')
+                self.writers[name] = StoreWriter(path, self.config, self.train_size, with_ids=True)
+                self.digests[name] = hashlib.sha256()
+            shard_docs = [docs[i] for i in positions]
+            shard_ids = [ids[i] for i in positions]
+            self.writers[name].add(shard_docs, vectors[positions], shard_ids)
+
+            digest = self.digests[name]
+            for doc_id, doc in zip(shard_ids, shard_docs):
+                digest.update(f'{doc_id}\x00{doc.page_content}\x00'.encode('utf-8'))
+
+    def close(self):
+        """
+        Escribe los fragmentos y sus índices BM25, publica el manifiesto con las estadísticas
+        BM25 del corpus completo y elimina las versiones que ya no se usan (se conserva la
+        anterior para las búsquedas en curso).
+
+        Returns:
+            dict: Manifiesto publicado.
+        """
+        previous = read_manifest(self.persist_dir) if os.path.exists(
+            os.path.join(self.persist_dir, SHARDS_FILE)) else {'shards': []}
+        previous_shards = {shard['name']: shard for shard in previous['shards']}
+
+        shards = []
+        for name in sorted(self.writers):
+            writer = self.writers[name]
+            index = writer.close()
+            digest = self.digests[name].hexdigest()
+
+            old = previous_shards.get(name)
+            old_path = os.path.join(self.persist_dir, old['path']) if old is not None else None
+            if old is not None and old.get('digest') == digest and os.path.exists(old_path) and \
+                    BM25Index.has_counts(old_path):
+                # Mismo contenido: se mantiene la versión publicada
+                shutil.rmtree(writer.persist_dir)
+                shards.append(old)
+                continue
+
+            # Índice BM25 del fragmento, con los identificadores globales como filas. Se guardan
+            # también las frecuencias sin ponderar para puntuar con las estadísticas globales
+            docstore = SQLiteDocstore(os.path.join(writer.persist_dir, DOCSTORE_FILE))
+            ids, texts = [], []
+            for doc_id, doc in docstore.iter_documents():
+                ids.append(doc_id)
+                texts.append(doc.page_content)
+            docstore.connection.close()
+            BM25Index.build(texts, ids=ids, keep_counts=True).save(writer.persist_dir)
+
+            shards.append({
+                'name': name,
+                'path': os.path.basename(writer.persist_dir),
+                'version': self.version,
+                'digest': digest,
+                'ntotal': int(index.ntotal),
+            })
+
+        # Estadísticas BM25 del corpus completo: cada fragmento tiene su propio IDF y longitud
+        # media, que no son comparables entre fragmentos de tamaños o temas distintos
+        shard_stats = []
+        for shard in shards:
+            with open(os.path.join(self.persist_dir, shard['path'], STATS_FILE), encoding='utf-8') as f:
+                shard_stats.append(json.load(f))
+        stats = corpus_stats(shard_stats)
+        df_file = f'bm25_df.{self.version}.json'
+        with open(os.path.join(self.persist_dir, df_file), 'w', encoding='utf-8') as f:
+            json.dump(stats['df'], f, ensure_ascii=False)
+
+        manifest = {
+            **self.config,
+            'shard_by': self.shard_by,
+            'n_shards': self.n_shards,
+            'distance_strategy': distance_strategy(self.config),
+            'bm25': {'n_docs': stats['n_docs'], 'avgdl': stats['avgdl'], 'df': df_file},
+            'shards': shards,
+        }
+        write_manifest(self.persist_dir, manifest)
+
+        # Solo se conservan las versiones publicadas ahora y en el manifiesto anterior
+        keep = {shard['path'] for shard in shards} | {shard['path'] for shard in previous['shards']}
+        keep |= {df_file, previous.get('bm25', {}).get('df')}
+        for entry in os.listdir(self.persist_dir):
+            path = os.path.join(self.persist_dir, entry)
+            if entry.startswith('shard_') and os.path.isdir(path) and entry not in keep:
+                shutil.rmtree(path)
+            elif entry.startswith('bm25_df.') and entry not in keep:
+                os.remove(path)
+        return manifest
+
+
+def save_index_config(persist_dir, config, index):
+    """
+    Guarda junto al índice la configuración con la que se construyó.
+    """
+    data = {
+        **config,
+        'distance_strategy': distance_strategy(config),
+        'dimension': index.d,
+        'ntotal': index.ntotal,
+    }
+    with open(os.path.join(persist_dir, CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def load_index_config(persist_dir):
+    """
+    Carga la configuración de un índice guardado. Los índices antiguos sin
+    configuración se consideran planos (IndexFlatL2).
+    """
+    path = os.path.join(persist_dir, CONFIG_FILE)
+    if not os.path.exists(path):
+        return dict(INDEX_CONFIGS['flat'])
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,222 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+import threading
+import json
+import time
+
+# Progreso de la generación: un JSONL por combinación de modelo y prompt
+CHECKPOINT_DIR = 'llm_responses/checkpoints'
+
+# Latencias y rendimiento por modelo
+STATS_FILE = 'llm_responses/generation_stats.csv'
+
+class RateLimiter:
+    """
+    Limitador de peticiones por cubo de tokens, compartido entre hilos.
+    Con rate=None no se limita el ritmo.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        """
+        Args:
+            rate (float): Peticiones por segundo permitidas.
+            burst (int): Peticiones que pueden salir seguidas sin esperar.
+        """
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Bloquea hasta que haya un token disponible."""
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Checkpoint:
+    """
+    Respuestas ya generadas de una combinación, guardadas línea a línea en un JSONL.
+    Cada línea se escribe en cuanto termina la pregunta, de modo que una ejecución
+    interrumpida se reanuda sin repetir las preguntas completadas.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.records = {}
+        if self.path.exists():
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Última línea incompleta si el proceso se cortó al escribir
+                    self.records[record['index']] = record
+
+    def __contains__(self, index):
+        return index in self.records
+
+    def add(self, record):
+        with self.lock:
+            self.records[record['index']] = record
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+
+class GenerationRunner:
+    """
+    Genera las respuestas de varias combinaciones de modelo y prompt de forma
+    concurrente. Cada modelo tiene su propio límite de peticiones simultáneas y
+    su propio ritmo máximo, ya que cada uno se sirve por separado; las combinaciones
+    de modelos distintos avanzan en paralelo.
+    """
+
+    def __init__(self, max_concurrency=4, rate=None, retries=3, checkpoint_dir=CHECKPOINT_DIR):
+        """
+        Args:
+            max_concurrency (int | dict): Peticiones simultáneas por modelo (o modelo -> valor).
+            rate (float | dict): Peticiones por segundo por modelo (None para no limitar).
+            retries (int): Intentos por pregunta antes de darla por fallida.
+            checkpoint_dir (str): Carpeta de los ficheros de progreso.
+        """
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.retries = retries
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.semaphores = {}
+        self.limiters = {}
+        self.timings = []
+        self.lock = threading.Lock()
+
+    def _setting(self, value, model_name):
+        return value.get(model_name) if isinstance(value, dict) else value
+
+    def _controls(self, model_name):
+        with self.lock:
+            if model_name not in self.semaphores:
+                self.semaphores[model_name] = threading.Semaphore(self._setting(self.max_concurrency, model_name) or 1)
+                self.limiters[model_name] = RateLimiter(self._setting(self.rate, model_name))
+            return self.semaphores[model_name], self.limiters[model_name]
+
+    def _generate(self, model_name, invoke, index, question, checkpoint):
+        """
+        Genera una respuesta respetando los límites del modelo y la guarda en el progreso.
+        Los errores se reintentan con espera exponencial; si se agotan los intentos, la
+        pregunta queda pendiente para la siguiente ejecución.
+        """
+        semaphore, limiter = self._controls(model_name)
+        for attempt in range(self.retries):
+            limiter.acquire()
+            with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = invoke(question)
+                except Exception as e:
+                    error = e
+                else:
+                    latency = time.perf_counter() - start
+                    checkpoint.add({'index': index, 'question': question, 'response': response, 'latency': latency})
+                    with self.lock:
+                        self.timings.append({'model': model_name, 'end': time.perf_counter(), 'latency': latency})
+                    return True
+            print(f'Error en {model_name} (pregunta {index}, intento {attempt + 1}): {error}')
+            if attempt < self.retries - 1:
+                time.sleep(2 ** attempt)
+        with self.lock:
+            self.timings.append({'model': model_name, 'end': time.perf_counter(), 'latency': np.nan})
+        return False
+
+    def run(self, jobs, max_workers=None):
+        """
+        Ejecuta todas las combinaciones y devuelve las respuestas de las que han terminado.
+
+        Args:
+            jobs (List[Tuple[str, str, Callable, List[str]]]): Tuplas (modelo, nombre de la
+                combinación, función pregunta -> respuesta, preguntas).
+            max_workers (int): Hilos en total (por defecto, la suma de los límites por modelo).
+
+        Returns:
+            dict: Nombre de la combinación -> lista de respuestas (None en las pendientes).
+        """
+        checkpoints = {name: Checkpoint(self.checkpoint_dir / f'{name}.jsonl') for _, name, _, _ in jobs}
+        tasks = [
+            (model_name, invoke, index, question, checkpoints[name])
+            for model_name, name, invoke, questions in jobs
+            for index, question in enumerate(questions)
+            if index not in checkpoints[name]
+        ]
+        done = sum(len(c.records) for c in checkpoints.values())
+        print(f'Preguntas por generar: {len(tasks)} ({done} recuperadas del progreso guardado)')
+
+        if max_workers is None:
+            models = {model_name for model_name, _, _, _ in jobs}
+            max_workers = sum(self._setting(self.max_concurrency, m) or 1 for m in models)
+
+        self.start = time.perf_counter()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            # Se intercalan las combinaciones para que todos los modelos trabajen desde el principio
+            order = sorted(range(len(tasks)), key=lambda i: tasks[i][2])
+            futures = [executor.submit(self._generate, *tasks[i]) for i in order]
+            for completed, future in enumerate(as_completed(futures), start=1):
+                failed += not future.result()
+                if completed % 50 == 0 or completed == len(futures):
+                    print(f'Respuestas generadas: {completed - failed}/{len(futures)} ({failed} con error)')
+
+        return {
+            name: [
+                checkpoints[name].records[i]['response'] if i in checkpoints[name] else None
+                for i in range(len(questions))
+            ]
+            for _, name, _, questions in jobs
+        }
+
+    def stats(self):
+        """
+        Resume las latencias y el rendimiento de la última ejecución.
+
+        Returns:
+            DataFrame: Una fila por modelo con peticiones, errores, rendimiento y percentiles de latencia.
+        """
+        columns = ['model', 'requests', 'errors', 'throughput_rps', 'latency_mean',
+                   'latency_p50', 'latency_p90', 'latency_p99', 'latency_max']
+        if not self.timings:
+            return pd.DataFrame(columns=columns)
+
+        df = pd.DataFrame(self.timings)
+        rows = []
+        for model_name, group in df.groupby('model', sort=True):
+            latencies = group['latency'].dropna().to_numpy()
+            elapsed = group['end'].max() - self.start
+            rows.append({
+                'model': model_name,
+                'requests': len(latencies),
+                'errors': int(group['latency'].isna().sum()),
+                'throughput_rps': len(latencies) / elapsed if elapsed > 0 else np.nan,
+                'latency_mean': latencies.mean() if len(latencies) else np.nan,
+                **{
+                    f'latency_p{q}': np.percentile(latencies, q) if len(latencies) else np.nan
+                    for q in (50, 90, 99)
+                },
+                'latency_max': latencies.max() if len(latencies) else np.nan,
+            })
+        return pd.DataFrame(rows, columns=columns).round(4)
+
+    def save_stats(self, path=STATS_FILE):
+        stats = self.stats()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        stats.to_csv(path, index=False)
+        return stats
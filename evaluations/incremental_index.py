@@ -0,0 +1,178 @@
+import sys
+sys.path.append("../prototype/llm_agent")
+from langchain_huggingface import HuggingFaceEmbeddings
+from embedding_cache import CachedEmbeddings
+from faiss_indexes import INDEX_CONFIGS, MANIFEST_FILE, create_index, save_index_config
+from vector_store import INDEX_FILE, DOCSTORE_FILE, SQLiteDocstore
+from bm25_index import BM25Index
+from test_store import import_data, split_documents
+from datetime import datetime, timezone
+import numpy as np
+import hashlib
+import faiss
+import json
+import os
+
+# Solo los índices planos admiten eliminar vectores de forma exacta
+INCREMENTAL_INDEX_TYPES = ['flat', 'flat_ip']
+
+def article_hash(doc):
+    """
+    Calcula el hash del contenido y las categorías de un artículo.
+    """
+    text = doc.page_content + '\x00' + str(doc.metadata['categories'])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def load_manifest(persist_dir):
+    """
+    Carga el manifiesto del índice incremental, o None si el almacén no tiene uno.
+    """
+    path = os.path.join(persist_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def update_store(persist_dir, docs, embed_model, size, index_type='flat'):
+    """
+    Actualiza un almacén vectorial procesando solo los artículos nuevos, modificados o eliminados.
+
+    Si el almacén no tiene manifiesto se construye desde cero con un índice con
+    identificadores (IndexIDMap2), que permite eliminar los vectores de un artículo.
+
+    Args:
+        persist_dir (str): Carpeta del almacén.
+        docs (List[Document]): Artículos actuales del corpus.
+        embed_model: Modelo de embeddings de LangChain.
+        size (str): Tamaño de chunk ('full' o número de caracteres).
+        index_type (str): Tipo de índice base ('flat' o 'flat_ip').
+
+    Returns:
+        dict: Resumen de la actualización.
+    """
+    if index_type not in INCREMENTAL_INDEX_TYPES:
+        raise ValueError(f"El modo incremental solo admite los índices {INCREMENTAL_INDEX_TYPES}")
+
+    config = INDEX_CONFIGS[index_type]
+    index_path = os.path.join(persist_dir, INDEX_FILE)
+    manifest = load_manifest(persist_dir)
+    os.makedirs(persist_dir, exist_ok=True)
+
+    if manifest is None:
+        # Primera ejecución: se descarta cualquier almacén previo sin identificadores
+        for filename in [INDEX_FILE, DOCSTORE_FILE]:
+            if os.path.exists(os.path.join(persist_dir, filename)):
+                os.remove(os.path.join(persist_dir, filename))
+        d = len(embed_model.embed_query("texto de ejemplo"))
+        index = faiss.IndexIDMap2(create_index(config, d))
+        manifest = {'version': 0, 'next_id': 0, 'articles': {}}
+    else:
+        index = faiss.read_index(index_path)
+        # Un manifiesto junto a un índice sin identificadores no corresponde a este almacén
+        # (p. ej. tras reconstruirlo con test_store.py): no se modifica nada
+        if not isinstance(index, faiss.IndexIDMap2):
+            raise ValueError(
+                f"El índice de {persist_dir} no es un IndexIDMap2, por lo que no se creó en modo incremental. "
+                f"Elimine {MANIFEST_FILE} para reconstruirlo desde cero."
+            )
+
+    docstore = SQLiteDocstore(os.path.join(persist_dir, DOCSTORE_FILE), read_only=False)
+
+    # Si una ejecución anterior se interrumpió antes de publicar el manifiesto, el índice y
+    # el docstore pueden tener filas con identificadores >= next_id que el manifiesto no
+    # conoce. Se eliminan para no repetir esos identificadores con otros chunks.
+    orphans = index.remove_ids(faiss.IDSelectorRange(manifest['next_id'], np.iinfo(np.int64).max))
+    orphan_ids = [row[0] for row in docstore.connection.execute(
+        "SELECT id FROM documents WHERE id >= ?", (manifest['next_id'],))]
+    docstore.delete(orphan_ids)
+    if orphans or orphan_ids:
+        print(f"Eliminadas filas de una actualización interrumpida: {orphans} vectores, {len(orphan_ids)} documentos")
+
+    current = {doc.metadata['title']: (article_hash(doc), doc) for doc in docs}
+    articles = manifest['articles']
+
+    removed = [title for title in articles if title not in current]
+    changed = [title for title, (h, _) in current.items() if title in articles and articles[title]['hash'] != h]
+    added = [title for title in current if title not in articles]
+
+    # Eliminar los vectores de los artículos borrados o modificados
+    stale_ids = [i for title in removed + changed for i in articles[title]['ids']]
+    if stale_ids:
+        index.remove_ids(np.asarray(stale_ids, dtype=np.int64))
+        docstore.delete(stale_ids)
+    for title in removed:
+        del articles[title]
+
+    # Volver a trocear e indexar solo los artículos nuevos o modificados
+    pending = [current[title][1] for title in changed + added]
+    chunks = pending if size == 'full' else split_documents(pending, int(size))
+
+    if chunks:
+        ids = np.arange(manifest['next_id'], manifest['next_id'] + len(chunks), dtype=np.int64)
+        vectors = np.asarray(embed_model.embed_documents([doc.page_content for doc in chunks]), dtype=np.float32)
+        index.add_with_ids(vectors, ids)
+        docstore.add(dict(zip(ids.tolist(), chunks)))
+        manifest['next_id'] = int(ids[-1]) + 1
+
+        for title in changed + added:
+            articles[title] = {'hash': current[title][0], 'ids': []}
+        for i, doc in zip(ids.tolist(), chunks):
+            articles[doc.metadata['title']]['ids'].append(i)
+
+    # El índice BM25 se reconstruye desde el docstore, sin recalcular embeddings
+    if stale_ids or chunks or orphan_ids:
+        doc_ids, texts = [], []
+        for i, doc in docstore.iter_documents():
+            doc_ids.append(i)
+            texts.append(doc.page_content)
+        # Con el corpus vacío se guarda un índice BM25 vacío
+        BM25Index.build(texts, ids=doc_ids).save(persist_dir)
+
+    docstore.connection.close()
+
+    # Escritura atómica del índice y del sello de versión
+    tmp_path = index_path + '.tmp'
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, index_path)
+    save_index_config(persist_dir, config, index)
+
+    manifest['version'] += 1
+    manifest['updated_at'] = datetime.now(timezone.utc).isoformat()
+    manifest_path = os.path.join(persist_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    return {
+        'version': manifest['version'],
+        'added': len(added),
+        'changed': len(changed),
+        'removed': len(removed),
+        'chunks': len(chunks),
+        'ntotal': index.ntotal,
+    }
+
+if __name__ == '__main__':
+    model_list = [
+        ['minilm', 'paraphrase-multilingual-MiniLM-L12-v2'],
+        ['mpnet', 'paraphrase-multilingual-mpnet-base-v2']
+    ]
+    size_list = ['full', '512', '1024']
+    file_path = 'data/wikipedia_jaen.csv'
+
+    docs = import_data(file_path)
+
+    for model_name, model_path in model_list:
+        model_kwargs = {'device': 'cuda'}
+        encode_kwargs = {'normalize_embeddings': True}
+        embed_model = HuggingFaceEmbeddings(
+            model_name=f'sentence-transformers/{model_path}',  # Ruta sustituida
+            model_kwargs=model_kwargs,
+            encode_kwargs=encode_kwargs,
+        )
+        embed_model = CachedEmbeddings(embed_model)  # Caché de embeddings en disco
+
+        for size in size_list:
+            persist_dir = f"storage/faiss_index_{model_name}_{size}"
+            summary = update_store(persist_dir, docs, embed_model, size)
+            print(f'ACTUALIZADO: {model_name} {size} {summary}')
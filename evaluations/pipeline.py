@@ -0,0 +1,390 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import product
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+import pandas as pd
+import subprocess
+import argparse
+import hashlib
+import json
+import glob
+import time
+import sys
+import os
+
+# Estado del pipeline: claves de cada celda ejecutada, huellas de ficheros e informes
+STATE_DIR = '.pipeline'
+
+MODELS = ['minilm', 'mpnet']
+SIZES = ['full', '512', '1024']
+
+# Rutas que pueden depender de los parámetros de la celda (p. ej. '{model}')
+Paths = Union[List[str], Callable[[dict], List[str]]]
+
+@dataclass
+class Stage:
+    """
+    Etapa del pipeline: un script que lee unos ficheros y escribe otros.
+
+    Attributes:
+        name (str): Nombre de la etapa.
+        script (str): Script que se ejecuta.
+        inputs (List[str]): Ficheros, carpetas o patrones glob de entrada.
+        outputs (List[str]): Ficheros, carpetas o patrones glob de salida.
+        code (List[str]): Módulos de los que depende el script, además de él mismo.
+        deps (List[str]): Etapas que deben terminar antes.
+        grid (Dict[str, list]): Parámetros de la rejilla; cada combinación es una celda.
+        args (Callable): Argumentos de línea de comandos de una celda.
+        params (dict): Configuración adicional que forma parte de la clave.
+        max_parallel (int): Celdas de esta etapa que pueden ejecutarse a la vez.
+    """
+    name: str
+    script: str
+    inputs: Paths = field(default_factory=list)
+    outputs: Paths = field(default_factory=list)
+    code: List[str] = field(default_factory=list)
+    deps: List[str] = field(default_factory=list)
+    grid: Dict[str, list] = field(default_factory=dict)
+    args: Callable[[dict], List[str]] = lambda cell: []
+    params: dict = field(default_factory=dict)
+    max_parallel: int = 1
+
+    def cells(self):
+        keys = list(self.grid)
+        return [dict(zip(keys, values)) for values in product(*self.grid.values())] or [{}]
+
+    def paths(self, paths, cell):
+        paths = paths(cell) if callable(paths) else paths
+        return [p.format(**cell) for p in paths]
+
+LLM_AGENT = '../prototype/llm_agent'
+
+# Declaración de las etapas, desde el corpus hasta el resumen de resultados
+STAGES = [
+    Stage(
+        name='download',
+        script='download_wikipedia.py',
+        outputs=['data/wikipedia_jaen.csv'],
+        params={'category': 'Provincia de Jaén'},
+    ),
+    Stage(
+        name='stats',
+        script='data_stats.py',
+        deps=['download'],
+        inputs=['data/wikipedia_jaen.csv'],
+        outputs=['stats/token_counts.csv', 'stats/token_stats.csv'],
+    ),
+    Stage(
+        name='store',
+        script='test_store.py',
+        deps=['download', 'stats'],
+        code=['faiss_indexes.py', 'embedding_cache.py', 'data_stats.py',
+              f'{LLM_AGENT}/vector_store.py', f'{LLM_AGENT}/bm25_index.py'],
+        grid={'model': MODELS, 'size': SIZES},
+        args=lambda cell: ['--models', cell['model'], '--sizes', cell['size']],
+        inputs=['data/wikipedia_jaen.csv', 'stats/token_counts.csv'],
+        outputs=['storage/faiss_index_{model}_{size}'],
+    ),
+    Stage(
+        name='contexts',
+        script='test_contexts.py',
+        deps=['store'],
+        code=['embedding_cache.py', 'query_rewriting.py', 'artifacts.py', f'{LLM_AGENT}/vector_store.py'],
+        grid={'model': MODELS, 'size': SIZES},
+        args=lambda cell: ['--models', cell['model'], '--sizes', cell['size']],
+        inputs=['storage/faiss_index_{model}_{size}', 'data/preguntas_wikipedia_jaen_*.csv'],
+        outputs=['faiss_contexts/{model}_{size}_*.parquet'],
+        max_parallel=2,
+    ),
+    Stage(
+        name='reranking',
+        script='test_reranking.py',
+        deps=['contexts'],
+        code=['artifacts.py'],
+        inputs=['faiss_contexts/mpnet_full_similarity20.parquet'],
+        outputs=['reranking/*.parquet'],
+    ),
+    Stage(
+        name='contexts_eval',
+        script='test_contexts_eval.py',
+        deps=['contexts'],
+        code=['eval_runner.py', 'context_metrics.py', 'artifacts.py'],
+        inputs=['faiss_contexts/*.parquet'],
+        outputs=['faiss_evaluated/*.csv'],
+    ),
+    Stage(
+        name='reranking_eval',
+        script='test_reranking_eval.py',
+        deps=['reranking'],
+        code=['eval_runner.py', 'context_metrics.py', 'artifacts.py'],
+        inputs=['reranking/*.parquet'],
+        outputs=['reranking_evaluated/*.csv'],
+    ),
+    Stage(
+        name='resume',
+        script='test_resume.py',
+        deps=['contexts_eval', 'reranking_eval'],
+        inputs=['faiss_evaluated/*.csv', 'reranking_evaluated/*.csv'],
+        outputs=['stats/faiss_evaluated_*.csv', 'stats/reranking_evaluated_*.csv'],
+    ),
+]
+
+class FileHasher:
+    """
+    Calcula el hash del contenido de ficheros y carpetas. Los hashes se guardan junto
+    con el tamaño y la fecha de modificación, de modo que solo se vuelven a leer los
+    ficheros que han cambiado.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.cache = json.loads(self.path.read_text(encoding='utf-8')) if self.path.exists() else {}
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        entry = self.cache.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['hash']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.cache[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def files(self, patterns):
+        """Expande patrones y carpetas en la lista ordenada de ficheros que contienen."""
+        files = set()
+        for pattern in patterns:
+            for path in glob.glob(pattern) or []:
+                if os.path.isdir(path):
+                    files.update(str(p) for p in Path(path).rglob('*') if p.is_file())
+                else:
+                    files.add(path)
+        return sorted(files)
+
+    def hash(self, patterns):
+        """
+        Hash conjunto de todos los ficheros que corresponden a los patrones, o None si no hay ninguno.
+        """
+        files = self.files(patterns)
+        if not files:
+            return None
+        digest = hashlib.sha256()
+        for path in files:
+            digest.update(f'{path}\0{self.file_hash(path)}\n'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.cache), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+def cell_id(stage, cell):
+    return stage.name + ''.join(f'[{k}={v}]' for k, v in cell.items())
+
+def depends_on(cell, dep_cell):
+    """Una celda depende de las celdas de otra etapa que coinciden en los parámetros comunes."""
+    return all(cell[k] == v for k, v in dep_cell.items() if k in cell)
+
+class Pipeline:
+    """
+    Ejecuta las etapas en orden de dependencias. Cada celda tiene una clave que combina
+    el hash de sus entradas, el de su código y su configuración; si la clave coincide con
+    la de la última ejecución y las salidas no han cambiado, la celda se omite.
+    """
+
+    def __init__(self, stages=STAGES, state_dir=STATE_DIR, workers=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_dir = Path(state_dir)
+        self.state_file = self.state_dir / 'state.json'
+        self.state = json.loads(self.state_file.read_text(encoding='utf-8')) if self.state_file.exists() else {}
+        self.hasher = FileHasher(self.state_dir / 'file_hashes.json')
+        self.workers = workers or os.cpu_count() or 1
+        self.timings = []
+
+    def key(self, stage, cell):
+        """Clave de contenido de una celda: entradas, código y configuración."""
+        code = [stage.script] + stage.code
+        data = {
+            'stage': stage.name,
+            'cell': cell,
+            'params': stage.params,
+            'args': stage.args(cell),
+            'code': {path: self.hasher.hash([path]) for path in code},
+            'inputs': self.hasher.hash(stage.paths(stage.inputs, cell)),
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_cached(self, stage, cell, key):
+        entry = self.state.get(cell_id(stage, cell))
+        if not entry or entry['key'] != key:
+            return False
+        # Las salidas deben seguir siendo las que produjo esa ejecución
+        return entry['outputs'] is not None and entry['outputs'] == self.hasher.hash(stage.paths(stage.outputs, cell))
+
+    def run_cell(self, stage, cell, log_dir):
+        """Ejecuta el script de una celda y guarda su salida en un log."""
+        command = [sys.executable, stage.script] + stage.args(cell)
+        log_path = log_dir / f'{cell_id(stage, cell)}.log'
+        start = time.perf_counter()
+        with open(log_path, 'w', encoding='utf-8') as log:
+            result = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+        return result.returncode, time.perf_counter() - start, log_path
+
+    def plan(self, targets=None):
+        """Etapas a ejecutar: las pedidas y todas sus dependencias."""
+        if not targets:
+            return list(self.stages)
+        selected = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in selected:
+                selected.add(name)
+                pending.extend(self.stages[name].deps)
+        return [name for name in self.stages if name in selected]
+
+    def run(self, targets=None, force=(), dry_run=False):
+        """
+        Ejecuta el pipeline. Las celdas listas (con sus dependencias terminadas) se lanzan
+        en paralelo, respetando el límite de cada etapa.
+
+        Args:
+            targets (List[str]): Etapas finales que se quieren obtener (por defecto, todas).
+            force (Iterable[str]): Etapas que se ejecutan aunque estén en caché.
+            dry_run (bool): Si es True, solo se indica qué celdas se ejecutarían.
+
+        Returns:
+            DataFrame: Informe de tiempos por celda.
+        """
+        names = self.plan(targets)
+        log_dir = self.state_dir / 'logs'
+        log_dir.mkdir(parents=True, exist_ok=True)
+
+        cells = [(self.stages[name], cell) for name in names for cell in self.stages[name].cells()]
+        done = set()
+        failed = set()
+        pending = set()  # Celdas que se ejecutarían (solo con dry_run)
+        running = {}
+        running_per_stage = {name: 0 for name in names}
+
+        def ready(stage, cell):
+            for dep in stage.deps:
+                if dep not in names:
+                    continue
+                for dep_cell in self.stages[dep].cells():
+                    if depends_on(cell, dep_cell) and cell_id(self.stages[dep], dep_cell) not in done:
+                        return False
+            return True
+
+        def upstream(stage, cell, cids):
+            return any(
+                cell_id(self.stages[dep], dep_cell) in cids
+                for dep in stage.deps if dep in names
+                for dep_cell in self.stages[dep].cells() if depends_on(cell, dep_cell)
+            )
+
+        def blocked(stage, cell):
+            return upstream(stage, cell, failed)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while cells or running:
+                # Lanzar todas las celdas cuyas dependencias ya han terminado
+                for stage, cell in list(cells):
+                    cid = cell_id(stage, cell)
+                    if blocked(stage, cell):
+                        cells.remove((stage, cell))
+                        failed.add(cid)
+                        self.timings.append({'stage': stage.name, 'cell': cid, 'status': 'bloqueada', 'seconds': 0.0})
+                        continue
+                    if not ready(stage, cell) or running_per_stage[stage.name] >= stage.max_parallel:
+                        continue
+                    cells.remove((stage, cell))
+
+                    # En dry_run, las celdas que dependen de una pendiente también se ejecutarían:
+                    # sus entradas cambiarán, así que no se consulta su caché
+                    key = self.key(stage, cell)
+                    stale = dry_run and upstream(stage, cell, pending)
+                    if not stale and stage.name not in force and self.is_cached(stage, cell, key):
+                        done.add(cid)
+                        self.timings.append({'stage': stage.name, 'cell': cid, 'status': 'en caché', 'seconds': 0.0})
+                        print(f'[en caché] {cid}')
+                        continue
+                    if dry_run:
+                        done.add(cid)
+                        pending.add(cid)
+                        self.timings.append({'stage': stage.name, 'cell': cid, 'status': 'pendiente', 'seconds': 0.0})
+                        print(f'[pendiente] {cid}')
+                        continue
+
+                    print(f'[ejecutando] {cid}')
+                    running_per_stage[stage.name] += 1
+                    running[executor.submit(self.run_cell, stage, cell, log_dir)] = (stage, cell, key)
+
+                if not running:
+                    if cells and not any(ready(s, c) for s, c in cells):
+                        raise RuntimeError('Dependencias circulares o no resolubles en el pipeline')
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, cell, key = running.pop(future)
+                    running_per_stage[stage.name] -= 1
+                    cid = cell_id(stage, cell)
+                    returncode, seconds, log_path = future.result()
+
+                    if returncode == 0:
+                        done.add(cid)
+                        self.state[cid] = {
+                            'key': key,
+                            'outputs': self.hasher.hash(stage.paths(stage.outputs, cell)),
+                            'finished_at': datetime.now(timezone.utc).isoformat(),
+                            'seconds': seconds,
+                        }
+                        self.save_state()
+                        status = 'ejecutada'
+                    else:
+                        failed.add(cid)
+                        status = 'error'
+                        print(f'ERROR en {cid} (código {returncode}), ver {log_path}')
+                    self.timings.append({'stage': stage.name, 'cell': cid, 'status': status, 'seconds': seconds})
+                    print(f'[{status}] {cid} en {seconds:.1f} s')
+
+        return self.report()
+
+    def save_state(self):
+        self.hasher.save()
+        tmp = self.state_file.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.state, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp, self.state_file)
+
+    def report(self):
+        """Guarda y muestra el informe de tiempos por celda y por etapa."""
+        self.hasher.save()
+        timings = pd.DataFrame(self.timings, columns=['stage', 'cell', 'status', 'seconds'])
+        timings.to_csv(self.state_dir / 'timings.csv', index=False)
+        if not timings.empty:
+            summary = timings.groupby('stage', sort=False).agg(
+                cells=('cell', 'count'),
+                executed=('status', lambda s: int((s == 'ejecutada').sum())),
+                cached=('status', lambda s: int((s == 'en caché').sum())),
+                seconds=('seconds', 'sum'),
+            )
+            print('\nTiempos por etapa:')
+            print(summary.to_string())
+        return timings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ejecuta el pipeline de evaluación de forma incremental.")
+    parser.add_argument('targets', nargs='*', help="Etapas a obtener (por defecto, todas).")
+    parser.add_argument('--force', nargs='*', default=[], help="Etapas que se ejecutan aunque estén en caché.")
+    parser.add_argument('--workers', type=int, default=None, help="Celdas en paralelo como máximo.")
+    parser.add_argument('--dry-run', action='store_true', help="Mostrar qué se ejecutaría sin hacerlo.")
+    args = parser.parse_args()
+
+    Pipeline(workers=args.workers).run(args.targets, force=args.force, dry_run=args.dry_run)
@@ -0,0 +1,81 @@
+import spacy
+import json
+import os
+
+# Modelo de spaCy usado para reescribir las consultas
+SPACY_MODEL = 'es_core_news_lg'
+
+# Componentes que no intervienen en el etiquetado POS y no se cargan
+EXCLUDED_COMPONENTS = ['parser', 'ner', 'lemmatizer', 'senter']
+
+# Consultas reescritas ya calculadas, reutilizables entre barridos
+CACHE_FILE = 'cache/ner_queries.json'
+
+def load_pipeline(model=SPACY_MODEL):
+    """
+    Carga el pipeline de spaCy solo con los componentes necesarios para obtener las etiquetas POS.
+    """
+    return spacy.load(model, exclude=EXCLUDED_COMPONENTS)
+
+def extraer_sustantivos(doc):
+    """
+    Extrae los sustantivos comunes y propios de un documento spaCy.
+    """
+    palabras_filtradas = [token.text for token in doc if token.pos_ in ("NOUN", "PROPN")]
+    return " ".join(palabras_filtradas)
+
+def save_cache(cache_path, new_entries):
+    """
+    Añade consultas reescritas a la caché en disco. Otros procesos (p. ej. celdas de
+    pipeline.py en paralelo) pueden estar escribiéndola a la vez: se vuelve a leer justo
+    antes de escribir y se sustituye de forma atómica mediante un fichero temporal propio
+    del proceso, de modo que nunca se lee un fichero a medias.
+
+    Args:
+        cache_path (str): Fichero JSON de la caché.
+        new_entries (dict): Modelo -> {pregunta: consulta reescrita}.
+    """
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+    for model, entries in new_entries.items():
+        cache.setdefault(model, {}).update(entries)
+
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, cache_path)
+
+def rewrite_queries(questions, nlp=None, batch_size=64, n_process=1, cache_path=CACHE_FILE):
+    """
+    Reescribe las preguntas conservando solo sus sustantivos. Las preguntas se procesan
+    por lotes con nlp.pipe y el resultado se guarda en disco para siguientes ejecuciones.
+
+    Args:
+        questions (list): Preguntas originales.
+        nlp: Pipeline de spaCy ya cargado (opcional; solo se carga si hay preguntas nuevas).
+        batch_size (int): Tamaño de lote de nlp.pipe.
+        n_process (int): Número de procesos de nlp.pipe.
+        cache_path (str): Fichero JSON con las consultas ya reescritas.
+
+    Returns:
+        list: Consulta reescrita para cada pregunta.
+    """
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            cache = json.load(f)
+    model_cache = cache.setdefault(SPACY_MODEL, {})
+
+    missing = list(dict.fromkeys(q for q in questions if q not in model_cache))
+    if missing:
+        nlp = nlp or load_pipeline()
+        for question, doc in zip(missing, nlp.pipe(missing, batch_size=batch_size, n_process=n_process)):
+            model_cache[question] = extraer_sustantivos(doc)
+
+        if cache_path:
+            save_cache(cache_path, {SPACY_MODEL: {q: model_cache[q] for q in missing}})
+
+    return [model_cache[q] for q in questions]
@@ -0,0 +1,136 @@
+import sys
+sys.path.append("../prototype/llm_agent")
+from langchain_huggingface import HuggingFaceEmbeddings
+from sentence_transformers import CrossEncoder
+from embedding_cache import CachedEmbeddings
+from artifacts import ChunkTable, read_artifact
+from context_metrics import context_scores, PRECISION, RECALL
+from retriever import DEFAULT_CONFIG, cascade_rerank
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+# Variantes de la cascada comparadas con el reranking completo (cross-encoder_5)
+CASCADE_CONFIGS = {
+    'completo': {'cascade_window': None, 'cascade_gap': None},
+    'ventana0.05': {'cascade_window': 0.05},
+    'ventana0.1': {'cascade_window': 0.1},
+    'ventana0.2': {'cascade_window': 0.2},
+    'ventana0.1_sep0.2': {'cascade_window': 0.1, 'cascade_gap': 0.2},
+    'sin_ventana_sep0.3': {'cascade_window': None, 'cascade_gap': 0.3},
+    'presupuesto100ms': {'cascade_window': None, 'cascade_gap': None, 'cascade_budget_ms': 100},
+}
+
+def dense_scores(questions, contexts, embed_model):
+    """
+    Calcula la similitud coseno entre cada pregunta y sus contextos, la misma puntuación
+    que devuelve el índice FAISS en la primera etapa.
+
+    Args:
+        questions (List[str]): Preguntas.
+        contexts (List[List[str]]): Contextos recuperados de cada pregunta.
+        embed_model (Embeddings): Modelo de embeddings normalizados.
+
+    Returns:
+        List[List[float]]: Similitud de cada contexto con su pregunta.
+    """
+    unique = list(dict.fromkeys(c for docs in contexts for c in docs))
+    vectors = np.asarray(embed_model.embed_documents(unique), dtype=np.float32)
+    position = {c: i for i, c in enumerate(unique)}
+    queries = np.asarray(embed_model.embed_documents(questions), dtype=np.float32)
+    return [
+        (vectors[[position[c] for c in docs]] @ query).tolist()
+        for query, docs in zip(queries, contexts)
+    ]
+
+def run_cascade(questions, contexts, first_scores, reranker, config):
+    """
+    Aplica la cascada a todas las preguntas.
+
+    Returns:
+        Tuple[List[List[str]], DataFrame]: Contextos seleccionados y estadísticas por pregunta.
+    """
+    selected, stats = [], []
+    for question, docs, scores in zip(questions, contexts, first_scores):
+        positions, call_stats = cascade_rerank(
+            question, docs, scores,
+            lambda pairs: reranker.predict(pairs, show_progress_bar=False),
+            config
+        )
+        selected.append([docs[i] for i in positions])
+        stats.append(call_stats)
+    return selected, pd.DataFrame(stats)
+
+def compare(selected, reference, k):
+    """
+    Solapamiento de los contextos seleccionados con los del reranking completo.
+
+    Returns:
+        Tuple[float, float]: Solapamiento medio de los top-k y fracción de preguntas con el mismo orden.
+    """
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(selected, reference)])
+    exact = np.mean([list(a) == list(b) for a, b in zip(selected, reference)])
+    return float(overlap), float(exact)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compara el reranking en cascada con el reranking completo.")
+    parser.add_argument("--device", default="cuda")
+    parser.add_argument("--n-rows", type=int, default=24, help="Preguntas usadas en las métricas de contexto.")
+    parser.add_argument("--output", default="stats/cascade_report.csv")
+    args = parser.parse_args()
+
+    # Mismos contextos de entrada y misma salida de referencia que test_reranking.py
+    chunk_table = ChunkTable()
+    df = read_artifact("faiss_contexts/mpnet_full_similarity20",
+                       columns=['question', 'retrieved_contexts', 'reference_contexts'],
+                       chunk_table=chunk_table)
+    reference = read_artifact("reranking/cross-encoder_5", columns=['retrieved_contexts'],
+                              chunk_table=chunk_table)['retrieved_contexts'].tolist()
+
+    questions = df['question'].tolist()
+    contexts = [list(docs) for docs in df['retrieved_contexts']]
+    references = df['reference_contexts'].fillna("").apply(lambda text: [text]).tolist()
+    k = DEFAULT_CONFIG['top_k']
+
+    embed_model = CachedEmbeddings(HuggingFaceEmbeddings(
+        model_name='sentence-transformers/paraphrase-multilingual-mpnet-base-v2',  # Ruta sustituida
+        model_kwargs={'device': args.device},
+        encode_kwargs={'normalize_embeddings': True},
+    ))
+    reranker = CrossEncoder("cross-encoder/mmarco-mMiniLMv2-L12-H384-v1", device=args.device)
+    first_scores = dense_scores(questions, contexts, embed_model)
+
+    # Métricas de contexto del reranking completo guardado
+    n = args.n_rows
+    base_metrics = context_scores(reference[:n], references[:n]).mean()
+
+    rows = []
+    for name, overrides in CASCADE_CONFIGS.items():
+        config = {**DEFAULT_CONFIG, 'cascade': True, **overrides}
+        selected, stats = run_cascade(questions, contexts, first_scores, reranker, config)
+        overlap, exact = compare(selected, reference, k)
+        metrics = context_scores(selected[:n], references[:n]).mean()
+
+        rows.append({
+            'config': name,
+            'pairs_mean': stats['pairs'].mean(),
+            'pairs_saved': 1 - stats['pairs'].sum() / sum(len(docs) for docs in contexts),
+            'stop_depth': int((stats['stop'] == 'depth').sum()),
+            'stop_separated': int((stats['stop'] == 'separated').sum()),
+            'stop_budget': int((stats['stop'] == 'budget').sum()),
+            'rerank_p50_ms': stats['ms'].median(),
+            'rerank_p95_ms': stats['ms'].quantile(0.95),
+            f'overlap@{k}': overlap,
+            'same_order': exact,
+            PRECISION: metrics[PRECISION],
+            RECALL: metrics[RECALL],
+            f'{PRECISION}_delta': metrics[PRECISION] - base_metrics[PRECISION],
+            f'{RECALL}_delta': metrics[RECALL] - base_metrics[RECALL],
+        })
+        print(f'COMPLETADO: {name} ({stats["pairs"].mean():.1f} pares por pregunta, solapamiento {overlap:.2f})')
+
+    report = pd.DataFrame(rows).round(4)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    report.to_csv(args.output, index=False)
+    print(report.to_string(index=False))
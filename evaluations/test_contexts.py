@@ -1,64 +1,140 @@
+import sys
+sys.path.append("../prototype/llm_agent")
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from embedding_cache import CachedEmbeddings
+from vector_store import load_store
+from query_rewriting import rewrite_queries
+from artifacts import ChunkTable, write_artifact
+import numpy as np
 import pandas as pd
-import spacy
-import json
+import argparse
 import math
 
-def prepare_data(df_orig, retriever, ner):
+def search_candidates(index, query_vectors, depth):
     """
-    Genera los contextos recuperados a partir de las preguntas del CSV original.
+    Ejecuta una única búsqueda en lote a la profundidad máxima del barrido y
+    reconstruye los vectores de los candidatos para el cálculo de MMR.
+
+    La profundidad se limita al tamaño del índice. Los índices aproximados pueden devolver
+    menos candidatos para algunas consultas: esas posiciones quedan con identificador -1
+    y vector nulo, y se descartan al derivar los resultados (como hace LangChain).
 
     Args:
-        df_orig (DataFrame): Dataset con preguntas y referencias.
-        retriever: Objeto que permite recuperar documentos relevantes.
-        ner (bool): Si True, aplica extracción de sustantivos con spaCy.
+        index (faiss.Index): Índice FAISS.
+        query_vectors (np.ndarray): Embeddings de las consultas (Q x d).
+        depth (int): Número de candidatos por consulta.
 
     Returns:
-        Tuple[dict, DataFrame]: Datos en formato JSON y DataFrame.
+        Tuple[np.ndarray, np.ndarray]: Identificadores (Q x depth') y vectores (Q x depth' x d),
+        con depth' = min(depth, index.ntotal).
     """
-    questions = df_orig['question'].tolist()
-    references = df_orig['reference'].tolist()
-    ids = df_orig['id_context'].tolist()
-    reference_contexts = df_orig['reference_contexts'].tolist()
-
-    data_list = []
-    data_dict = {}
-
-    if ner:
-        nlp = spacy.load('es_core_news_lg')
+    depth = min(depth, index.ntotal)
+    _, ids = index.search(query_vectors, depth)
+    valid = ids != -1
+    vectors = np.zeros((ids.shape[0], depth, query_vectors.shape[1]), dtype=np.float32)
+    if valid.any():
+        vectors[valid] = index.reconstruct_batch(ids[valid])
+    return ids, vectors
+
+def mmr_select(query_vectors, candidate_vectors, k, lambda_mult=0.5, valid=None):
+    """
+    Calcula Maximal Marginal Relevance para todas las consultas a la vez.
+    Sigue el mismo algoritmo voraz que LangChain: el primer documento es el más
+    similar a la consulta y, en caso de empate, se elige el candidato de menor posición.
 
-    for idx, question in enumerate(questions):
-        query = extraer_sustantivos(nlp(question)) if ner else question
+    Args:
+        query_vectors (np.ndarray): Embeddings de las consultas (Q x d).
+        candidate_vectors (np.ndarray): Vectores de los candidatos (Q x f x d).
+        k (int): Número de documentos a seleccionar.
+        lambda_mult (float): Peso entre relevancia y diversidad.
+        valid (np.ndarray): Candidatos existentes (Q x f); por defecto, todos.
 
-        retrieved_docs = retriever.invoke(query)
-        retrieved_contexts = [{'content': doc.page_content, 'metadata': doc.metadata} for doc in retrieved_docs]
+    Returns:
+        np.ndarray: Posiciones seleccionadas dentro de los candidatos (Q x k), con -1
+        cuando una consulta tiene menos de k candidatos.
+    """
+    queries = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    norms = np.linalg.norm(candidate_vectors, axis=2, keepdims=True)
+    candidates = candidate_vectors / np.where(norms > 0, norms, 1)
+
+    query_similarity = np.einsum('qd,qfd->qf', queries, candidates)
+    if valid is not None:
+        query_similarity[~valid] = -np.inf
+    candidate_similarity = np.einsum('qfd,qgd->qfg', candidates, candidates)
+
+    n_queries, n_candidates = query_similarity.shape
+    k = min(k, n_candidates)
+    rows = np.arange(n_queries)
+
+    selected = np.full((n_queries, k), -1, dtype=np.int64)
+    if k == 0:
+        return selected
+    selected[:, 0] = np.argmax(query_similarity, axis=1)
+    chosen = np.zeros((n_queries, n_candidates), dtype=bool)
+    chosen[rows, selected[:, 0]] = True
+    redundancy = candidate_similarity[rows, selected[:, 0]]
+
+    for step in range(1, k):
+        scores = lambda_mult * query_similarity - (1 - lambda_mult) * redundancy
+        scores[chosen] = -np.inf
+        selected[:, step] = np.argmax(scores, axis=1)
+        chosen[rows, selected[:, step]] = True
+        redundancy = np.maximum(redundancy, candidate_similarity[rows, selected[:, step]])
+
+    # Posiciones elegidas cuando ya no quedaban candidatos
+    if valid is not None:
+        selected[np.arange(k) >= valid.sum(axis=1, keepdims=True)] = -1
+    return selected
+
+def derive_results(config, ids, candidate_vectors, query_vectors):
+    """
+    Obtiene los identificadores recuperados por una configuración a partir de la
+    búsqueda profunda compartida.
 
-        entry = {
-            "question": question,
-            "query": query,
-            "id_context": int(ids[idx]) if not math.isnan(ids[idx]) else -1,
-            "retrieved_contexts": retrieved_contexts,
-            "reference": references[idx],
-            "reference_contexts": reference_contexts[idx]
-        }
+    Args:
+        config (dict): Configuración del recuperador (search_type y search_kwargs).
+        ids (np.ndarray): Identificadores de la búsqueda profunda (Q x depth).
+        candidate_vectors (np.ndarray): Vectores de los candidatos (Q x depth x d).
+        query_vectors (np.ndarray): Embeddings de las consultas.
 
-        data_dict[f"test_{idx + 1}"] = entry
-        data_list.append({
-            "question": question,
-            "retrieved_contexts": [doc.page_content for doc in retrieved_docs],
-            "reference": references[idx],
-            "reference_contexts": reference_contexts[idx]
-        })
+    Returns:
+        List[List[int]]: Identificadores recuperados por consulta (hasta k, sin los -1
+        de las consultas con menos candidatos).
+    """
+    search_kwargs = config['search_kwargs']
+    k = search_kwargs['k']
+
+    if config['search_type'] == 'similarity':
+        result_ids = ids[:, :k]
+    else:
+        fetch_k = search_kwargs['fetch_k']
+        selected = mmr_select(query_vectors, candidate_vectors[:, :fetch_k], k,
+                              search_kwargs.get('lambda_mult', 0.5), valid=ids[:, :fetch_k] != -1)
+        result_ids = np.where(selected != -1, np.take_along_axis(ids[:, :fetch_k], np.maximum(selected, 0), axis=1), -1)
+    return [[int(i) for i in row if i != -1] for row in result_ids]
+
+def prepare_data(df_orig, queries, retrieved):
+    """
+    Genera los contextos recuperados a partir de las preguntas del CSV original.
 
-    return data_dict, pd.DataFrame(data_list)
+    Args:
+        df_orig (DataFrame): Dataset con preguntas y referencias.
+        queries (list): Consulta utilizada para cada pregunta (original o con NER).
+        retrieved (list): Documentos recuperados para cada pregunta.
 
-def extraer_sustantivos(doc):
-    """
-    Extrae los sustantivos comunes y propios de un documento spaCy.
+    Returns:
+        DataFrame: Una fila por pregunta con los documentos recuperados.
     """
-    palabras_filtradas = [token.text for token in doc if token.pos_ in ("NOUN", "PROPN")]
-    return " ".join(palabras_filtradas)
+    ids = df_orig['id_context'].tolist()
+
+    return pd.DataFrame({
+        "question": df_orig['question'].tolist(),
+        "query": queries,
+        "id_context": [int(i) if not math.isnan(i) else -1 for i in ids],
+        "retrieved_contexts": retrieved,
+        "reference": df_orig['reference'].tolist(),
+        "reference_contexts": df_orig['reference_contexts'].tolist()
+    })
 
 if __name__ == '__main__':
     # Carga de datasets de preguntas según tamaño de chunk
@@ -74,6 +150,14 @@ if __name__ == '__main__':
     ]
     size_list = ["full", "512", "1024"]
 
+    # Permite ejecutar solo una parte de la rejilla (p. ej. una celda desde pipeline.py)
+    parser = argparse.ArgumentParser(description="Recupera los contextos de cada pregunta.")
+    parser.add_argument('--models', nargs='+', default=[name for name, _ in model_list])
+    parser.add_argument('--sizes', nargs='+', default=size_list)
+    args = parser.parse_args()
+    model_list = [model for model in model_list if model[0] in args.models]
+    size_list = [size for size in size_list if size in args.sizes]
+
     retriever_configs = [
         ['similarity5', {"search_type": "similarity", "search_kwargs": {"k": 5}}],
         ['similarity10', {"search_type": "similarity", "search_kwargs": {"k": 10}}],
@@ -88,6 +172,23 @@ if __name__ == '__main__':
         ['ner', True]
     ]
 
+    # Vistas legibles opcionales de cada artefacto: 'json' y/o 'csv'
+    export_formats = []
+    chunk_table = ChunkTable()
+
+    # Profundidad de la búsqueda compartida: cubre el mayor k y el mayor fetch_k
+    depth = max(config['search_kwargs'].get('fetch_k', config['search_kwargs']['k']) for _, config in retriever_configs)
+
+    # Variantes de consulta (originales y con NER) para cada dataset. Las consultas con NER
+    # se calculan en lote una sola vez y se reutilizan desde la caché en disco
+    all_questions = [q for df in csv_files.values() for q in df['question']]
+    ner_queries = dict(zip(all_questions, rewrite_queries(all_questions)))
+    query_variants = {
+        (size, suffix): [ner_queries[q] for q in df['question']] if use_ner else df['question'].tolist()
+        for size, df in csv_files.items()
+        for suffix, use_ner in ner_list
+    }
+
     for model_name, model_path in model_list:
         model_kwargs = {'device': 'cuda'}
         encode_kwargs = {'normalize_embeddings': True}
@@ -96,24 +197,30 @@ if __name__ == '__main__':
             model_kwargs=model_kwargs,
             encode_kwargs=encode_kwargs,
         )
+        embed_model = CachedEmbeddings(embed_model)  # Caché de embeddings en disco
+
+        # Cada texto de consulta distinto se codifica una única vez por modelo
+        unique_queries = sorted({q for queries in query_variants.values() for q in queries})
+        query_embeddings = dict(zip(unique_queries, np.asarray(embed_model.embed_documents(unique_queries), dtype=np.float32)))
 
         for size in size_list:
             persist_dir = f"storage/faiss_index_{model_name}_{size}"
-            vectorstore = FAISS.load_local(persist_dir, embeddings=embed_model, allow_dangerous_deserialization=True)
-
-            for strategy, config in retriever_configs:
-                retriever = vectorstore.as_retriever(**config)
+            vectorstore = load_store(persist_dir, embed_model)
+            df_orig = csv_files[size]
 
-                for suffix, use_ner in ner_list:
-                    df_orig = csv_files[size]
+            for suffix, use_ner in ner_list:
+                queries = query_variants[(size, suffix)]
+                query_vectors = np.stack([query_embeddings[q] for q in queries])
+                ids, candidate_vectors = search_candidates(vectorstore.index, query_vectors, depth)
 
-                    prepared_data_json, prepared_data_csv = prepare_data(df_orig, retriever, use_ner)
+                for strategy, config in retriever_configs:
+                    result_ids = derive_results(config, ids, candidate_vectors, query_vectors)
+                    retrieved = [vectorstore.docstore.mget(row) for row in result_ids]
 
-                    output_json = f'faiss_contexts/{model_name}_{size}_{strategy}{suffix}.json'
-                    with open(output_json, 'w', encoding='utf-8') as f:
-                        json.dump(prepared_data_json, f, ensure_ascii=False, indent=4)
+                    prepared_data = prepare_data(df_orig, queries, retrieved)
 
-                    output_csv = f'faiss_contexts/{model_name}_{size}_{strategy}{suffix}.csv'
-                    prepared_data_csv.to_csv(output_csv, index=True)
+                    # Parquet con referencias a la tabla de chunks compartida
+                    output_path = f'faiss_contexts/{model_name}_{size}_{strategy}{suffix}'
+                    write_artifact(prepared_data, output_path, chunk_table, export=export_formats)
 
-                    print(f'Datos guardados en {output_json} y {output_csv}')
+                    print(f'Datos guardados en {output_path}.parquet')
@@ -1,92 +1,199 @@
 import os
-from langchain_community.retrievers import TFIDFRetriever, BM25Retriever
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+from scipy import sparse
 from tqdm import tqdm
+import numpy as np
 import pandas as pd
-import json
 from sentence_transformers import CrossEncoder
-from ast import literal_eval
+from artifacts import ChunkTable, read_artifact, write_artifact
 
-def rerank_documents(df: pd.DataFrame, strategy, k, retrievers):
+def build_term_matrices(questions, contexts, vectorizer):
     """
-    Reranquea documentos utilizando BM25 o TF-IDF con el número de documentos deseado.
+    Construye las matrices de términos de todas las preguntas a la vez.
+
+    Cada pregunta tiene su propio corpus (sus contextos recuperados), por lo que las
+    frecuencias de documento se calculan por grupo mediante una matriz de pertenencia.
 
     Args:
-        df (DataFrame): Datos originales con preguntas y contextos.
-        strategy (str): Estrategia de recuperación ('bm25' o 'tfidf').
-        k (int): Número de documentos a recuperar.
-        retrievers (dict): Diccionario con clases de retrievers.
+        questions (list): Preguntas.
+        contexts (list): Lista de contextos recuperados por pregunta.
+        vectorizer (CountVectorizer): Vectorizador que define la tokenización.
 
     Returns:
-        list: Lista de listas de documentos reranqueados.
+        Tuple: Frecuencias de término de los contextos (N x V), de las preguntas (G x V),
+        frecuencias de documento por grupo (G x V) y grupo de cada contexto.
     """
-    retriever_class = retrievers[strategy]
-    return df.apply(lambda row: [
-        doc.page_content for doc in retriever_class.from_texts(row["retrieved_contexts"], k=k).invoke(row["question"], k=k)
-    ], axis=1).tolist()
+    texts = [doc for docs in contexts for doc in docs]
+    groups = np.repeat(np.arange(len(contexts)), [len(docs) for docs in contexts])
+
+    tf = vectorizer.fit_transform(texts).tocsr().astype(np.float64)
+    query_tf = vectorizer.transform(questions).tocsr().astype(np.float64)
+
+    membership = sparse.csr_matrix(
+        (np.ones(len(texts)), (groups, np.arange(len(texts)))),
+        shape=(len(contexts), len(texts))
+    )
+    df = (membership @ (tf > 0).astype(np.float64)).tocsr()
 
-def rerank_with_cross_encoder(df: pd.DataFrame, reranker: CrossEncoder, k: int):
+    return tf, query_tf, df, groups
+
+def split_rankings(scores, contexts, descending_order):
     """
-    Reranquea usando un modelo CrossEncoder para reordenar documentos según la similitud con la pregunta.
+    Divide el vector de puntuaciones por pregunta y devuelve el orden completo de cada grupo.
     """
-    for index, row in df.iterrows():
-        pairs = [(row['question'], doc) for doc in row['retrieved_contexts']]
-        scores = reranker.predict(pairs)
-        reranked_docs = [doc for _, doc in sorted(zip(scores, row['retrieved_contexts']), reverse=True)][:k]
-        df.at[index, 'retrieved_contexts'] = reranked_docs
+    offsets = np.cumsum([0] + [len(docs) for docs in contexts])
+    return [descending_order(scores[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
 
-def prepare_data(df_orig: pd.DataFrame, strategy, k, retrievers):
+def bm25_rankings(questions, contexts, k1=1.5, b=0.75, epsilon=0.25):
     """
-    Aplica reranking con la estrategia indicada y devuelve los datos preparados.
+    Ordena los contextos de todas las preguntas con BM25 en una sola pasada.
+    Reproduce el cálculo de BM25Retriever (BM25Okapi con tokenización por espacios)
+    construido sobre los contextos de cada pregunta.
 
     Args:
-        df_orig (DataFrame): Datos originales.
-        strategy (str): Estrategia de reranking ('bm25', 'tfidf' o 'cross-encoder').
-        k (int): Número de documentos a conservar.
-        retrievers (dict): Diccionario de retrievers.
+        questions (list): Preguntas.
+        contexts (list): Lista de contextos recuperados por pregunta.
+        k1, b, epsilon (float): Parámetros de BM25Okapi.
 
     Returns:
-        Tuple[dict, DataFrame]: Datos en formato JSON y DataFrame.
+        list: Orden completo (índices) de los contextos de cada pregunta.
     """
-    new_df = df_orig.copy()
-    reranker = CrossEncoder("cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+    vectorizer = CountVectorizer(tokenizer=str.split, lowercase=False, token_pattern=None)
+    tf, query_tf, df, groups = build_term_matrices(questions, contexts, vectorizer)
+
+    n_docs = np.bincount(groups).astype(np.float64)
+    doc_len = np.asarray(tf.sum(axis=1)).ravel()
+    avgdl = np.bincount(groups, weights=doc_len) / n_docs
+
+    # IDF por grupo; los valores negativos se sustituyen por epsilon * IDF medio del grupo
+    df = df.tocoo()
+    idf = np.log(n_docs[df.row] - df.data + 0.5) - np.log(df.data + 0.5)
+    average_idf = np.bincount(df.row, weights=idf, minlength=len(contexts)) / np.bincount(df.row, minlength=len(contexts))
+    idf = np.where(idf < 0, epsilon * average_idf[df.row], idf)
+    idf = sparse.csr_matrix((idf, (df.row, df.col)), shape=df.shape)
+
+    # Peso de cada término de la pregunta (repeticiones incluidas) en su grupo
+    query_weights = query_tf.multiply(idf).tocsr()
+
+    tf = tf.tocoo()
+    weights = np.asarray(query_weights[groups[tf.row], tf.col]).ravel()
+    norm = k1 * (1 - b + b * doc_len[tf.row] / avgdl[groups[tf.row]])
+    contributions = weights * (tf.data * (k1 + 1) / (tf.data + norm))
+    scores = np.bincount(tf.row, weights=contributions, minlength=len(groups))
+
+    return split_rankings(scores, contexts, lambda s: np.argsort(s)[::-1])
+
+def tfidf_rankings(questions, contexts):
+    """
+    Ordena los contextos de todas las preguntas con TF-IDF en una sola pasada.
+    Reproduce TFIDFRetriever (TfidfVectorizer por defecto y similitud coseno)
+    construido sobre los contextos de cada pregunta.
+
+    Args:
+        questions (list): Preguntas.
+        contexts (list): Lista de contextos recuperados por pregunta.
+
+    Returns:
+        list: Orden completo (índices) de los contextos de cada pregunta.
+    """
+    tf, query_tf, df, groups = build_term_matrices(questions, contexts, CountVectorizer())
 
-    if strategy in ['bm25', 'tfidf']:
-        new_df['retrieved_contexts'] = rerank_documents(new_df, strategy, k, retrievers)
-    elif strategy == 'cross-encoder':
-        rerank_with_cross_encoder(new_df, reranker, k)
+    # IDF suavizado por grupo, igual que TfidfVectorizer
+    n_docs = np.bincount(groups).astype(np.float64)
+    df = df.tocoo()
+    idf = np.log((1 + n_docs[df.row]) / (1 + df.data)) + 1
+    idf = sparse.csr_matrix((idf, (df.row, df.col)), shape=df.shape)
 
-    data_list = new_df.to_dict(orient='records')
-    data_dict = {f"test_{i+1}": entry for i, entry in enumerate(data_list)}
+    doc_weights = normalize(tf.multiply(idf[groups]).tocsr())
+    query_weights = normalize(query_tf.multiply(idf).tocsr())
+    scores = np.asarray(doc_weights.multiply(query_weights[groups]).sum(axis=1)).ravel()
 
-    return data_dict, pd.DataFrame(data_list)
+    return split_rankings(scores, contexts, lambda s: s.argsort()[::-1])
+
+def cross_encoder_rankings(questions, contexts, reranker, batch_size=64):
+    """
+    Ordena los contextos de todas las preguntas con un CrossEncoder en una única
+    pasada por lotes sobre todos los pares (pregunta, contexto).
+
+    Args:
+        questions (list): Preguntas.
+        contexts (list): Lista de contextos recuperados por pregunta.
+        reranker (CrossEncoder): Modelo de reranking.
+        batch_size (int): Tamaño de lote de inferencia.
+
+    Returns:
+        list: Orden completo (índices) de los contextos de cada pregunta.
+    """
+    pairs = [(question, doc) for question, docs in zip(questions, contexts) for doc in docs]
+    scores = reranker.predict(pairs, batch_size=batch_size, show_progress_bar=False)
+
+    offsets = np.cumsum([0] + [len(docs) for docs in contexts])
+    rankings = []
+    for docs, start, end in zip(contexts, offsets[:-1], offsets[1:]):
+        group_scores = scores[start:end]
+        # Mismo criterio que sorted(zip(scores, docs), reverse=True)
+        rankings.append(sorted(range(len(docs)), key=lambda i: (group_scores[i], docs[i]), reverse=True))
+    return rankings
+
+def prepare_data(df_orig: pd.DataFrame, rankings, k):
+    """
+    Conserva los k primeros contextos de cada pregunta según el orden calculado.
+
+    Args:
+        df_orig (DataFrame): Datos originales.
+        rankings (list): Orden completo de los contextos de cada pregunta.
+        k (int): Número de documentos a conservar.
+
+    Returns:
+        DataFrame: Datos con los contextos reordenados y recortados.
+    """
+    new_df = df_orig.copy()
+    new_df['retrieved_contexts'] = [
+        [docs[i] for i in ranking[:k]]
+        for docs, ranking in zip(df_orig['retrieved_contexts'], rankings)
+    ]
+    return new_df
 
 if __name__ == '__main__':
     # Cargar el dataset generado por recuperación semántica
-    df = pd.read_csv("faiss_contexts/mpnet_full_similarity20.csv", index_col=0)
+    # (solo las columnas necesarias; los contextos se resuelven desde la tabla de chunks)
+    chunk_table = ChunkTable()
+    df = read_artifact("faiss_contexts/mpnet_full_similarity20",
+                       columns=['question', 'retrieved_contexts', 'reference', 'reference_contexts'],
+                       chunk_table=chunk_table)
 
     # Preprocesamiento
     df['reference'] = df['reference'].fillna("")
     df['reference_contexts'] = df['reference_contexts'].fillna("")
-    df['retrieved_contexts'] = df['retrieved_contexts'].apply(literal_eval)
-    df['reference_contexts'] = df['reference_contexts'].apply(lambda text: [text])
+
+    questions = df['question'].tolist()
+    contexts = df['retrieved_contexts'].tolist()
 
     strategies = ['bm25', 'tfidf', 'cross-encoder']
     n_docs = [15, 10, 5]
-    retriever_configs = [(strategy, k) for strategy in strategies for k in n_docs]
-    retrievers = {'bm25': BM25Retriever, 'tfidf': TFIDFRetriever}
+
+    # El CrossEncoder se carga una única vez para toda la ejecución
+    reranker = CrossEncoder("cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+    ranking_functions = {
+        'bm25': bm25_rankings,
+        'tfidf': tfidf_rankings,
+        'cross-encoder': lambda q, c: cross_encoder_rankings(q, c, reranker),
+    }
 
     output_dir = 'reranking'
+    export_formats = []  # Vistas legibles opcionales: 'json' y/o 'csv'
     os.makedirs(output_dir, exist_ok=True)
 
-    for strategy, k in tqdm(retriever_configs, desc="Procesando estrategias de recuperación"):
-        prepared_data_json, prepared_data_csv = prepare_data(df, strategy, k, retrievers)
+    for strategy in tqdm(strategies, desc="Procesando estrategias de recuperación"):
+        # Una sola pasada por estrategia; cada k es un prefijo del mismo orden
+        rankings = ranking_functions[strategy](questions, contexts)
 
-        # Guardar resultados
-        output_json = f'{output_dir}/{strategy}_{k}.json'
-        with open(output_json, 'w', encoding='utf-8') as f:
-            json.dump(prepared_data_json, f, ensure_ascii=False, indent=4)
+        for k in n_docs:
+            prepared_data = prepare_data(df, rankings, k)
 
-        output_csv = f'{output_dir}/{strategy}_{k}.csv'
-        prepared_data_csv.to_csv(output_csv, index=False)
+            # Guardar resultados
+            output_path = f'{output_dir}/{strategy}_{k}'
+            write_artifact(prepared_data, output_path, chunk_table, export=export_formats)
 
-        print(f'Datos guardados en {output_json} y {output_csv}')
+            print(f'Datos guardados en {output_path}.parquet')
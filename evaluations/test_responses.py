@@ -1,50 +1,33 @@
 import sys
-sys.path.append("../prototype/llm_agent (server)")
+sys.path.append("../prototype/llm_agent")
 from llm_api import LLMApi
 from agent import Agent
-from tools import retrieval_augmented_generation
-import pandas as pd
-from datasets import Dataset
+from artifacts import ChunkTable, read_artifact, write_artifact
+from generation_runner import GenerationRunner
+import argparse
 import os
-import json
-import ast
 
-# Genera respuestas a partir de una lista de preguntas (batch)
-def generate(batch):
-    questions = batch["question"]
-    responses = []
-    for question in questions:
-        response = agent.invoke(user_message=question)
-        responses.append(response)
-    return {"response": responses}
+parser = argparse.ArgumentParser(description="Genera las respuestas de cada LLM con cada prompt del sistema.")
+parser.add_argument("--max-concurrency", type=int, default=4, help="Peticiones simultáneas por modelo.")
+parser.add_argument("--rate", type=float, default=None, help="Peticiones por segundo por modelo.")
+parser.add_argument("--mode", choices=["agent", "replay"], default="agent",
+                    help="'agent' ejecuta el grafo completo (clasificador y recuperación en vivo); "
+                         "'replay' pasa los contextos reordenados directamente al chatbot.")
+args = parser.parse_args()
 
-# Aplica el generador de respuestas a todo el dataset
-def generate_response(dataset):
-    dataset = dataset.map(generate, batched=True, batch_size=5)
+# Cargar los contextos reordenados (Parquet, o el CSV antiguo si no se ha convertido)
+chunk_table = ChunkTable()
+df_orig = read_artifact('reranking/cross-encoder_5', chunk_table=chunk_table)
+questions = df_orig['question'].tolist()
+contexts = dict(zip(questions, df_orig['retrieved_contexts']))
 
-    data_dict = {
-        f"test_{i + 1}": {
-            "question": row["question"],
-            "reference": row["reference"],
-            "response": row["response"],
-            "reference_contexts": row["reference_contexts"],
-            "retrieved_contexts": row["retrieved_contexts"]
-        }
-        for i, row in enumerate(dataset)
-    }
-
-    return data_dict, dataset.to_pandas()
-
-# Cargar datos desde CSV
-df_orig = pd.read_csv('reranking/cross-encoder_5.csv', converters={'retrieved_contexts': ast.literal_eval})
-
-# Convertir a Dataset de HuggingFace
-dt = Dataset.from_pandas(df_orig)
-
-# Crear carpeta de salida si no existe
-output_dir = 'llm_responses'
+# Crear carpeta de salida si no existe (las respuestas del modo replay se guardan aparte)
+output_dir = 'llm_responses' if args.mode == 'agent' else 'llm_responses_replay'
 os.makedirs(output_dir, exist_ok=True)
 
+# Vistas legibles opcionales de cada artefacto: 'json' y/o 'csv'
+export_formats = []
+
 # Modelos LLM disponibles
 llm_list = {
     'eurollm': "<YOUR_MODEL_PATH>/EuroLLM-9B-Instruct",
@@ -87,25 +70,45 @@ system_prompts = {
     )
 }
 
-# Ejecutar la generación para cada combinación de modelo y prompt
+# La recuperación en vivo (FAISS y CrossEncoder) solo se carga si se ejecuta el agente completo
+if args.mode == 'agent':
+    from tools import retrieval_augmented_generation
+    tools = [retrieval_augmented_generation]
+else:
+    tools = []
+
+def replay(agent):
+    return lambda question: agent.invoke_with_context(question, contexts[question])
+
+# Un agente por combinación de modelo y prompt; todas se generan de forma concurrente
+jobs = []
 for model_name, model_path in llm_list.items():
     for prompt_type, prompt in system_prompts.items():
         agent = Agent(
             llm=LLMApi(model=model_path, api_key=api_key),
-            tools=[retrieval_augmented_generation],
+            tools=tools,
             system_prompt=prompt
         )
+        invoke = agent.invoke if args.mode == 'agent' else replay(agent)
+        jobs.append((model_name, f"{model_name}_{prompt_type}", invoke, questions))
+
+# Las respuestas se guardan en disco a medida que llegan: al relanzar se reanuda la generación
+runner = GenerationRunner(max_concurrency=args.max_concurrency, rate=args.rate,
+                          checkpoint_dir=os.path.join(output_dir, 'checkpoints'))
+responses = runner.run(jobs)
 
-        # Generar respuestas
-        prepared_data_json, prepared_data_csv = generate_response(dt)
+for name, generated in responses.items():
+    pending = sum(response is None for response in generated)
+    if pending:
+        print(f'{name}: {pending} respuestas pendientes, vuelva a ejecutar el script para completarlas')
+        continue
 
-        # Guardar en JSON
-        output_json = os.path.join(output_dir, f"{model_name}_{prompt_type}.json")
-        with open(output_json, 'w', encoding='utf-8') as f:
-            json.dump(prepared_data_json, f, ensure_ascii=False, indent=4)
+    # Guardar como Parquet (con vistas JSON/CSV opcionales)
+    prepared_data = df_orig.assign(response=generated)
+    output_path = os.path.join(output_dir, name)
+    write_artifact(prepared_data, output_path, chunk_table, export=export_formats)
 
-        # Guardar en CSV
-        output_csv = os.path.join(output_dir, f"{model_name}_{prompt_type}.csv")
-        prepared_data_csv.to_csv(output_csv, index=False)
+    print(f'Datos guardados en {output_path}.parquet')
 
-        print(f'Datos guardados en {output_json} y {output_csv}')
+# Latencias y rendimiento por modelo
+print(runner.save_stats(os.path.join(output_dir, 'generation_stats.csv')).to_string(index=False))
@@ -1,13 +1,54 @@
-from langchain_community.vectorstores import FAISS
-from langchain_community.docstore import InMemoryDocstore
+import sys
+sys.path.append("../prototype/llm_agent")
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import NLTKTextSplitter
 from langchain.schema import Document
+from embedding_cache import CachedEmbeddings
+from faiss_indexes import INDEX_CONFIGS, StoreWriter, ShardedStoreWriter
+from vector_store import DOCSTORE_FILE, SQLiteDocstore
+from bm25_index import BM25Index
+from data_stats import MAX_SEQ_LENGTH, load_token_counts, chunk_size_report
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 import pandas as pd
-import faiss
+import argparse
 import json
+import os
 from typing import List
 
+def iter_documents(file_path, batch_size=1000):
+    """
+    Lee los artículos del CSV por lotes y los convierte en objetos Document de LangChain,
+    sin cargar el corpus completo en memoria.
+
+    Args:
+        file_path (str): Ruta del archivo CSV.
+        batch_size (int): Número de artículos por lote.
+
+    Yields:
+        List[Document]: Lote de documentos.
+    """
+    required_columns = {'content', 'title', 'categories'}
+    next_id = 1
+
+    for df in pd.read_csv(file_path, chunksize=batch_size):
+        # Validar que el archivo contiene las columnas requeridas
+        if not required_columns.issubset(df.columns):
+            raise ValueError(f"El archivo debe contener las columnas: {required_columns}")
+
+        yield [
+            Document(
+                page_content=content,
+                metadata={
+                    'id': next_id + i,
+                    'title': title,
+                    'categories': categories
+                },
+            )
+            for i, (content, title, categories) in enumerate(zip(df['content'], df['title'], df['categories']))
+        ]
+        next_id += len(df)
+
 def import_data(file_path):
     """
     Carga los artículos desde un CSV y los convierte en objetos Document de LangChain.
@@ -18,27 +59,7 @@ def import_data(file_path):
     Returns:
         list: Lista de documentos procesados.
     """
-    df = pd.read_csv(file_path)
-
-    # Validar que el archivo contiene las columnas requeridas
-    required_columns = {'content', 'title', 'categories'}
-    if not required_columns.issubset(df.columns):
-        raise ValueError(f"El archivo debe contener las columnas: {required_columns}")
-
-    # Crear lista de documentos
-    documents = [
-        Document(
-            page_content=row['content'],
-            metadata={
-                'id': i + 1,
-                'title': row['title'],
-                'categories': row['categories']
-            },
-        )
-        for i, row in df.iterrows()
-    ]
-
-    return documents
+    return [doc for batch in iter_documents(file_path) for doc in batch]
 
 def split_documents(docs: List[Document], size: int) -> List[Document]:
     """
@@ -59,21 +80,50 @@ def split_documents(docs: List[Document], size: int) -> List[Document]:
     )
     return splitter.split_documents(docs)
 
-def chunks_to_json(chunks, filename):
+def iter_chunks(batches, size, workers=None, max_pending=None):
     """
-    Guarda los chunks como archivo JSON estructurado.
+    Divide los lotes de documentos en chunks en un pool de procesos. Solo se mantienen
+    en vuelo unos pocos lotes a la vez y los resultados se devuelven en el orden de entrada.
 
     Args:
-        chunks: Lista de documentos divididos.
-        filename: Nombre del archivo de salida.
-    """
-    docs = [{'content': doc.page_content, 'metadata': doc.metadata} for doc in chunks]
+        batches (Iterable[List[Document]]): Lotes de documentos.
+        size (str): Tamaño de chunk ('full' para no dividir).
+        workers (int): Número de procesos (por defecto, uno por CPU).
+        max_pending (int): Lotes enviados al pool que aún no se han consumido.
 
-    data = {f"chunk_{i}": doc for i, doc in enumerate(docs)}
+    Yields:
+        List[Document]: Chunks de cada lote.
+    """
+    if size == 'full':
+        yield from batches
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in batches:
+            pending.append(executor.submit(split_documents, batch, int(size)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def write_chunks(f, chunks, start):
+    """
+    Añade los chunks a un archivo JSON Lines, uno por línea.
 
-    output_file = f'chunks/{filename}'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    Args:
+        f: Archivo abierto en modo texto.
+        chunks (List[Document]): Chunks a guardar.
+        start (int): Posición del primer chunk en el corpus.
+    """
+    f.writelines(
+        json.dumps({'id': f'chunk_{start + i}', 'content': doc.page_content, 'metadata': doc.metadata},
+                   ensure_ascii=False) + '\n'
+        for i, doc in enumerate(chunks)
+    )
 
 if __name__ == '__main__':
     model_list = [
@@ -81,9 +131,30 @@ if __name__ == '__main__':
         ['mpnet', 'paraphrase-multilingual-mpnet-base-v2']
     ]
     size_list = ['full', '512', '1024']
+    # Tipos de índice a construir (ver INDEX_CONFIGS): 'flat', 'flat_ip', 'hnsw', 'ivf', 'sq_fp16', 'sq8', 'pq', 'pca'
+    index_types = ['flat']
     file_path = 'data/wikipedia_jaen.csv'
 
-    docs = import_data(file_path)
+    # Permite construir solo una parte de la rejilla (p. ej. una celda desde pipeline.py)
+    parser = argparse.ArgumentParser(description="Construye los índices FAISS y BM25 del corpus.")
+    parser.add_argument('--models', nargs='+', default=[name for name, _ in model_list])
+    parser.add_argument('--sizes', nargs='+', default=size_list)
+    parser.add_argument('--index-types', nargs='+', default=index_types)
+    # Almacén fragmentado para corpus grandes (ver prototype/llm_agent/shards.py)
+    parser.add_argument('--shards', type=int, default=0, help="Número de fragmentos (0 para un único índice).")
+    parser.add_argument('--shard-by', choices=['hash', 'category'], default='hash',
+                        help="Reparto de los artículos: por hash del título o por su primera categoría.")
+    # Reordenación de los candidatos con los vectores originales (ver INDEX_CONFIGS)
+    parser.add_argument('--refine', type=int, default=0,
+                        help="Candidatos por resultado reordenados con los vectores originales "
+                             "en los índices aproximados (0 para no reordenar).")
+    args = parser.parse_args()
+    model_list = [model for model in model_list if model[0] in args.models]
+    size_list = [size for size in size_list if size in args.sizes]
+    index_types = args.index_types
+
+    # Recuentos de tokens por artículo calculados por data_stats.py (opcional)
+    token_counts = load_token_counts()
 
     for model_name, model_path in model_list:
         # Cargar el modelo de embeddings
@@ -95,34 +166,77 @@ if __name__ == '__main__':
             encode_kwargs=encode_kwargs,
         )
 
+        # Longitud máxima de entrada del modelo: el texto que la supere se trunca al codificar
+        client = getattr(embed_model, '_client', None) or getattr(embed_model, 'client', None)
+        max_seq_length = getattr(client, 'max_seq_length', None) or MAX_SEQ_LENGTH
+
+        # Los embeddings se consultan primero en la caché en disco
+        embed_model = CachedEmbeddings(embed_model)
+
         # Comprobar dimensión de embeddings
         sample_text = "texto de ejemplo"
         embedding = embed_model.embed_query(sample_text)
         print(f"Dimensión del embedding: {len(embedding)}")
 
         for size in size_list:
-            if size == 'full':
-                chunks = docs
-            else:
-                chunks = split_documents(docs, int(size))
-                filename = f'chunks_{model_name}_{size}.json'
-                chunks_to_json(chunks, filename)
-
-            # Crear índice FAISS
-            d = len(embedding)
-            faiss_index = faiss.IndexFlatL2(d)
-            imdocstore = InMemoryDocstore({})
-            vectorstore = FAISS(
-                index=faiss_index,
-                docstore=imdocstore,
-                index_to_docstore_id={},
-                embedding_function=embed_model,
-                distance_strategy='COSINE'
-            )
-
-            vectorstore.add_documents(chunks)
-
-            # Guardar el índice en disco
-            persist_dir = f"storage/faiss_index_{model_name}_{size}"
-            vectorstore.save_local(persist_dir)
-            print(f'COMPLETADO: {model_name} {size}')
+            # Aviso de truncado a partir de los recuentos de tokens por artículo (data_stats.py)
+            if token_counts is not None and f'num_tokens_{model_name}' in token_counts:
+                report = chunk_size_report(token_counts, model_name, size, max_seq_length)
+                if report['truncated_fraction'] > 0.05:
+                    print(f"AVISO: con chunks '{size}' unos {report['estimated_tokens']:.0f} tokens por chunk; "
+                          f"el {report['truncated_fraction']:.0%} supera los {max_seq_length} tokens de {model_name} "
+                          f"y se truncará. Tamaño sugerido: {report['suggested_size']} caracteres.")
+
+            # Un escritor por tipo de índice: todos reciben los mismos chunks y embeddings
+            writers = {}
+            for index_type in index_types:
+                suffix = '' if index_type == 'flat' else f'_{index_type}'
+                config = INDEX_CONFIGS[index_type]
+                # Los índices exactos no necesitan reordenar
+                if args.refine and index_type not in ('flat', 'flat_ip'):
+                    config = {**config, 'refine': args.refine}
+                    suffix += f'_refine{args.refine}'
+                if args.shards:
+                    persist_dir = f"storage/faiss_index_{model_name}_{size}{suffix}_shards"
+                    writers[index_type] = ShardedStoreWriter(persist_dir, config, args.shards, args.shard_by)
+                else:
+                    persist_dir = f"storage/faiss_index_{model_name}_{size}{suffix}"
+                    writers[index_type] = StoreWriter(persist_dir, config)
+
+            chunks_file = None
+            if size != 'full':
+                chunks_file = open(f'chunks/chunks_{model_name}_{size}.jsonl', 'w', encoding='utf-8')
+
+            # Lectura, troceado y embeddings por lotes, sin materializar el corpus completo
+            n_chunks = 0
+            for chunks in iter_chunks(iter_documents(file_path), size):
+                if not chunks:
+                    continue
+                vectors = embed_model.embed_documents([doc.page_content for doc in chunks])
+                for writer in writers.values():
+                    writer.add(chunks, vectors)
+                if chunks_file is not None:
+                    write_chunks(chunks_file, chunks, n_chunks)
+                n_chunks += len(chunks)
+
+            if chunks_file is not None:
+                chunks_file.close()
+
+            for writer in writers.values():
+                writer.close()
+
+            # Los fragmentos ya incluyen su propio índice BM25
+            if args.shards:
+                for index_type in writers:
+                    print(f'COMPLETADO: {model_name} {size} {index_type} ({n_chunks} chunks, {args.shards} fragmentos)')
+                continue
+
+            # Índice léxico BM25 sobre los mismos chunks, leídos del docstore en el orden del índice FAISS
+            persist_dirs = [writer.persist_dir for writer in writers.values()]
+            docstore = SQLiteDocstore(os.path.join(persist_dirs[0], DOCSTORE_FILE))
+            bm25_index = BM25Index.build(doc.page_content for _, doc in docstore.iter_documents())
+            docstore.connection.close()
+
+            for index_type, persist_dir in zip(writers, persist_dirs):
+                bm25_index.save(persist_dir)
+                print(f'COMPLETADO: {model_name} {size} {index_type} ({n_chunks} chunks)')
@@ -8,6 +8,7 @@ from llm_api import LLMApi
 from langfuse.callback import CallbackHandler
 from langchain_core.messages import HumanMessage, AIMessage, AnyMessage, ToolMessage
 import os
+import json
 import json_repair
 from collections import deque
 
@@ -22,6 +23,21 @@ class State(TypedDict):
     chat: List[Dict[str, Any]]  # Historial de la conversación en formato simple
 
 
+def format_contexts(contexts: list, max_chars: int = 1024) -> str:
+    """
+    Da a una lista de contextos el mismo formato JSON que devuelve la herramienta de recuperación.
+
+    :param contexts: Textos de los contextos, ordenados por relevancia.
+    :param max_chars: Caracteres que se conservan de cada contexto.
+    :return: Contextos numerados como JSON.
+    """
+    return json.dumps(
+        {i + 1: context[:max_chars] for i, context in enumerate(contexts)},
+        ensure_ascii=False,
+        indent=4
+    )
+
+
 class Agent:
     def __init__(self, llm: LLMApi, tools: list, system_prompt: str):
         self.graph_builder = StateGraph(State)
@@ -160,6 +176,14 @@ class Agent:
 
         self.graph = self.graph_builder.compile()
 
+        # Grafo de reproducción: los contextos se reciben ya recuperados y se pasan
+        # directamente al chatbot, sin clasificador ni herramienta
+        replay_builder = StateGraph(State)
+        replay_builder.add_node("chatbot", _chatbot)
+        replay_builder.add_edge(START, "chatbot")
+        replay_builder.add_edge("chatbot", END)
+        self.replay_graph = replay_builder.compile()
+
     def invoke(self, user_message):
         """
         Ejecuta el grafo y devuelve solo la respuesta final.
@@ -172,6 +196,26 @@ class Agent:
         stream = self.graph.stream(input=inputs, config=config, stream_mode="values")
         return deque(stream, maxlen=1)[-1]["chat"][-1]["content"]
 
+    def invoke_with_context(self, user_message, contexts):
+        """
+        Genera la respuesta final con contextos precalculados, como si la herramienta los
+        hubiera devuelto. Se omiten la llamada al clasificador y la recuperación, de modo
+        que solo se mide la generación del LLM.
+
+        :param user_message: Mensaje del usuario.
+        :param contexts: Textos de los contextos, ordenados por relevancia.
+        :return: Respuesta del modelo.
+        """
+        config = {"configurable": {"thread_id": "1"}, "callbacks": [CallbackHandler()]}
+        inputs = {
+            "messages": [
+                HumanMessage(content=user_message),
+                ToolMessage(content=format_contexts(contexts), tool_call_id="tool_call_id")
+            ],
+            "chat": [self.system_prompt, {"role": "user", "content": user_message}]
+        }
+        return self.replay_graph.invoke(input=inputs, config=config)["chat"][-1]["content"]
+
     def chat(self):
         """
         Modo de conversación en bucle (útil para pruebas por consola).
@@ -1,17 +1,22 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, FileResponse
 import aiofiles
 import os
 import asyncio
-import whisper
 from uuid import uuid4
 import edge_tts
 import logging
 import traceback
+import json
+import time
 
 from llm_api import LLMApi
 from agent import Agent
-from tools import retrieval_augmented_generation
+from tools import retrieval_augmented_generation, retriever, retrieval_cache
+from prefetch import Prefetcher, extract_topics, profile_topics
+from model_client import model_server_url, RemoteTranscriber
+from scheduler import get_scheduler
+from streaming_asr import AudioDecoder, StreamingTranscriber, SAMPLE_RATE
 
 
 class Backend:
@@ -22,9 +27,14 @@ class Backend:
         # Configura logging para mostrar errores o mensajes informativos en consola
         logging.basicConfig(level=logging.INFO)
 
-        # Carga del modelo de transcripción Whisper en CPU
+        # Modelo de transcripción Whisper: el del servidor de modelos compartido si está
+        # configurado (MODEL_SERVER_URL) o uno propio cargado en CPU
         try:
-            self.transcriptor = whisper.load_model(name="turbo", device="cpu")
+            if server_url := model_server_url():
+                self.transcriptor = RemoteTranscriber(server_url)
+            else:
+                import whisper
+                self.transcriptor = whisper.load_model(name="turbo", device="cpu")
         except Exception as e:
             logging.error("Error al cargar el modelo de Whisper: %s", e)
 
@@ -53,6 +63,12 @@ class Backend:
             "de conversación diferente."
         )
 
+        # Ejecutores con presupuesto de hilos propio para cada clase de modelo
+        self.scheduler = get_scheduler()
+
+        # Precarga de la recuperación mientras el usuario piensa su siguiente mensaje
+        self.prefetcher = Prefetcher(retriever, retrieval_cache)
+
         # Inicialización de variables que se usarán tras el setup
         self.agent = None
         self.config = None
@@ -97,6 +113,10 @@ class Backend:
                 self.config
             )
 
+            # Precarga los temas del perfil y los mencionados en la bienvenida
+            self.prefetcher.cancel()
+            self.prefetcher.schedule(profile_topics(user_info) + extract_topics(welcome_msg))
+
             # Convierte el mensaje de texto a voz
             await self.generate_tts(welcome_msg)
 
@@ -111,6 +131,9 @@ class Backend:
             """
             Recibe audio de entrada del usuario, lo transcribe y genera una respuesta hablada.
             """
+            # Una petición real tiene prioridad: se detiene la precarga en curso
+            self.prefetcher.cancel()
+
             # Genera nombre de archivo temporal único
             filename = f"{uuid4().hex}_{file.filename}"
             filepath = os.path.join(self.upload_folder, filename)
@@ -121,8 +144,9 @@ class Backend:
                     content = await file.read()
                     await out_file.write(content)
 
-                # Transcribe el audio a texto
-                result = await asyncio.to_thread(
+                # Transcribe el audio a texto en el ejecutor de Whisper
+                result = await self.scheduler.run(
+                    "asr",
                     self.transcriptor.transcribe,
                     audio=filepath,
                     language="spanish"
@@ -137,6 +161,9 @@ class Backend:
                     self.config
                 )
 
+                # Precarga los temas mencionados en la respuesta
+                self.prefetcher.schedule(extract_topics(response))
+
                 # Convierte la respuesta en audio
                 await self.generate_tts(response)
 
@@ -146,6 +173,113 @@ class Backend:
                 logging.error(traceback.format_exc())
                 return JSONResponse(status_code=500, content={"error": str(e)})
 
+        # Endpoint que transcribe el audio mientras el usuario habla
+        @self.local_server.websocket("/stream")
+        async def stream(websocket: WebSocket):
+            """
+            Recibe el audio del usuario en fragmentos mientras se graba y lo transcribe de forma
+            incremental. Protocolo:
+
+            - El cliente puede enviar primero {"type": "start", "format": ..., "sample_rate": ..., "channels": ...}
+              (por defecto PCM de 16 bits, mono a 16 kHz; también admite WebM/Ogg, MP3, AAC o WAV).
+            - Después envía el audio en mensajes binarios y {"type": "end"} al soltar el botón.
+            - El servidor envía {"type": "partial", "committed": ..., "tentative": ...} tras cada
+              decodificación y, al terminar, {"type": "transcription", "text": ...} seguido de
+              {"type": "response", "transcription": ..., "response": ...}, como /receive.
+
+            Si el cliente no envía "end", el turno termina tras un silencio (ver StreamingTranscriber).
+            """
+            await websocket.accept()
+
+            # Una petición real tiene prioridad: se detiene la precarga en curso
+            self.prefetcher.cancel()
+
+            transcriber = StreamingTranscriber(self.transcriptor, language="spanish")
+            decoder = None
+            stop = asyncio.Event()
+            decoding = None
+
+            try:
+                message = await websocket.receive()
+                options = {}
+                if message.get("text"):
+                    options = json.loads(message["text"])
+                decoder = AudioDecoder(
+                    transcriber.feed,
+                    fmt=options.get("format", "pcm_s16le"),
+                    sample_rate=int(options.get("sample_rate", 16000)),
+                    channels=int(options.get("channels", 1)),
+                )
+                await decoder.start()
+                if message.get("bytes"):
+                    await decoder.feed(message["bytes"])
+
+                # La decodificación avanza en paralelo a la recepción del audio
+                decoding = asyncio.create_task(self.decode_stream(websocket, transcriber, stop))
+                receiving = asyncio.create_task(self.receive_stream(websocket, decoder))
+                stopped = asyncio.create_task(stop.wait())
+                await asyncio.wait([receiving, stopped], return_when=asyncio.FIRST_COMPLETED)
+                stopped.cancel()
+                stop.set()
+                if receiving.done():
+                    receiving.result()  # Propaga la desconexión del cliente
+                else:
+                    receiving.cancel()
+
+                # Tiempo desde el final del audio hasta la transcripción definitiva
+                end = time.perf_counter()
+                await decoder.close()
+                await decoding
+                transcription = await self.scheduler.run("asr", transcriber.finish)
+                logging.info("Transcripción en streaming: %s, %.0f ms tras el final del audio",
+                             transcriber.stats(), (time.perf_counter() - end) * 1000)
+                await websocket.send_json({"type": "transcription", "text": transcription})
+
+                # Procesa la transcripción con el agente
+                response = await asyncio.to_thread(
+                    self.agent.chat_handler,
+                    transcription,
+                    self.config
+                )
+
+                # Precarga los temas mencionados en la respuesta
+                self.prefetcher.schedule(extract_topics(response))
+
+                # Convierte la respuesta en audio
+                await self.generate_tts(response)
+
+                await websocket.send_json({"type": "response", "transcription": transcription, "response": response})
+                await websocket.close()
+
+            except WebSocketDisconnect:
+                logging.info("El cliente cerró la conexión de streaming")
+            except Exception as e:
+                logging.error(traceback.format_exc())
+                await websocket.send_json({"type": "error", "error": str(e)})
+                await websocket.close(code=1011)
+            finally:
+                stop.set()
+                if decoding is not None and not decoding.done():
+                    await asyncio.gather(decoding, return_exceptions=True)
+                if decoder is not None and decoder.process is not None and decoder.process.returncode is None:
+                    decoder.process.kill()
+
+        # Endpoint con el estado de las colas de inferencia
+        @self.local_server.get("/scheduler")
+        async def scheduler_stats():
+            """
+            Devuelve, para cada clase de modelo, la profundidad de la cola y los tiempos de espera y de ejecución.
+            """
+            return self.scheduler.stats()
+
+        # Endpoint con la actividad de la precarga y la tasa de aciertos de la caché
+        @self.local_server.get("/prefetch")
+        async def prefetch_stats():
+            """
+            Devuelve los temas precargados y cuántas búsquedas se resolvieron gracias a la precarga.
+            """
+            return self.prefetcher.stats()
+
         # Endpoint que devuelve el audio generado
         @self.local_server.get("/audio")
         def send_response_audio():
@@ -157,6 +291,36 @@ class Backend:
             else:
                 return JSONResponse(status_code=404, content={"error": "No se encontró el audio."})
 
+    async def receive_stream(self, websocket: WebSocket, decoder: AudioDecoder):
+        """
+        Pasa al decodificador los fragmentos de audio hasta que el cliente envía {"type": "end"}.
+        """
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                await decoder.feed(message["bytes"])
+            elif message.get("text") and json.loads(message["text"]).get("type") == "end":
+                return
+
+    async def decode_stream(self, websocket: WebSocket, transcriber: StreamingTranscriber, stop: asyncio.Event):
+        """
+        Decodifica periódicamente la ventana de audio en el ejecutor de Whisper y envía la
+        transcripción parcial. Marca el final del turno si detecta silencio tras la voz.
+        """
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), transcriber.step / SAMPLE_RATE)
+                return
+            except asyncio.TimeoutError:
+                pass
+            partial = await self.scheduler.run("asr", transcriber.update)
+            if partial is not None and not stop.is_set():
+                await websocket.send_json({"type": "partial", **partial})
+            if transcriber.ended():
+                stop.set()
+
     async def generate_tts(self, text: str):
         """
         Convierte texto en audio usando el modelo TTS de Edge (voz en español).
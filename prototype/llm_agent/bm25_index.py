@@ -0,0 +1,240 @@
+from scipy import sparse
+import numpy as np
+import unicodedata
+import json
+import os
+import re
+
+# Ficheros del índice léxico, guardados junto al índice FAISS
+MATRIX_FILE = "bm25.npz"
+VOCAB_FILE = "bm25_vocab.json"
+
+# Frecuencias de término y longitudes de documento sin ponderar (solo en los fragmentos, que
+# se puntúan con las estadísticas de todo el corpus) y resumen de sus estadísticas
+COUNTS_FILE = "bm25_counts.npz"
+DOC_LEN_FILE = "bm25_doc_len.npy"
+STATS_FILE = "bm25_stats.json"
+
+# Palabras vacías frecuentes en español que no aportan a la búsqueda léxica
+STOPWORDS = {
+    "a", "al", "como", "con", "cual", "cuando", "de", "del", "donde", "el", "en", "es", "esta", "este",
+    "fue", "ha", "la", "las", "lo", "los", "me", "mas", "mi", "muy", "no", "o", "para", "pero", "por",
+    "que", "quien", "se", "sin", "sobre", "su", "sus", "te", "un", "una", "uno", "unos", "y", "ya",
+}
+
+
+def tokenize(text: str) -> list:
+    """
+    Normaliza un texto (minúsculas y sin tildes) y lo divide en términos.
+
+    :param text: Texto de entrada.
+    :return: Lista de términos sin palabras vacías.
+    """
+    text = unicodedata.normalize("NFD", text.lower())
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    return [token for token in re.findall(r"\w+", text) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 sobre todos los chunks del corpus. Los pesos de cada par
+    (documento, término) se calculan al indexar, de modo que una consulta se resuelve
+    sumando las columnas de sus términos en una matriz dispersa.
+    Los identificadores de documento coinciden con los identificadores del índice FAISS.
+    """
+
+    def __init__(self, matrix: sparse.csc_matrix, vocabulary: dict, counts: sparse.csc_matrix = None,
+                 doc_len: np.ndarray = None, n_docs: int = None, k1: float = 1.5, b: float = 0.75):
+        """
+        :param matrix: Matriz dispersa documentos x términos con los pesos BM25.
+        :param vocabulary: Diccionario término -> columna.
+        :param counts: Matriz con las frecuencias de término sin ponderar (opcional).
+        :param doc_len: Longitud en términos de cada fila (necesaria con counts).
+        :param n_docs: Número de documentos indexados (necesario con counts).
+        :param k1: Saturación de la frecuencia de término.
+        :param b: Normalización por longitud de documento.
+        """
+        self.matrix = matrix
+        self.vocabulary = vocabulary
+        self.counts = counts
+        self.doc_len = doc_len
+        self.n_docs = n_docs
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts, ids: list = None, k1: float = 1.5, b: float = 0.75,
+              keep_counts: bool = False) -> "BM25Index":
+        """
+        Construye el índice a partir de los textos en el mismo orden que el índice FAISS.
+        Los textos se recorren una sola vez, por lo que pueden llegar de un generador.
+
+        :param texts: Contenido de los chunks (lista o iterable).
+        :param ids: Identificadores FAISS de cada texto (por defecto, su posición).
+        :param k1: Saturación de la frecuencia de término.
+        :param b: Normalización por longitud de documento.
+        :param keep_counts: Conservar las frecuencias sin ponderar para poder puntuar con
+                            estadísticas externas (ver search y corpus_stats).
+        :return: Índice BM25.
+        """
+        vocabulary = {}
+        rows, cols, tfs = [], [], []
+        doc_len = []
+
+        for doc_id, text in enumerate(texts):
+            counts = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            doc_len.append(len(tokens))
+            rows.extend([doc_id] * len(counts))
+            cols.extend(counts.keys())
+            tfs.extend(counts.values())
+
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        tfs = np.asarray(tfs, dtype=np.float32)
+
+        n_docs = len(doc_len)
+        doc_len = np.asarray(doc_len, dtype=np.float32)
+        df = np.bincount(cols, minlength=len(vocabulary))
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * doc_len / max(doc_len.mean() if n_docs else 0.0, 1.0))
+        weights = idf[cols] * tfs * (k1 + 1) / (tfs + norm[rows])
+
+        # Con un índice con identificadores (IndexIDMap) las filas son los identificadores FAISS
+        if ids is not None:
+            ids = np.asarray(ids, dtype=np.int64)
+            rows = ids[rows]
+        n_rows = int(ids.max()) + 1 if ids is not None and len(ids) else n_docs
+
+        matrix = sparse.csc_matrix((weights, (rows, cols)), shape=(n_rows, len(vocabulary)), dtype=np.float32)
+        counts = row_len = None
+        if keep_counts:
+            counts = sparse.csc_matrix((tfs, (rows, cols)), shape=(n_rows, len(vocabulary)), dtype=np.float32)
+            row_len = np.zeros(n_rows, dtype=np.float32)
+            row_len[ids if ids is not None else np.arange(n_docs)] = doc_len
+        return cls(matrix, vocabulary, counts, row_len, n_docs, k1, b)
+
+    def term_stats(self) -> dict:
+        """
+        Estadísticas del corpus del índice (requiere keep_counts): documentos, términos en
+        total y número de documentos que contienen cada término.
+        """
+        df = np.diff(self.counts.indptr)
+        return {
+            "n_docs": self.n_docs,
+            "total_len": float(self.doc_len.sum()),
+            "df": {term: int(df[column]) for term, column in self.vocabulary.items()},
+        }
+
+    def _scores(self, term_ids: list, terms: list, stats: dict) -> np.ndarray:
+        """
+        Puntúa con las frecuencias sin ponderar y las estadísticas de otro corpus (el corpus
+        completo del que este índice es un fragmento).
+        """
+        n_docs, avgdl = stats["n_docs"], max(stats["avgdl"], 1.0)
+        df = np.asarray([stats["df"].get(term, 0) for term in terms], dtype=np.float32)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        columns = self.counts[:, term_ids].tocoo()
+        tfs = columns.data
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[columns.row] / avgdl)
+        weights = idf[columns.col] * tfs * (self.k1 + 1) / (tfs + norm)
+        return np.bincount(columns.row, weights=weights, minlength=self.counts.shape[0])
+
+    def search(self, query: str, k: int, stats: dict = None) -> tuple:
+        """
+        Devuelve los k documentos con mayor puntuación BM25.
+
+        :param query: Consulta del usuario.
+        :param k: Número de documentos a devolver.
+        :param stats: Estadísticas del corpus completo ("n_docs", "avgdl" y "df" por término)
+                      con las que puntuar en lugar de las del propio índice. Solo se usan si
+                      el índice conserva las frecuencias sin ponderar.
+        :return: Tupla (ids, puntuaciones) ordenada de mayor a menor.
+        """
+        terms = [t for t in tokenize(query) if t in self.vocabulary]
+        term_ids = [self.vocabulary[t] for t in terms]
+        if not term_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if stats is not None and self.counts is not None:
+            scores = self._scores(term_ids, terms, stats).astype(np.float32)
+        else:
+            scores = np.asarray(self.matrix[:, term_ids].sum(axis=1)).ravel()
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return order, scores[order]
+
+    def save(self, persist_dir: str) -> None:
+        """
+        Guarda el índice en la carpeta del almacén vectorial.
+        """
+        sparse.save_npz(os.path.join(persist_dir, MATRIX_FILE), self.matrix)
+        with open(os.path.join(persist_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        if self.counts is not None:
+            sparse.save_npz(os.path.join(persist_dir, COUNTS_FILE), self.counts)
+            np.save(os.path.join(persist_dir, DOC_LEN_FILE), self.doc_len)
+            with open(os.path.join(persist_dir, STATS_FILE), "w", encoding="utf-8") as f:
+                json.dump({"k1": self.k1, "b": self.b, **self.term_stats()}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, persist_dir: str) -> "BM25Index":
+        """
+        Carga un índice guardado con save.
+        """
+        matrix = sparse.load_npz(os.path.join(persist_dir, MATRIX_FILE)).tocsc()
+        with open(os.path.join(persist_dir, VOCAB_FILE), encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        if not cls.has_counts(persist_dir):
+            return cls(matrix, vocabulary)
+        counts = sparse.load_npz(os.path.join(persist_dir, COUNTS_FILE)).tocsc()
+        doc_len = np.load(os.path.join(persist_dir, DOC_LEN_FILE))
+        with open(os.path.join(persist_dir, STATS_FILE), encoding="utf-8") as f:
+            stats = json.load(f)
+        return cls(matrix, vocabulary, counts, doc_len, stats["n_docs"], stats["k1"], stats["b"])
+
+    @staticmethod
+    def has_counts(persist_dir: str) -> bool:
+        return all(os.path.exists(os.path.join(persist_dir, name)) for name in (COUNTS_FILE, DOC_LEN_FILE, STATS_FILE))
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, MATRIX_FILE))
+
+
+def corpus_stats(stats_list: list) -> dict:
+    """
+    Combina las estadísticas de varios fragmentos (BM25Index.term_stats) en las del corpus completo.
+
+    :param stats_list: Estadísticas de cada fragmento.
+    :return: Diccionario con "n_docs", "avgdl" y "df" por término.
+    """
+    df = {}
+    n_docs, total_len = 0, 0.0
+    for stats in stats_list:
+        n_docs += stats["n_docs"]
+        total_len += stats["total_len"]
+        for term, count in stats["df"].items():
+            df[term] = df.get(term, 0) + count
+    return {"n_docs": n_docs, "avgdl": total_len / n_docs if n_docs else 0.0, "df": df}
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """
+    Fusiona varias listas ordenadas de identificadores mediante Reciprocal Rank Fusion.
+
+    :param rankings: Listas de identificadores, cada una ordenada por relevancia.
+    :param k: Constante de suavizado de RRF.
+    :return: Identificadores ordenados por puntuación fusionada.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            doc_id = int(doc_id)
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
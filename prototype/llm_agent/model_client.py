@@ -0,0 +1,100 @@
+from langchain_core.embeddings import Embeddings
+import numpy as np
+import httpx
+import wave
+import io
+import os
+
+# Dirección del servidor de modelos compartido: "unix:///ruta/al/socket" o "http://127.0.0.1:8001".
+# Si no está definida, cada proceso carga sus propios modelos.
+MODEL_SERVER_ENV = "MODEL_SERVER_URL"
+
+
+def model_server_url() -> str | None:
+    """
+    Devuelve la dirección del servidor de modelos configurada, o None si no se usa.
+    """
+    return os.getenv(MODEL_SERVER_ENV) or None
+
+
+def connect(url: str, timeout: float = 120.0) -> httpx.Client:
+    """
+    Crea un cliente HTTP hacia el servidor de modelos, por socket Unix o por TCP.
+
+    :param url: Dirección del servidor ("unix:///ruta" o "http://host:puerto").
+    :param timeout: Tiempo máximo de cada petición en segundos.
+    :return: Cliente HTTP reutilizable (mantiene la conexión abierta).
+    """
+    if url.startswith("unix://"):
+        transport = httpx.HTTPTransport(uds=url[len("unix://"):])
+        return httpx.Client(transport=transport, base_url="http://model-server", timeout=timeout)
+    return httpx.Client(base_url=url, timeout=timeout)
+
+
+class RemoteEmbeddings(Embeddings):
+    """
+    Embeddings calculados por el servidor de modelos, con la misma interfaz que
+    HuggingFaceEmbeddings para usarlos en el vector store y en la recuperación.
+    """
+
+    def __init__(self, url: str):
+        self.client = connect(url)
+
+    def embed_documents(self, texts: list) -> list:
+        response = self.client.post("/embed", json={"texts": list(texts)})
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+class RemoteCrossEncoder:
+    """
+    Reranking con el CrossEncoder del servidor de modelos (misma interfaz que CrossEncoder.predict).
+    """
+
+    def __init__(self, url: str):
+        self.client = connect(url)
+
+    def predict(self, pairs: list) -> np.ndarray:
+        response = self.client.post("/rerank", json={"pairs": [list(pair) for pair in pairs]})
+        response.raise_for_status()
+        return np.asarray(response.json()["scores"], dtype=np.float32)
+
+
+class RemoteTranscriber:
+    """
+    Transcripción con el modelo Whisper del servidor de modelos (misma interfaz que
+    whisper.Whisper.transcribe para un fichero de audio o un array de muestras).
+    """
+
+    def __init__(self, url: str):
+        self.client = connect(url)
+
+    def transcribe(self, audio, language: str = "spanish") -> dict:
+        """
+        :param audio: Ruta del fichero de audio o muestras float32 a 16 kHz (audio en streaming).
+        :param language: Idioma del audio.
+        :return: Diccionario con el texto transcrito en "text" y sus segmentos en "segments".
+        """
+        if isinstance(audio, np.ndarray):
+            # Las muestras se envían como WAV de 16 bits, que el servidor decodifica igual que un fichero
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(16000)
+                wav.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+            files = [("files", ("stream.wav", buffer.getvalue()))]
+            response = self.client.post("/transcribe", files=files, data={"language": language})
+        else:
+            with open(audio, "rb") as f:
+                response = self.client.post(
+                    "/transcribe",
+                    files=[("files", (os.path.basename(audio), f))],
+                    data={"language": language},
+                )
+        response.raise_for_status()
+        data = response.json()
+        return {"text": data["texts"][0], "segments": data.get("segments", [[]])[0]}
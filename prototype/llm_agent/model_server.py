@@ -0,0 +1,210 @@
+from fastapi import FastAPI, UploadFile, File, Form
+from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from scheduler import InferenceScheduler
+import argparse
+import asyncio
+import logging
+import os
+
+# Modelos compartidos por todos los procesos del backend (los mismos que cargan tools.py y backend.py)
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+RERANKER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+WHISPER_MODEL = "turbo"
+
+DEFAULT_SOCKET = "/tmp/asistente_modelos.sock"
+
+
+class EmbedRequest(BaseModel):
+    texts: list[str]
+
+
+class RerankRequest(BaseModel):
+    pairs: list[list[str]]
+
+
+class MicroBatcher:
+    """
+    Agrupa en un único lote las peticiones que llegan casi a la vez. Cada petición
+    espera como máximo max_wait_ms a que se sumen otras; el modelo se ejecuta en un
+    hilo propio, de modo que nunca hay dos llamadas simultáneas al mismo modelo.
+    """
+
+    def __init__(self, fn, max_batch: int = 64, max_wait_ms: float = 5.0, executor=None):
+        """
+        :param fn: Función que recibe una lista de entradas y devuelve una salida por entrada.
+        :param max_batch: Número máximo de entradas por lote.
+        :param max_wait_ms: Espera máxima para completar un lote.
+        :param executor: Ejecutor de los lotes (p. ej. el del planificador de inferencia).
+        """
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.worker = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, items: list) -> list:
+        """
+        Encola unas entradas y espera sus resultados.
+
+        :param items: Entradas de la petición.
+        :return: Salidas en el mismo orden.
+        """
+        loop = asyncio.get_running_loop()
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = loop.create_task(self._run())
+        future = loop.create_future()
+        await self.queue.put((items, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+
+            # Esperar brevemente a otras peticiones para llenar el lote
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                size += len(request[0])
+
+            inputs = [item for items, _ in batch for item in items]
+            try:
+                outputs = await asyncio.wrap_future(self.executor.submit(self.fn, inputs))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(inputs)
+            start = 0
+            for items, future in batch:
+                if not future.done():
+                    future.set_result(outputs[start:start + len(items)])
+                start += len(items)
+
+
+class ModelServer:
+    def __init__(self, device: str = "cpu", max_batch: int = 64, max_wait_ms: float = 5.0):
+        """
+        Carga una sola vez Whisper, el modelo de embeddings y el CrossEncoder y los
+        expone a los procesos del backend con llamadas por lotes.
+
+        :param device: Dispositivo de los modelos.
+        :param max_batch: Entradas máximas por lote de embeddings o de reranking.
+        :param max_wait_ms: Espera máxima para agrupar peticiones.
+        """
+        from langchain_huggingface import HuggingFaceEmbeddings
+        from sentence_transformers import CrossEncoder
+        import whisper
+
+        self.app = FastAPI()
+        logging.basicConfig(level=logging.INFO)
+
+        self.embedding_model = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            model_kwargs={'device': device},
+            encode_kwargs={'normalize_embeddings': True},
+        )
+        self.reranker = CrossEncoder(RERANKER_MODEL, device=device)
+        self.transcriptor = whisper.load_model(name=WHISPER_MODEL, device=device)
+
+        # Cada modelo se ejecuta en su ejecutor del planificador, con su presupuesto de hilos
+        self.scheduler = InferenceScheduler.from_env()
+        self.embed_batcher = MicroBatcher(self.embedding_model.embed_documents, max_batch, max_wait_ms,
+                                          executor=self.scheduler.executors["embed"])
+        self.rerank_batcher = MicroBatcher(
+            lambda pairs: self.reranker.predict([tuple(pair) for pair in pairs]).tolist(), max_batch, max_wait_ms,
+            executor=self.scheduler.executors["rerank"]
+        )
+
+        self.upload_folder = "audio_temp"
+        os.makedirs(self.upload_folder, exist_ok=True)
+
+        self.define_routes()
+
+    def define_routes(self):
+        @self.app.get("/health")
+        async def health():
+            return {
+                "status": "ok",
+                "embed": {"batches": self.embed_batcher.batches, "items": self.embed_batcher.items},
+                "rerank": {"batches": self.rerank_batcher.batches, "items": self.rerank_batcher.items},
+                "scheduler": self.scheduler.stats(),
+            }
+
+        @self.app.post("/embed")
+        async def embed(request: EmbedRequest):
+            """
+            Calcula los embeddings normalizados de una lista de textos.
+            """
+            return {"embeddings": await self.embed_batcher.submit(request.texts)}
+
+        @self.app.post("/rerank")
+        async def rerank(request: RerankRequest):
+            """
+            Puntúa pares (consulta, documento) con el CrossEncoder.
+            """
+            return {"scores": await self.rerank_batcher.submit(request.pairs)}
+
+        @self.app.post("/transcribe")
+        async def transcribe(files: list[UploadFile] = File(...), language: str = Form("spanish")):
+            """
+            Transcribe uno o varios ficheros de audio.
+            """
+            texts, segments = [], []
+            for file in files:
+                filepath = os.path.join(self.upload_folder, f"{uuid4().hex}_{file.filename}")
+                with open(filepath, "wb") as out_file:
+                    out_file.write(await file.read())
+                try:
+                    # Whisper no admite lotes de audios: se transcriben de uno en uno en su ejecutor
+                    result = await self.scheduler.run(
+                        "asr", self.transcriptor.transcribe, audio=filepath, language=language
+                    )
+                finally:
+                    os.remove(filepath)
+                texts.append(result["text"])
+                # Los segmentos permiten recortar la ventana en la transcripción en streaming
+                segments.append([
+                    {"start": s["start"], "end": s["end"], "text": s["text"]} for s in result.get("segments", [])
+                ])
+            return {"texts": texts, "segments": segments}
+
+
+# Lanza el servidor de modelos; los procesos del backend lo usan si se define MODEL_SERVER_URL
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Servidor local de modelos compartido por los procesos del backend.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Socket Unix en el que escuchar.")
+    parser.add_argument("--port", type=int, help="Escuchar en 127.0.0.1:PUERTO en lugar del socket.")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = ModelServer(args.device, args.max_batch, args.max_wait_ms)
+    if args.port:
+        print(f"Servidor de modelos en http://127.0.0.1:{args.port}")
+        uvicorn.run(server.app, host="127.0.0.1", port=args.port)
+    else:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        print(f"Servidor de modelos en unix://{args.socket}")
+        uvicorn.run(server.app, uds=args.socket)
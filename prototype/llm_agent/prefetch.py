@@ -0,0 +1,314 @@
+from collections import OrderedDict, deque
+import numpy as np
+import threading
+import os
+import re
+
+# Palabras con mayúscula que no son temas de conversación
+NON_TOPICS = {
+    "María", "Usted", "Ustedes", "Hola", "Buenos", "Buenas", "Gracias", "Sí", "No", "Qué", "Cómo",
+    "Cuándo", "Dónde", "Por", "Me", "Le", "Les", "Espero", "Claro", "Perfecto", "Muy", "Bueno",
+}
+
+# Secuencias de palabras con mayúscula, unidas por artículos y preposiciones ("Sierra de Cazorla")
+TOPIC_PATTERN = re.compile(
+    r"[A-ZÁÉÍÓÚÑ][\wáéíóúñü]+(?:\s+(?:(?:de|del|la|las|los|el|y)\s+)?[A-ZÁÉÍÓÚÑ][\wáéíóúñü]+)*"
+)
+SENTENCE_START = re.compile(r"(?:^|[.!?¡¿:;\n]\s*)$")
+
+
+def extract_topics(text: str, max_topics: int = 5) -> list:
+    """
+    Extrae de una respuesta los nombres propios mencionados (lugares, personajes, fiestas),
+    que suelen ser el tema de la siguiente pregunta del usuario.
+
+    Las palabras sueltas al comienzo de una frase solo se aceptan si también aparecen con
+    mayúscula en mitad de una frase, para no confundirlas con nombres propios.
+
+    :param text: Texto de la respuesta.
+    :param max_topics: Número máximo de temas.
+    :return: Temas en orden de aparición, sin repetir.
+    """
+    topics = {}
+    inner = set()
+    for match in TOPIC_PATTERN.finditer(text or ""):
+        # Se quita el artículo inicial de comienzo de frase ("La Catedral de Jaén")
+        topic = re.sub(r"^(?:El|La|Los|Las)\s+(?=[A-ZÁÉÍÓÚÑ])", "", match.group(0))
+        at_start = bool(SENTENCE_START.search(text[:match.start()]))
+        if not at_start:
+            inner.add(topic)
+        if topic in NON_TOPICS:
+            continue
+        topics.setdefault(topic, at_start and " " not in topic)
+
+    selected = [t for t, ambiguous in topics.items() if not ambiguous or t in inner]
+    return selected[:max_topics]
+
+
+def profile_topics(user_info: dict) -> list:
+    """
+    Temas del perfil del usuario: su lugar de nacimiento y cada uno de sus gustos.
+
+    :param user_info: Datos recibidos en /setup.
+    :return: Lista de temas.
+    """
+    topics = []
+    if birthplace := str(user_info.get("lugarNacimiento") or "").strip():
+        topics.append(birthplace)
+    likes = str(user_info.get("gustos") or "")
+    topics += [like.strip() for like in re.split(r",|;|\sy\s", likes) if like.strip()]
+    return list(dict.fromkeys(topics))
+
+
+class RetrievalCache:
+    """
+    Caché de resultados de recuperación. Una consulta reutiliza los resultados de otra si su
+    texto normalizado coincide y, solo si se indica un umbral, también si la similitud coseno
+    de sus embeddings lo supera (ver benchmark_retrieval.py --cache-quality). Se distinguen las entradas precargadas para medir la utilidad de la precarga.
+
+    Si se indica la versión del almacén, la caché se vacía cuando cambia (recarga de los
+    fragmentos o almacén reconstruido) para no devolver documentos que ya no están.
+    """
+
+    def __init__(self, max_entries: int = 256, threshold: float = None, version=None):
+        """
+        :param max_entries: Entradas máximas (se descartan las menos usadas recientemente).
+        :param threshold: Similitud coseno mínima para reutilizar una entrada (None: solo texto igual).
+        :param version: Función sin argumentos que devuelve la versión actual del almacén (opcional).
+        """
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.version = version
+        self.current_version = version() if version else None
+        self.invalidations = 0
+        self.entries = OrderedDict()  # texto normalizado -> {"embedding", "results", "prefetched", "used"}
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.prefetch_hits = 0
+        self.prefetched = 0
+
+    def _check_version(self) -> None:
+        """
+        Vacía la caché si el almacén ha cambiado desde la última comprobación.
+        """
+        if self.version is None:
+            return
+        # Fuera del cerrojo: comprobar la versión puede recargar los fragmentos
+        version = self.version()
+        with self.lock:
+            if version != self.current_version:
+                self.current_version = version
+                self.entries.clear()
+                self.invalidations += 1
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _match(self, query: str, embedding: np.ndarray = None):
+        key = self.normalize(query)
+        if key in self.entries:
+            return key
+        if embedding is None or self.threshold is None or not self.entries:
+            return None
+        keys = list(self.entries)
+        matrix = np.stack([self.entries[k]["embedding"] for k in keys])
+        similarities = matrix @ np.asarray(embedding, dtype=np.float32).ravel()
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.threshold else None
+
+    def contains(self, query: str, embedding: np.ndarray = None) -> bool:
+        """
+        Comprueba si una consulta ya está en la caché, sin contarlo como búsqueda.
+        """
+        self._check_version()
+        with self.lock:
+            return self._match(query, embedding) is not None
+
+    def lookup(self, query: str, embed):
+        """
+        Busca una consulta: primero por texto y, si no está, por similitud de embeddings.
+
+        :param query: Consulta del usuario.
+        :param embed: Función sin argumentos que calcula el embedding (solo se llama si hace falta).
+        :return: Tupla (resultados o None, embedding calculado o None).
+        """
+        self._check_version()
+        with self.lock:
+            self.lookups += 1
+            key = self._match(query)
+        embedding = None
+        if key is None and self.threshold is not None:
+            embedding = embed()
+            with self.lock:
+                key = self._match(query, embedding)
+        if key is None:
+            return None, embedding
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, embedding
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if entry["prefetched"] and not entry["used"]:
+                self.prefetch_hits += 1
+            entry["used"] = True
+            return entry["results"], embedding
+
+    def put(self, query: str, embedding: np.ndarray, results: list, prefetched: bool = False) -> None:
+        """
+        Guarda los resultados de una consulta.
+
+        :param prefetched: Si es True, la entrada procede de la precarga.
+        """
+        self._check_version()
+        with self.lock:
+            key = self.normalize(query)
+            self.entries[key] = {
+                "embedding": np.asarray(embedding, dtype=np.float32).ravel(),
+                "results": results,
+                "prefetched": prefetched,
+                "used": False,
+            }
+            self.entries.move_to_end(key)
+            if prefetched:
+                self.prefetched += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        :return: Búsquedas, aciertos, aciertos de entradas precargadas y tasas correspondientes.
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "invalidations": self.invalidations,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else None,
+                "prefetched": self.prefetched,
+                "prefetch_hits": self.prefetch_hits,
+                # Fracción de búsquedas resueltas gracias a la precarga
+                "prefetch_hit_rate": self.prefetch_hits / self.lookups if self.lookups else None,
+                # Fracción de consultas precargadas que se llegaron a usar
+                "prefetch_precision": self.prefetch_hits / self.prefetched if self.prefetched else None,
+            }
+
+
+class Prefetcher:
+    """
+    Precarga en segundo plano los resultados de recuperación de los temas que probablemente
+    aparezcan en la siguiente pregunta, mientras el usuario piensa y graba su mensaje.
+    Las llamadas a los modelos usan la clase de baja prioridad del planificador de
+    inferencia, y la precarga se cancela en cuanto llega una petición real: la etapa en
+    curso termina, pero no empieza ninguna más.
+    """
+
+    def __init__(self, retriever, cache: RetrievalCache, max_pending: int = 10):
+        """
+        :param retriever: Recuperador (ver retriever.py) que comparte la caché con la herramienta.
+        :param cache: Caché de resultados que se precalienta.
+        :param max_pending: Temas pendientes como máximo.
+        """
+        self.retriever = retriever.background()
+        self.cache = cache
+        self.pending = deque(maxlen=max_pending)
+        self.condition = threading.Condition()
+        self.generation = 0
+        self.closed = False
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.worker = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self.worker.start()
+
+    def schedule(self, topics: list) -> None:
+        """
+        Añade temas a precargar (los que ya están en la caché se omiten al procesarlos).
+        """
+        with self.condition:
+            for topic in topics:
+                if topic not in self.pending:
+                    self.pending.append(topic)
+                    self.scheduled += 1
+            self.condition.notify()
+
+    def cancel(self) -> None:
+        """
+        Descarta los temas pendientes e interrumpe la precarga en curso.
+        """
+        with self.condition:
+            self.cancelled += len(self.pending)
+            self.pending.clear()
+            self.generation += 1
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.generation += 1
+            self.condition.notify()
+
+    def _run(self):
+        # La búsqueda en FAISS y la lectura de documentos se hacen en este hilo: prioridad mínima
+        if hasattr(os, "setpriority"):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                pass
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                topic = self.pending.popleft()
+                generation = self.generation
+            try:
+                done = self._prefetch(topic, lambda: self.generation != generation)
+            except Exception:
+                done = False
+            with self.condition:
+                if done:
+                    self.completed += 1
+                elif self.generation != generation:
+                    self.cancelled += 1
+
+    def _prefetch(self, topic: str, cancelled) -> bool:
+        """
+        Recupera un tema etapa a etapa, comprobando entre etapas si se ha cancelado.
+
+        :return: True si los resultados se guardaron en la caché.
+        """
+        if self.cache.contains(topic):
+            return False
+        retriever = self.retriever
+
+        embedding = retriever.embed(topic)
+        if cancelled() or self.cache.contains(topic, embedding):
+            return False
+        ids, first_scores = retriever.candidates(topic, embedding)
+        if cancelled():
+            return False
+        ids, texts, first_scores = retriever.fetch(ids, first_scores)
+        if cancelled():
+            return False
+        positions = retriever.rank(topic, texts, first_scores)
+        if cancelled():
+            return False
+
+        self.cache.put(topic, embedding, [texts[i] for i in positions], prefetched=True)
+        return True
+
+    def stats(self) -> dict:
+        with self.condition:
+            stats = {
+                "pending": len(self.pending),
+                "scheduled": self.scheduled,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+            }
+        return {**stats, "cache": self.cache.stats()}
@@ -0,0 +1,269 @@
+from bm25_index import reciprocal_rank_fusion
+import numpy as np
+import faiss
+import copy
+import time
+
+# Configuración por defecto de la recuperación híbrida
+DEFAULT_CONFIG = {
+    "dense_k": 20,     # Candidatos recuperados por FAISS
+    "lexical_k": 20,   # Candidatos recuperados por BM25
+    "rerank_k": 10,    # Candidatos fusionados que se pasan al CrossEncoder
+    "rrf_k": 60,       # Constante de Reciprocal Rank Fusion
+    "top_k": 5,        # Documentos devueltos tras el reranking
+    "max_chars": 1024,  # Caracteres de cada documento que se pasan al CrossEncoder
+
+    # Reranking en cascada: el CrossEncoder solo puntúa los candidatos necesarios
+    "cascade": False,              # Activar el modo en cascada
+    "cascade_window": 0.1,         # Candidatos a menos de esta similitud del primero entran en la profundidad inicial
+    "cascade_min_k": 5,            # Profundidad mínima (nunca menor que top_k)
+    "cascade_step": 5,             # Pares puntuados en cada llamada al CrossEncoder
+    "cascade_gap": 0.3,            # Separación que detiene la cascada (ver cascade_rerank)
+    "cascade_budget_ms": None,     # Tiempo máximo de reranking por consulta
+    "cascade_lexical_weight": 0.0  # Peso de la puntuación BM25 normalizada en la puntuación inicial
+}
+
+
+def cascade_rerank(query: str, texts: list, first_scores: list, predict, config: dict) -> tuple:
+    """
+    Reranking en cascada. Los candidatos se recorren por su puntuación de la primera etapa
+    y se puntúan por bloques con el CrossEncoder:
+
+    - Profundidad adaptativa: solo entran los candidatos cuya puntuación inicial está a
+      menos de cascade_window de la mejor (como mínimo cascade_min_k y top_k). Si la
+      primera etapa está muy segura, se puntúan pocos pares.
+    - Parada temprana: si el mejor candidato del último bloque queda al menos cascade_gap
+      por debajo del top_k-ésimo ya puntuado, los resultados están claramente separados.
+    - Presupuesto: no se lanza un bloque si, al ritmo medido, superaría cascade_budget_ms.
+
+    Los candidatos sin puntuar se colocan detrás de los puntuados en el orden de la primera
+    etapa. Sin ventana, separación ni presupuesto se obtiene el mismo orden que el reranking completo.
+
+    :param query: Consulta del usuario.
+    :param texts: Textos de los candidatos.
+    :param first_scores: Puntuación de la primera etapa de cada candidato (mayor es mejor).
+    :param predict: Función del CrossEncoder que puntúa una lista de pares (consulta, texto).
+    :param config: Parámetros de la recuperación (ver DEFAULT_CONFIG).
+    :return: Tupla (posiciones de los top_k candidatos, estadísticas de la cascada).
+    """
+    top_k = config["top_k"]
+    if not texts:
+        return [], {"pairs": 0, "depth": 0, "stop": "empty", "ms": 0.0}
+
+    order = sorted(range(len(texts)), key=lambda i: -first_scores[i])
+    best = first_scores[order[0]]
+    window = config["cascade_window"]
+    depth = len(texts) if window is None else sum(1 for i in order if first_scores[i] >= best - window)
+    depth = min(len(texts), max(depth, config["cascade_min_k"], top_k))
+
+    budget = config["cascade_budget_ms"]
+    gap = config["cascade_gap"]
+    step = max(1, config["cascade_step"])
+
+    start = time.perf_counter()
+    scores = {}
+    stop = "depth"
+    while len(scores) < depth:
+        batch = order[len(scores):min(depth, len(scores) + step)]
+
+        # Se estima la duración del bloque con el tiempo por par medido hasta ahora
+        if budget is not None and scores:
+            elapsed = (time.perf_counter() - start) * 1000
+            if elapsed + elapsed / len(scores) * len(batch) > budget:
+                stop = "budget"
+                break
+
+        batch_scores = predict([(query, texts[i]) for i in batch])
+        scores.update(zip(batch, (float(score) for score in batch_scores)))
+
+        if gap is not None and len(scores) > top_k and len(scores) < depth:
+            ranked = sorted(scores.values(), reverse=True)
+            if ranked[top_k - 1] - max(scores[i] for i in batch) >= gap:
+                stop = "separated"
+                break
+
+    # Mismo orden que sorted(zip(scores, texts), reverse=True) entre los candidatos puntuados
+    ranked = sorted(scores, key=lambda i: (scores[i], texts[i]), reverse=True)
+    ranked += [i for i in order if i not in scores]
+    stats = {"pairs": len(scores), "depth": depth, "stop": stop, "ms": (time.perf_counter() - start) * 1000}
+    return ranked[:top_k], stats
+
+
+class Retriever:
+    """
+    Recuperación de la herramienta del agente dividida en etapas independientes
+    (embedding de la consulta, búsqueda, lectura de documentos y reranking), de modo
+    que cada una pueda medirse o sustituirse por separado.
+    """
+
+    def __init__(self, vector_store, embedding_model, reranker, bm25_index=None, config: dict = None,
+                 scheduler=None, cache=None):
+        """
+        :param vector_store: Vector store de LangChain (índice FAISS y docstore).
+        :param embedding_model: Modelo de embeddings de las consultas.
+        :param reranker: CrossEncoder usado para reordenar los candidatos.
+        :param bm25_index: Índice BM25 opcional para la búsqueda híbrida.
+        :param config: Parámetros de la recuperación (ver DEFAULT_CONFIG).
+        :param scheduler: Planificador de inferencia opcional (ver scheduler.py) en el que se
+                          ejecutan el embedding y el reranking.
+        :param cache: Caché de resultados opcional (ver prefetch.RetrievalCache).
+        """
+        self.vector_store = vector_store
+        self.embedding_model = embedding_model
+        self.reranker = reranker
+        self.bm25_index = bm25_index
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.scheduler = scheduler
+        self.cache = cache
+        self.scheduler_class = None  # Clase del planificador que sustituye a "embed" y "rerank"
+
+    def _call(self, model_class: str, fn, *args):
+        if self.scheduler is None:
+            return fn(*args)
+        return self.scheduler.run_sync(self.scheduler_class or model_class, fn, *args)
+
+    def background(self, model_class: str = "prefetch") -> "Retriever":
+        """
+        Devuelve una copia que comparte modelos, índices y caché pero ejecuta todas sus
+        llamadas a los modelos en la clase de baja prioridad del planificador.
+        """
+        clone = copy.copy(self)
+        clone.scheduler_class = model_class
+        return clone
+
+    def embed(self, query: str) -> np.ndarray:
+        """
+        Calcula el embedding de la consulta.
+
+        :param query: Consulta del usuario.
+        :return: Matriz 1 x d en float32.
+        """
+        return np.asarray([self._call("embed", self.embedding_model.embed_query, query)], dtype=np.float32)
+
+    def candidates(self, query: str, embedding: np.ndarray) -> tuple:
+        """
+        Recupera candidatos con FAISS y BM25 y los fusiona mediante Reciprocal Rank Fusion.
+        Sin índice BM25 se devuelven los resultados densos, como en la recuperación original.
+
+        La puntuación de la primera etapa de cada candidato es su similitud coseno con la
+        consulta (la menor de los resultados densos si solo lo encontró BM25), más la
+        puntuación BM25 normalizada multiplicada por cascade_lexical_weight.
+
+        :param query: Consulta del usuario.
+        :param embedding: Embedding de la consulta.
+        :return: Tupla (identificadores ordenados por relevancia fusionada, puntuaciones de la primera etapa).
+        """
+        index = self.vector_store.index
+        distances, dense_ids = index.search(embedding, self.config["dense_k"])
+        valid = dense_ids[0] != -1
+        dense_ids = [int(i) for i in dense_ids[0][valid]]
+        similarities = distances[0][valid]
+        if index.metric_type == faiss.METRIC_L2:
+            # Con vectores normalizados, ||a - b||^2 = 2 - 2 cos(a, b)
+            similarities = 1 - similarities / 2
+        dense = dict(zip(dense_ids, similarities.tolist()))
+
+        if self.bm25_index is None:
+            return dense_ids, [dense[i] for i in dense_ids]
+
+        lexical_ids, lexical_scores = self.bm25_index.search(query, self.config["lexical_k"])
+        ids = reciprocal_rank_fusion(
+            [dense_ids, lexical_ids], k=self.config["rrf_k"]
+        )[:self.config["rerank_k"]]
+
+        floor = min(dense.values(), default=0.0)
+        lexical = {}
+        if len(lexical_scores) and lexical_scores[0] > 0:
+            lexical = dict(zip(map(int, lexical_ids), (lexical_scores / lexical_scores[0]).tolist()))
+        weight = self.config["cascade_lexical_weight"]
+        return ids, [dense.get(i, floor) + weight * lexical.get(i, 0.0) for i in ids]
+
+    def search(self, query: str, embedding: np.ndarray) -> list:
+        """
+        Identificadores de los candidatos de la primera etapa (ver candidates).
+
+        :param query: Consulta del usuario.
+        :param embedding: Embedding de la consulta.
+        :return: Identificadores de los candidatos ordenados por relevancia fusionada.
+        """
+        return self.candidates(query, embedding)[0]
+
+    def fetch(self, ids: list, first_scores: list = None) -> tuple:
+        """
+        Lee del docstore los textos de los candidatos. Los identificadores que ya no están
+        en el docstore (p. ej. tras un borrado incremental, o si BM25 y FAISS no coinciden)
+        se descartan junto con su puntuación.
+
+        :param ids: Identificadores de los candidatos.
+        :param first_scores: Puntuaciones de la primera etapa (opcional).
+        :return: Tupla (identificadores, textos recortados a max_chars, puntuaciones o None)
+                 de los candidatos encontrados, en el mismo orden.
+        """
+        docs = self.vector_store.docstore.mget(ids)
+        found = [i for i, doc in enumerate(docs) if doc is not None]
+        return (
+            [ids[i] for i in found],
+            [docs[i].page_content[:self.config["max_chars"]] for i in found],
+            None if first_scores is None else [first_scores[i] for i in found],
+        )
+
+    def rerank(self, query: str, texts: list) -> list:
+        """
+        Reordena los candidatos con el CrossEncoder.
+
+        :param query: Consulta del usuario.
+        :param texts: Textos de los candidatos.
+        :return: Posiciones (en texts) de los top_k mejores candidatos.
+        """
+        if not texts:
+            return []
+        scores = self._call("rerank", self.reranker.predict, [(query, text) for text in texts])
+        # Mismo orden que sorted(zip(scores, texts), reverse=True)
+        order = sorted(range(len(texts)), key=lambda i: (scores[i], texts[i]), reverse=True)
+        return order[:self.config["top_k"]]
+
+    def cascade(self, query: str, texts: list, first_scores: list) -> tuple:
+        """
+        Reordena los candidatos con el reranking en cascada (ver cascade_rerank).
+
+        :param query: Consulta del usuario.
+        :param texts: Textos de los candidatos.
+        :param first_scores: Puntuaciones de la primera etapa.
+        :return: Tupla (posiciones de los top_k candidatos, estadísticas de la cascada).
+        """
+        predict = lambda pairs: self._call("rerank", self.reranker.predict, pairs)
+        return cascade_rerank(query, texts, first_scores, predict, self.config)
+
+    def rank(self, query: str, texts: list, first_scores: list) -> list:
+        """
+        Reordena los candidatos con el reranking configurado (completo o en cascada).
+
+        :return: Posiciones (en texts) de los top_k mejores candidatos.
+        """
+        if self.config["cascade"]:
+            return self.cascade(query, texts, first_scores)[0]
+        return self.rerank(query, texts)
+
+    def retrieve(self, query: str) -> list:
+        """
+        Ejecuta todas las etapas de la recuperación. Con caché, una consulta igual o muy
+        parecida a otra ya resuelta (o precargada) reutiliza sus resultados.
+
+        :param query: Consulta del usuario.
+        :return: Textos de los documentos más relevantes.
+        """
+        if self.cache is None:
+            embedding = self.embed(query)
+        else:
+            results, embedding = self.cache.lookup(query, lambda: self.embed(query))
+            if results is not None:
+                return results
+            if embedding is None:
+                embedding = self.embed(query)
+
+        ids, texts, first_scores = self.fetch(*self.candidates(query, embedding))
+        results = [texts[i] for i in self.rank(query, texts, first_scores)]
+
+        if self.cache is not None:
+            self.cache.put(query, embedding, results)
+        return results
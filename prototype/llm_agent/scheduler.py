@@ -0,0 +1,209 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import numpy as np
+import threading
+import asyncio
+import json
+import time
+import sys
+import os
+
+# Configuración opcional en JSON, p. ej. '{"asr": {"threads": 4, "cores": [0, 1, 2, 3]}}'
+SCHEDULER_ENV = "INFERENCE_SCHEDULER"
+
+# Clases de modelo con ejecutor propio ("prefetch" agrupa las llamadas de la precarga en segundo plano)
+MODEL_CLASSES = ("asr", "embed", "rerank", "prefetch")
+
+
+def default_budgets(cpus: int = None) -> dict:
+    """
+    Reparto por defecto de los núcleos: la mitad para Whisper y una cuarta parte para el
+    modelo de embeddings y para el CrossEncoder, con un hilo de trabajo por clase. La
+    precarga usa un único hilo con la prioridad del sistema más baja.
+
+    :param cpus: Núcleos disponibles (por defecto, los del sistema).
+    :return: Diccionario clase -> {"workers", "threads", "cores", "nice"}.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    return {
+        "asr": {"workers": 1, "threads": max(1, cpus // 2), "cores": None, "nice": 0},
+        "embed": {"workers": 1, "threads": max(1, cpus // 4), "cores": None, "nice": 0},
+        "rerank": {"workers": 1, "threads": max(1, cpus // 4), "cores": None, "nice": 0},
+        "prefetch": {"workers": 1, "threads": 1, "cores": None, "nice": 19},
+    }
+
+
+def _set_torch_threads(threads: int) -> None:
+    """
+    Fija los hilos intra-op de torch si el proceso ya lo ha importado (no se importa solo
+    para esto: con los modelos remotos torch no llega a cargarse).
+    """
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+
+
+def _init_worker(threads: int, cores: list = None, nice: int = 0) -> None:
+    """
+    Inicializa un hilo de trabajo: fija su afinidad (que heredan los hilos de OpenMP que
+    cree), su prioridad y el número de hilos intra-op de torch.
+    """
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)  # 0 = el hilo actual en Linux
+    if nice and hasattr(os, "setpriority"):
+        try:
+            # En Linux la prioridad se aplica por hilo
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+        except OSError:
+            pass
+    _set_torch_threads(threads)
+
+
+class ModelExecutor:
+    """
+    Ejecutor de una clase de modelo con un número fijo de hilos de trabajo y de hilos de
+    inferencia. Registra la profundidad de la cola y el tiempo de espera y de ejecución.
+    """
+
+    def __init__(self, name: str, workers: int = 1, threads: int = 1, cores: list = None, nice: int = 0,
+                 history: int = 1000):
+        """
+        :param name: Nombre de la clase de modelo.
+        :param workers: Llamadas al modelo que pueden ejecutarse a la vez.
+        :param threads: Hilos de torch de cada llamada.
+        :param cores: Núcleos a los que se fija el ejecutor (None para no fijarlo).
+        :param nice: Prioridad de los hilos (0 normal, 19 la más baja).
+        :param history: Llamadas recientes usadas para las estadísticas.
+        """
+        self.name = name
+        self.workers = workers
+        self.threads = threads
+        self.cores = cores
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix=f"inference-{name}",
+            initializer=_init_worker,
+            initargs=(threads, cores, nice),
+        )
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.waits = deque(maxlen=history)
+        self.runs = deque(maxlen=history)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Encola una llamada al modelo.
+
+        :return: Future de concurrent.futures con el resultado.
+        """
+        submitted = time.perf_counter()
+        with self.lock:
+            self.queued += 1
+
+        def _task():
+            start = time.perf_counter()
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+                self.waits.append(start - submitted)
+            # torch.set_num_threads es global al proceso: si se fijara solo al crear el hilo,
+            # el último ejecutor inicializado impondría su presupuesto a todos. Se vuelve a
+            # aplicar en cada llamada; con llamadas de varias clases a la vez, la que empieza
+            # después fija los hilos de ambas hasta que termine.
+            _set_torch_threads(self.threads)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.runs.append(time.perf_counter() - start)
+
+        return self.executor.submit(_task)
+
+    def stats(self) -> dict:
+        """
+        :return: Cola, llamadas en curso y percentiles de espera y ejecución en milisegundos.
+        """
+        with self.lock:
+            waits = np.asarray(self.waits) * 1000
+            runs = np.asarray(self.runs) * 1000
+            stats = {
+                "workers": self.workers,
+                "threads": self.threads,
+                "cores": self.cores,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+            }
+        for label, values in [("wait", waits), ("run", runs)]:
+            for q in (50, 95, 99):
+                stats[f"{label}_p{q}_ms"] = round(float(np.percentile(values, q)), 3) if len(values) else None
+        return stats
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class InferenceScheduler:
+    """
+    Reparte la CPU entre Whisper, el modelo de embeddings y el CrossEncoder. Cada clase
+    de modelo tiene su ejecutor y su presupuesto de hilos, de modo que las peticiones
+    concurrentes esperan en su cola en lugar de competir por los mismos núcleos.
+    """
+
+    def __init__(self, budgets: dict = None):
+        """
+        :param budgets: Clase -> {"workers", "threads", "cores", "nice"}; lo no indicado toma el valor por defecto.
+        """
+        defaults = default_budgets()
+        budgets = budgets or {}
+        self.executors = {
+            name: ModelExecutor(name, **{**defaults.get(name, {"workers": 1, "threads": 1, "cores": None, "nice": 0}),
+                                         **budgets.get(name, {})})
+            for name in dict.fromkeys([*MODEL_CLASSES, *budgets])
+        }
+
+    @classmethod
+    def from_env(cls) -> "InferenceScheduler":
+        """
+        Crea el planificador con la configuración de la variable INFERENCE_SCHEDULER, si existe.
+        """
+        config = os.getenv(SCHEDULER_ENV)
+        return cls(json.loads(config) if config else None)
+
+    def run_sync(self, model_class: str, fn, *args, **kwargs):
+        """
+        Ejecuta una llamada en el ejecutor de su clase y espera el resultado (desde código síncrono).
+        """
+        return self.executors[model_class].submit(fn, *args, **kwargs).result()
+
+    async def run(self, model_class: str, fn, *args, **kwargs):
+        """
+        Ejecuta una llamada en el ejecutor de su clase sin bloquear el bucle de eventos.
+        """
+        return await asyncio.wrap_future(self.executors[model_class].submit(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        return {name: executor.stats() for name, executor in self.executors.items()}
+
+    def shutdown(self) -> None:
+        for executor in self.executors.values():
+            executor.shutdown()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> InferenceScheduler:
+    """
+    Devuelve el planificador compartido por el backend y las herramientas del agente.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler.from_env()
+        return _scheduler
@@ -0,0 +1,426 @@
+from concurrent.futures import ProcessPoolExecutor
+from vector_store import INDEX_FILE, DOCSTORE_FILE, SQLiteDocstore, read_index, open_index
+from bm25_index import BM25Index, tokenize, reciprocal_rank_fusion
+from collections import OrderedDict
+import multiprocessing
+import numpy as np
+import threading
+import heapq
+import faiss
+import json
+import time
+import os
+
+# Manifiesto de un almacén fragmentado: lista de fragmentos con su carpeta y su versión
+SHARDS_FILE = "shards.json"
+
+
+def read_manifest(root: str) -> dict:
+    """
+    Lee el manifiesto de un almacén fragmentado.
+
+    :param root: Carpeta del almacén.
+    :return: Diccionario con "shards": [{"name", "path", "version", "ntotal", ...}] y, si se
+             construyó con estadísticas BM25 globales, "bm25": {"n_docs", "avgdl", "df"}.
+    """
+    with open(os.path.join(root, SHARDS_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(root: str, manifest: dict) -> None:
+    """
+    Publica el manifiesto de forma atómica: los procesos que lo leen ven la versión
+    anterior o la nueva, nunca una a medias.
+    """
+    path = os.path.join(root, SHARDS_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def is_sharded(root: str) -> bool:
+    return os.path.exists(os.path.join(root, SHARDS_FILE))
+
+
+# Constante de suavizado de RRF al fusionar fragmentos sin estadísticas BM25 globales
+RRF_K = 60
+
+# Fragmentos abiertos en cada proceso de trabajo: carpeta -> (versión, índice, BM25 o None)
+_open_shards = {}
+
+
+def _init_worker() -> None:
+    # El paralelismo viene de los procesos: cada uno busca con un solo hilo de OpenMP
+    faiss.omp_set_num_threads(1)
+
+
+def _open_shard(path: str, version: str):
+    """
+    Devuelve el índice y el BM25 de un fragmento, reabriéndolo si su versión ha cambiado.
+    """
+    cached = _open_shards.get(path)
+    if cached is None or cached[0] != version:
+        index = open_index(path)
+        bm25 = BM25Index.load(path) if BM25Index.exists(path) else None
+        cached = _open_shards[path] = (version, index, bm25)
+    return cached[1], cached[2]
+
+
+def _load_shards(shards: list) -> dict:
+    """
+    Abre los fragmentos asignados al proceso y cierra los que ya no le corresponden.
+
+    :param shards: Lista de tuplas (carpeta, versión).
+    :return: Memoria residente del proceso en MB y fragmentos abiertos.
+    """
+    paths = {path for path, _ in shards}
+    for path in list(_open_shards):
+        if path not in paths:
+            del _open_shards[path]
+    for path, version in shards:
+        _open_shard(path, version)
+    rss = 0.0
+    if os.path.exists("/proc/self/statm"):
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    return {"pid": os.getpid(), "rss_mb": round(rss, 1), "shards": len(_open_shards)}
+
+
+def _search_dense(shards: list, queries: np.ndarray, k: int) -> list:
+    """
+    Busca en los fragmentos del proceso.
+
+    :param shards: Lista de tuplas (carpeta, versión).
+    :return: Lista de tuplas (distancias, identificadores) por fragmento.
+    """
+    results = []
+    for path, version in shards:
+        index, _ = _open_shard(path, version)
+        results.append(index.search(queries, k))
+    return results
+
+
+def _search_lexical(shards: list, query: str, k: int, stats: dict = None) -> list:
+    """
+    Busca con BM25 en los fragmentos del proceso.
+
+    :param stats: Estadísticas del corpus completo para los términos de la consulta (ver BM25Index.search).
+    :return: Lista de tuplas (identificadores, puntuaciones) por fragmento.
+    """
+    results = []
+    for path, version in shards:
+        _, bm25 = _open_shard(path, version)
+        if bm25 is None:
+            results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+        else:
+            results.append(bm25.search(query, k, stats))
+    return results
+
+
+class ShardedIndex:
+    """
+    Índice FAISS repartido en fragmentos que se consultan en paralelo (scatter-gather).
+
+    Cada proceso de trabajo abre solo los fragmentos que tiene asignados, de modo que la
+    memoria por proceso no crece con el número de fragmentos, y una consulta envía un único
+    mensaje a cada proceso. Los resultados parciales se fusionan quedándose con los k mejores.
+
+    Los fragmentos usan los identificadores globales de los chunks, así que los resultados
+    coinciden con los de un único índice con el mismo contenido. El manifiesto se vuelve a
+    leer cuando cambia en disco: solo se reabren los fragmentos cuya versión ha cambiado.
+
+    Tiene la interfaz de faiss.Index que usa el recuperador (search, metric_type, ntotal, d).
+    """
+
+    def __init__(self, root: str, workers: int = None, reload_interval: float = 5.0, max_locations: int = 10000):
+        """
+        :param root: Carpeta del almacén fragmentado (con shards.json).
+        :param workers: Procesos de búsqueda (por defecto, uno por CPU sin superar los fragmentos).
+        :param reload_interval: Segundos entre comprobaciones del manifiesto.
+        :param max_locations: Identificadores recientes cuyo fragmento se recuerda para leer sus documentos.
+        """
+        self.root = root
+        self.reload_interval = reload_interval
+        self.max_locations = max_locations
+        self.lock = threading.Lock()
+        self.manifest_mtime = None
+        self.last_check = 0.0
+        self.shards = []
+        self.bm25_stats = None
+        self.docstores = {}
+        self.locations = OrderedDict()  # identificador -> fragmento
+        self.reloaded_shards = 0
+
+        manifest = read_manifest(root)
+        n_shards = len(manifest["shards"])
+        self.n_workers = max(1, min(workers or os.cpu_count() or 1, n_shards))
+
+        # Un ejecutor de un solo proceso por grupo para que cada fragmento viva en un único proceso.
+        # Los procesos se crean con fork al abrir el índice, antes de cargar los modelos
+        context = multiprocessing.get_context("fork")
+        self.executors = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker)
+            for _ in range(self.n_workers)
+        ]
+        self.reload(force=True)
+
+        first = read_index(os.path.join(self._path(manifest["shards"][0]), INDEX_FILE))
+        self.metric_type = first.metric_type
+        self.d = first.d
+        del first
+
+    def _path(self, shard: dict) -> str:
+        return os.path.join(self.root, shard["path"])
+
+    def _groups(self, shards: list) -> list:
+        """
+        :return: Para cada proceso, la lista de fragmentos que tiene asignados.
+        """
+        groups = [[] for _ in self.executors]
+        for i, shard in enumerate(shards):
+            groups[i % len(self.executors)].append(shard)
+        return groups
+
+    def _locate(self, ids, shard_name: str) -> None:
+        for i in ids:
+            self.locations[int(i)] = shard_name
+            self.locations.move_to_end(int(i))
+        while len(self.locations) > self.max_locations:
+            self.locations.popitem(last=False)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard["ntotal"] for shard in self.shards)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Vuelve a leer el manifiesto si ha cambiado y abre las nuevas versiones de los fragmentos.
+
+        :param force: Leer el manifiesto aunque no haya cambiado.
+        :return: True si se ha recargado.
+        """
+        with self.lock:
+            mtime = os.stat(os.path.join(self.root, SHARDS_FILE)).st_mtime_ns
+            if not force and mtime == self.manifest_mtime:
+                return False
+            manifest = read_manifest(self.root)
+            shards = manifest["shards"]
+
+            # Los procesos abren las nuevas versiones antes de publicarlas para las consultas
+            futures = [
+                executor.submit(_load_shards, [(self._path(shard), shard["version"]) for shard in group])
+                for executor, group in zip(self.executors, self._groups(shards))
+            ]
+            for future in futures:
+                future.result()
+
+            previous = {shard["name"]: shard["version"] for shard in self.shards}
+            for shard in shards:
+                if previous.get(shard["name"]) != shard["version"]:
+                    self.reloaded_shards += 0 if force else 1
+                    old = self.docstores.pop(shard["name"], None)
+                    if old is not None:
+                        old.connection.close()
+                    self.docstores[shard["name"]] = SQLiteDocstore(os.path.join(self._path(shard), DOCSTORE_FILE))
+            for name in set(self.docstores) - {shard["name"] for shard in shards}:
+                self.docstores.pop(name).connection.close()
+
+            # Estadísticas BM25 del corpus completo (los manifiestos antiguos no las tienen)
+            self.bm25_stats = None
+            if "bm25" in manifest:
+                with open(os.path.join(self.root, manifest["bm25"]["df"]), encoding="utf-8") as f:
+                    self.bm25_stats = {**manifest["bm25"], "df": json.load(f)}
+
+            self.shards = shards
+            self.manifest_mtime = mtime
+            self.locations.clear()
+            return True
+
+    def _check_reload(self):
+        now = time.monotonic()
+        if now - self.last_check >= self.reload_interval:
+            self.last_check = now
+            self.reload()
+
+    def version(self) -> tuple:
+        """
+        Versión publicada de los fragmentos. Antes se comprueba el manifiesto, de modo que
+        una recarga pendiente se aplica aunque aún no se haya hecho ninguna búsqueda.
+
+        :return: Tupla de pares (nombre, versión) de los fragmentos.
+        """
+        self._check_reload()
+        with self.lock:
+            return tuple((shard["name"], shard["version"]) for shard in self.shards)
+
+    def _scatter(self, fn, *args) -> list:
+        """
+        Envía la búsqueda a todos los procesos a la vez y recoge sus resultados.
+
+        :return: Lista de tuplas (nombre del fragmento, resultado).
+        """
+        self._check_reload()
+        with self.lock:
+            groups = self._groups(self.shards)
+        futures = [
+            (group, executor.submit(fn, [(self._path(shard), shard["version"]) for shard in group], *args))
+            for executor, group in zip(self.executors, groups) if group
+        ]
+        return [
+            (shard["name"], result)
+            for group, future in futures
+            for shard, result in zip(group, future.result())
+        ]
+
+    def search(self, queries: np.ndarray, k: int) -> tuple:
+        """
+        Busca en todos los fragmentos y fusiona los k mejores resultados de cada consulta.
+
+        :param queries: Matriz n x d de consultas.
+        :param k: Resultados por consulta.
+        :return: Tupla (distancias, identificadores) como faiss.Index.search, con -1 si faltan resultados.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        partial = self._scatter(_search_dense, queries, k)
+        # En L2 los mejores son las distancias menores; con producto interno, las mayores
+        sign = 1 if self.metric_type == faiss.METRIC_L2 else -1
+
+        distances = np.full((len(queries), k), sign * np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for row in range(len(queries)):
+            candidates = [
+                (sign * float(d), int(i))
+                for _, (shard_distances, shard_ids) in partial
+                for d, i in zip(shard_distances[row], shard_ids[row]) if i != -1
+            ]
+            best = heapq.nsmallest(k, candidates)
+            distances[row, :len(best)] = [sign * d for d, _ in best]
+            ids[row, :len(best)] = [i for _, i in best]
+
+        with self.lock:
+            for name, (_, shard_ids) in partial:
+                self._locate(shard_ids[shard_ids != -1], name)
+        return distances, ids
+
+    def search_lexical(self, query: str, k: int) -> tuple:
+        """
+        Busca con BM25 en todos los fragmentos. Todos puntúan con el IDF y la longitud media
+        del corpus completo, de modo que las puntuaciones son comparables entre fragmentos
+        (también con el reparto por categoría) y coinciden con las de un único índice.
+        Con un manifiesto sin estadísticas globales, los fragmentos se fusionan por posición
+        con reciprocal rank fusion, ya que sus puntuaciones no son comparables.
+
+        :return: Tupla (ids, puntuaciones) ordenada de mayor a menor, como BM25Index.search.
+        """
+        self._check_reload()
+        with self.lock:
+            stats = self.bm25_stats
+        if stats is not None:
+            # A los procesos solo se envían las frecuencias de los términos de la consulta
+            stats = {**stats, "df": {t: stats["df"][t] for t in tokenize(query) if t in stats["df"]}}
+        partial = self._scatter(_search_lexical, query, k, stats)
+        with self.lock:
+            for name, (ids, _) in partial:
+                self._locate(ids, name)
+
+        if stats is None:
+            # Cada identificador está en un solo fragmento: su puntuación RRF depende de su posición
+            fused = {int(i): 1.0 / (RRF_K + rank + 1) for _, (ids, _) in partial for rank, i in enumerate(ids)}
+            best = reciprocal_rank_fusion([ids for _, (ids, _) in partial], k=RRF_K)[:k]
+            return np.asarray(best, dtype=np.int64), np.asarray([fused[i] for i in best], dtype=np.float32)
+
+        candidates = [(float(s), int(i)) for _, (ids, scores) in partial for i, s in zip(ids, scores)]
+        best = heapq.nlargest(k, candidates)
+        return (np.asarray([i for _, i in best], dtype=np.int64),
+                np.asarray([s for s, _ in best], dtype=np.float32))
+
+    def mget(self, ids: list) -> list:
+        """
+        Lee documentos de los docstores de los fragmentos. Los identificadores devueltos por
+        una búsqueda reciente se leen solo de su fragmento; el resto se buscan en todos.
+        """
+        ids = [int(i) for i in ids]
+        by_shard = {}
+        with self.lock:
+            for i in ids:
+                by_shard.setdefault(self.locations.get(i), []).append(i)
+            docstores = dict(self.docstores)
+
+        found = {}
+        for name, shard_ids in by_shard.items():
+            if name in docstores:
+                found.update(zip(shard_ids, docstores[name].mget(shard_ids)))
+        missing = [i for i in ids if found.get(i) is None]
+        for docstore in docstores.values():
+            if not missing:
+                break
+            found.update({i: doc for i, doc in zip(missing, docstore.mget(missing)) if doc is not None})
+            missing = [i for i in missing if found.get(i) is None]
+        return [found.get(i) for i in ids]
+
+    def stats(self) -> dict:
+        """
+        :return: Fragmentos, vectores, recargas y memoria residente de cada proceso de búsqueda.
+        """
+        with self.lock:
+            groups = self._groups(self.shards)
+        futures = [
+            executor.submit(_load_shards, [(self._path(shard), shard["version"]) for shard in group])
+            for executor, group in zip(self.executors, groups)
+        ]
+        return {
+            "shards": len(self.shards),
+            "ntotal": self.ntotal,
+            "reloaded_shards": self.reloaded_shards,
+            "workers": [future.result() for future in futures],
+        }
+
+    def close(self) -> None:
+        for executor in self.executors:
+            executor.shutdown()
+        for docstore in self.docstores.values():
+            docstore.connection.close()
+
+
+class ShardedDocstore:
+    """
+    Docstore con la interfaz mget del SQLiteDocstore sobre todos los fragmentos.
+    """
+
+    def __init__(self, index: ShardedIndex):
+        self.index = index
+
+    def mget(self, ids: list) -> list:
+        return self.index.mget(ids)
+
+
+class ShardedBM25:
+    """
+    Búsqueda BM25 con la interfaz de BM25Index.search sobre todos los fragmentos.
+    """
+
+    def __init__(self, index: ShardedIndex):
+        self.index = index
+
+    def search(self, query: str, k: int) -> tuple:
+        return self.index.search_lexical(query, k)
+
+
+class ShardedStore:
+    """
+    Almacén fragmentado con los atributos del vector store que usa el recuperador (index y docstore).
+    """
+
+    def __init__(self, root: str, workers: int = None, reload_interval: float = 5.0):
+        """
+        :param root: Carpeta del almacén fragmentado (con shards.json).
+        :param workers: Procesos de búsqueda.
+        :param reload_interval: Segundos entre comprobaciones del manifiesto.
+        """
+        self.index = ShardedIndex(root, workers, reload_interval)
+        self.docstore = ShardedDocstore(self.index)
+        has_bm25 = all(BM25Index.exists(self.index._path(shard)) for shard in self.index.shards)
+        self.bm25_index = ShardedBM25(self.index) if has_bm25 else None
+
+    def version(self) -> tuple:
+        return self.index.version()
@@ -0,0 +1,268 @@
+import numpy as np
+import threading
+import asyncio
+import re
+
+# Whisper trabaja con audio mono a 16 kHz en float32
+SAMPLE_RATE = 16000
+
+# Formatos PCM sin cabecera que se pueden recibir directamente (formato de ffmpeg y bytes por muestra)
+RAW_FORMATS = {"pcm_s16le": ("s16le", np.int16), "pcm_f32le": ("f32le", np.float32)}
+
+
+class AudioDecoder:
+    """
+    Convierte los fragmentos de audio recibidos en muestras float32 a 16 kHz. El PCM mono
+    a 16 kHz se usa directamente; el resto (PCM a otra frecuencia, WebM/Ogg con Opus, MP3,
+    AAC en ADTS, WAV...) se decodifica sobre la marcha con un proceso de ffmpeg que lee de
+    su entrada estándar. Los contenedores que necesitan leer el final del fichero (MP4/M4A)
+    no pueden decodificarse hasta recibirlos completos.
+    """
+
+    def __init__(self, on_audio, fmt: str = "pcm_s16le", sample_rate: int = SAMPLE_RATE, channels: int = 1):
+        """
+        :param on_audio: Función que recibe cada bloque de muestras decodificadas.
+        :param fmt: Formato del audio ("pcm_s16le", "pcm_f32le" o cualquier formato que reconozca ffmpeg).
+        :param sample_rate: Frecuencia de muestreo del PCM recibido.
+        :param channels: Canales del PCM recibido.
+        """
+        self.on_audio = on_audio
+        self.fmt = fmt
+        self.raw = RAW_FORMATS.get(fmt)
+        self.passthrough = self.raw is not None and sample_rate == SAMPLE_RATE and channels == 1
+        self.input_args = ["-f", self.raw[0], "-ar", str(sample_rate), "-ac", str(channels)] if self.raw else []
+        self.dtype = self.raw[1] if self.passthrough else np.int16
+        self.pending = b""
+        self.process = None
+        self.reader = None
+        self.received_bytes = 0
+
+    async def start(self) -> None:
+        if self.passthrough:
+            return
+        self.process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-loglevel", "error", *self.input_args, "-i", "pipe:0",
+            "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+        self.reader = asyncio.create_task(self._read())
+
+    async def feed(self, data: bytes) -> None:
+        """
+        Añade un fragmento de audio tal y como lo envía el cliente.
+        """
+        self.received_bytes += len(data)
+        if self.passthrough:
+            self._emit(data)
+            return
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    async def close(self) -> None:
+        """
+        Indica el final del audio y espera a que ffmpeg entregue las últimas muestras.
+        """
+        if self.process is None:
+            return
+        if not self.process.stdin.is_closing():
+            self.process.stdin.close()
+        await self.reader
+        await self.process.wait()
+
+    async def _read(self):
+        while chunk := await self.process.stdout.read(8192):
+            self._emit(chunk)
+
+    def _emit(self, data: bytes):
+        # Los fragmentos pueden cortar una muestra por la mitad: se guarda el resto para el siguiente
+        data = self.pending + data
+        size = np.dtype(self.dtype).itemsize
+        usable = len(data) // size * size
+        self.pending = data[usable:]
+        if not usable:
+            return
+        samples = np.frombuffer(data[:usable], dtype=self.dtype)
+        if self.dtype == np.int16:
+            samples = samples.astype(np.float32) / 32768.0
+        self.on_audio(samples.astype(np.float32, copy=False))
+
+
+def _normalize(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def common_prefix(a: list, b: list) -> int:
+    """
+    Número de palabras iniciales en las que coinciden dos hipótesis, sin tener en cuenta
+    mayúsculas ni signos de puntuación.
+    """
+    n = 0
+    for x, y in zip(a, b):
+        if _normalize(x) != _normalize(y):
+            break
+        n += 1
+    return n
+
+
+class StreamingTranscriber:
+    """
+    Transcripción incremental con Whisper sobre una ventana deslizante de audio.
+
+    Cada vez que llegan step_s segundos nuevos se transcribe la ventana completa y se
+    confirman las palabras en las que coinciden las dos últimas hipótesis (acuerdo local):
+    ya no cambiarán al llegar más audio. Cuando la ventana supera max_window_s, se descarta
+    el audio de los segmentos de Whisper ya confirmados, de modo que cada decodificación
+    trabaja sobre unos pocos segundos. Al terminar solo se vuelve a decodificar el audio
+    posterior al último segmento confirmado, o nada si la última hipótesis ya cubría todo el audio.
+
+    Las llamadas a update y finish bloquean mientras se ejecuta Whisper; el backend las
+    lanza en el ejecutor "asr" del planificador. feed puede llamarse a la vez desde el
+    bucle de eventos.
+    """
+
+    def __init__(self, transcriber, language: str = "spanish", step_s: float = 1.0, min_audio_s: float = 1.0,
+                 max_window_s: float = 15.0, end_silence_s: float = 0.8, silence_threshold: float = 0.01):
+        """
+        :param transcriber: Modelo con el método transcribe(audio=..., language=...) de Whisper
+                            (o RemoteTranscriber, ver model_client.py).
+        :param language: Idioma del audio.
+        :param step_s: Audio nuevo necesario para volver a decodificar.
+        :param min_audio_s: Audio mínimo antes de la primera decodificación.
+        :param max_window_s: Duración a partir de la cual se recorta la ventana.
+        :param end_silence_s: Silencio tras haber hablado que se considera fin del turno.
+        :param silence_threshold: Energía RMS por debajo de la cual un bloque de 30 ms es silencio.
+        """
+        self.transcriber = transcriber
+        self.language = language
+        self.step = int(step_s * SAMPLE_RATE)
+        self.min_audio = int(min_audio_s * SAMPLE_RATE)
+        self.max_window = int(max_window_s * SAMPLE_RATE)
+        self.end_silence = int(end_silence_s * SAMPLE_RATE)
+        self.silence_threshold = silence_threshold
+
+        self.lock = threading.Lock()
+        self.chunks = []              # Bloques recibidos aún no añadidos a la ventana
+        self.audio = np.zeros(0, dtype=np.float32)  # Ventana actual
+        self.offset = 0               # Muestras descartadas antes de la ventana
+        self.decoded = 0              # Longitud de la ventana en la última decodificación
+        self.committed = []           # Palabras confirmadas de todo el turno
+        self.window_committed = 0     # Palabras confirmadas que pertenecen a la ventana actual
+        self.tentative = []           # Palabras de la última hipótesis aún sin confirmar
+        self.segments = []            # Segmentos de la última decodificación (tiempos relativos a la ventana)
+        self.speech = False           # Si ya se ha detectado voz
+        self.silence = 0              # Muestras de silencio al final del audio
+        self.decodes = 0
+
+    def feed(self, samples: np.ndarray) -> None:
+        """
+        Añade muestras float32 a 16 kHz y actualiza la detección de fin de turno.
+        """
+        frame = int(0.03 * SAMPLE_RATE)
+        usable = len(samples) // frame * frame
+        energies = np.sqrt(np.mean(samples[:usable].reshape(-1, frame) ** 2, axis=1)) if usable else []
+        with self.lock:
+            self.chunks.append(samples)
+            for energy in energies:
+                if energy >= self.silence_threshold:
+                    self.speech = True
+                    self.silence = 0
+                else:
+                    self.silence += frame
+
+    def ended(self) -> bool:
+        """
+        :return: True si el usuario ha hablado y lleva end_silence_s en silencio.
+        """
+        with self.lock:
+            return self.speech and self.silence >= self.end_silence
+
+    @property
+    def duration(self) -> float:
+        with self.lock:
+            return (self.offset + len(self.audio) + sum(len(c) for c in self.chunks)) / SAMPLE_RATE
+
+    def _window(self) -> np.ndarray:
+        with self.lock:
+            if self.chunks:
+                self.audio = np.concatenate([self.audio, *self.chunks])
+                self.chunks = []
+            return self.audio
+
+    def _transcribe(self, audio: np.ndarray) -> dict:
+        self.decodes += 1
+        return self.transcriber.transcribe(audio=audio, language=self.language)
+
+    def update(self) -> dict | None:
+        """
+        Decodifica la ventana si ha llegado suficiente audio nuevo y confirma las palabras estables.
+
+        :return: Diccionario con el texto confirmado ("committed") y el provisional ("tentative"),
+                 o None si no se ha decodificado.
+        """
+        audio = self._window()
+        if len(audio) < self.min_audio or len(audio) - self.decoded < self.step:
+            return None
+
+        result = self._transcribe(audio)
+        self.decoded = len(audio)
+        words = result["text"].split()[self.window_committed:]
+
+        agreed = common_prefix(words, self.tentative)
+        self.committed += words[:agreed]
+        self.window_committed += agreed
+        self.tentative = words[agreed:]
+
+        self.segments = result.get("segments") or []
+        if len(audio) > self.max_window:
+            self._trim(self.segments, len(audio))
+
+        return self.partial()
+
+    def _trim(self, segments: list, length: int) -> None:
+        """
+        Descarta el audio de los segmentos completos cuyas palabras ya están confirmadas,
+        dejando siempre al menos un segundo de contexto.
+        """
+        cut, cut_words, count = 0, 0, 0
+        for segment in segments:
+            count += len(segment["text"].split())
+            end = int(segment["end"] * SAMPLE_RATE)
+            if count > self.window_committed or end > length - SAMPLE_RATE:
+                break
+            cut, cut_words = end, count
+        if not cut:
+            return
+        with self.lock:
+            self.audio = self.audio[cut:]
+            self.offset += cut
+        self.decoded -= cut
+        self.window_committed -= cut_words
+        # Los tiempos de los segmentos ya no corresponden a la ventana recortada
+        self.segments = []
+
+    def partial(self) -> dict:
+        return {"committed": " ".join(self.committed), "tentative": " ".join(self.tentative)}
+
+    def finish(self) -> str:
+        """
+        Cierra el turno y devuelve la transcripción completa. Si la última decodificación ya
+        incluía todo el audio, su hipótesis se da por buena sin volver a ejecutar Whisper; si
+        no, se descarta el audio de los segmentos ya confirmados y solo se decodifica el resto.
+
+        :return: Texto transcrito.
+        """
+        audio = self._window()
+        if len(audio) > self.decoded and len(audio) >= int(0.1 * SAMPLE_RATE):
+            self._trim(self.segments, len(audio))
+            audio = self._window()
+            result = self._transcribe(audio)
+            self.tentative = result["text"].split()[self.window_committed:]
+        self.committed += self.tentative
+        self.window_committed += len(self.tentative)
+        self.tentative = []
+        self.decoded = len(audio)
+        return " ".join(self.committed)
+
+    def stats(self) -> dict:
+        return {"audio_s": round(self.duration, 3), "window_s": round(len(self.audio) / SAMPLE_RATE, 3),
+                "decodes": self.decodes}
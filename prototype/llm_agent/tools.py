@@ -1,53 +1,92 @@
 from langchain.tools import tool
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from sentence_transformers import CrossEncoder
-import json
+from vector_store import load_store, store_version
+from bm25_index import BM25Index
+from retriever import Retriever, DEFAULT_CONFIG
+from agent import format_contexts
+from model_client import model_server_url, RemoteEmbeddings, RemoteCrossEncoder
+from scheduler import get_scheduler
+from prefetch import RetrievalCache
+from shards import ShardedStore, is_sharded
 
 # Ruta donde se guardan los vectores de FAISS
 persist_directory = "storage"
 
+# Almacén repartido en fragmentos (ver shards.py), si la carpeta tiene manifiesto. Sus procesos
+# de búsqueda se crean antes de cargar los modelos para no heredar su memoria ni sus hilos
+sharded_store = ShardedStore(persist_directory) if is_sharded(persist_directory) else None
+
+# Servidor de modelos compartido (ver model_server.py); si no se configura, los modelos se cargan aquí
+server_url = model_server_url()
+
 # Modelo de embeddings multilingüe
-embedding_model = HuggingFaceEmbeddings(
-    model_name='sentence-transformers/paraphrase-multilingual-mpnet-base-v2',
-    model_kwargs={'device': 'cpu'},
-    encode_kwargs={'normalize_embeddings': True},
-)
+if server_url:
+    embedding_model = RemoteEmbeddings(server_url)
+else:
+    from langchain_huggingface import HuggingFaceEmbeddings
+    embedding_model = HuggingFaceEmbeddings(
+        model_name='sentence-transformers/paraphrase-multilingual-mpnet-base-v2',
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True},
+    )
 
-# Cargar el vector store
-vector_store = FAISS.load_local(persist_directory, embeddings=embedding_model, allow_dangerous_deserialization=True)
+if sharded_store is not None:
+    # Búsqueda densa y léxica repartida entre los fragmentos
+    vector_store = sharded_store
+    bm25_index = sharded_store.bm25_index
+else:
+    # Cargar el vector store (índice proyectado en memoria y documentos en SQLite)
+    vector_store = load_store(persist_directory, embeddings=embedding_model)
 
-# Configuración del recuperador
-retriever_config = {"search_type": "similarity", "search_kwargs": {"k": 20}}
-retriever = vector_store.as_retriever(**retriever_config)
+    # Índice léxico BM25 construido junto al índice FAISS (opcional)
+    bm25_index = BM25Index.load(persist_directory) if BM25Index.exists(persist_directory) else None
+
+# Configuración de la recuperación híbrida (ver retriever.DEFAULT_CONFIG)
+retriever_config = dict(DEFAULT_CONFIG)
 
 # Modelo de reranking para reordenar resultados según relevancia
-reranker = CrossEncoder("cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+if server_url:
+    reranker = RemoteCrossEncoder(server_url)
+else:
+    from sentence_transformers import CrossEncoder
+    reranker = CrossEncoder("cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
 
+# Similitud mínima para que una consulta reutilice los resultados de otra distinta. Solo se
+# reutilizan consultas con el mismo texto mientras benchmark_retrieval.py --cache-quality no
+# muestre, con MPNet y el CrossEncoder, que un umbral no empeora la precisión ni el recall
+CACHE_THRESHOLD = None
 
-@tool
-def retrieval_augmented_generation(query: str) -> str:
+# Caché de resultados, compartida con la precarga del backend. Se vacía cuando cambia la
+# versión del almacén (fragmentos recargados o almacén actualizado en disco)
+if sharded_store is not None:
+    retrieval_cache = RetrievalCache(threshold=CACHE_THRESHOLD, version=sharded_store.version)
+else:
+    retrieval_cache = RetrievalCache(threshold=CACHE_THRESHOLD, version=lambda: store_version(persist_directory))
+
+# Recuperación por etapas: embedding, búsqueda híbrida, lectura de documentos y reranking.
+# Con los modelos locales, el embedding y el reranking se ejecutan en el planificador de
+# inferencia para no competir por los núcleos con la transcripción
+retriever = Retriever(vector_store, embedding_model, reranker, bm25_index, retriever_config,
+                      scheduler=None if server_url else get_scheduler(), cache=retrieval_cache)
+
+
+def hybrid_search(query: str) -> list:
     """
-    Recupera documentos relevantes usando FAISS + reranking con un modelo CrossEncoder.
-    
+    Recupera candidatos con FAISS y BM25 y los fusiona mediante Reciprocal Rank Fusion.
+    Sin índice BM25 se devuelven los resultados densos, como en la recuperación original.
+
     :param query: Consulta del usuario.
-    :return: Documentos rerankeados como JSON.
+    :return: Documentos candidatos ordenados por relevancia fusionada (sin los que ya no están en el docstore).
     """
-    # Recuperación inicial
-    retrieved_docs = retriever.invoke(query)
-    retrieved_texts = [doc.page_content[:1024] for doc in retrieved_docs]
-
-    # Emparejar consulta con cada contexto recuperado
-    pairs = [(query, context) for context in retrieved_texts]
+    candidate_ids = retriever.search(query, retriever.embed(query))
+    return [doc for doc in vector_store.docstore.mget(candidate_ids) if doc is not None]
 
-    # Obtener puntuaciones de relevancia
-    scores = reranker.predict(pairs)
 
-    # Selección de los 5 mejores documentos tras reranking
-    top_docs = [doc for _, doc in sorted(zip(scores, retrieved_texts), reverse=True)][:5]
+@tool
+def retrieval_augmented_generation(query: str) -> str:
+    """
+    Recupera documentos relevantes usando FAISS + BM25 + reranking con un modelo CrossEncoder.
 
-    return json.dumps(
-        {i + 1: doc for i, doc in enumerate(top_docs)},
-        ensure_ascii=False,
-        indent=4
-    )
+    :param query: Consulta del usuario.
+    :return: Documentos rerankeados como JSON.
+    """
+    return format_contexts(retriever.retrieve(query))
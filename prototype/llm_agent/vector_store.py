@@ -0,0 +1,363 @@
+from collections.abc import Mapping
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+import numpy as np
+import threading
+import sqlite3
+import faiss
+import json
+import os
+
+# Ficheros que componen un almacén vectorial en disco
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite"
+CONFIG_FILE = "index_config.json"
+VECTORS_FILE = "vectors.f32"       # Vectores originales de los índices comprimidos con 'refine'
+VECTOR_IDS_FILE = "vector_ids.npy"  # Identificador de cada fila de vectors.f32 (índices con IndexIDMap)
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Almacén de documentos en SQLite indexado por el identificador del vector en FAISS.
+    Solo se leen de disco los documentos que se solicitan (los top-k de cada búsqueda).
+    """
+
+    def __init__(self, path: str, read_only: bool = True):
+        """
+        :param path: Ruta del fichero SQLite.
+        :param read_only: Si es True, la base de datos se abre en modo solo lectura.
+        """
+        uri = f"file:{path}?mode=ro" if read_only else f"file:{path}"
+        self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+        if not read_only:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS documents ("
+                    "id INTEGER PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+                )
+
+    def search(self, search) -> Document | str:
+        """
+        Devuelve el documento asociado a un identificador.
+
+        :param search: Identificador del vector en el índice FAISS.
+        :return: Documento encontrado o mensaje de error (mismo contrato que InMemoryDocstore).
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT content, metadata FROM documents WHERE id = ?", (int(search),)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def mget(self, ids: list) -> list:
+        """
+        Recupera varios documentos en una única consulta, respetando el orden pedido.
+
+        :param ids: Identificadores de los vectores.
+        :return: Lista de documentos (None si algún identificador no existe).
+        """
+        ids = [int(i) for i in ids]
+        placeholders = ",".join("?" * len(ids))
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT id, content, metadata FROM documents WHERE id IN ({placeholders})", ids
+            ).fetchall()
+        found = {row[0]: Document(page_content=row[1], metadata=json.loads(row[2])) for row in rows}
+        return [found.get(i) for i in ids]
+
+    def add(self, texts: dict) -> None:
+        """
+        Añade documentos indexados por el identificador de su vector.
+
+        :param texts: Diccionario {id: Document}.
+        """
+        rows = [
+            (int(i), doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+            for i, doc in texts.items()
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO documents (id, content, metadata) VALUES (?, ?, ?)", rows
+            )
+
+    def delete(self, ids: list) -> None:
+        """
+        Elimina los documentos indicados.
+
+        :param ids: Identificadores de los vectores.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM documents WHERE id = ?", [(int(i),) for i in ids])
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def iter_documents(self, batch_size: int = 1000):
+        """
+        Recorre todos los documentos en orden de identificador.
+
+        :param batch_size: Documentos leídos de SQLite en cada consulta.
+        :return: Iterador de tuplas (id, Document).
+        """
+        last_id = -1
+        while True:
+            # Se lee por bloques para no cargar todo el corpus en memoria
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT id, content, metadata FROM documents WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], Document(page_content=row[1], metadata=json.loads(row[2]))
+            last_id = rows[-1][0]
+
+
+class IndexToDocstoreId(Mapping):
+    """
+    Correspondencia entre posiciones de FAISS e identificadores del docstore. Ambos
+    coinciden, por lo que no es necesario cargar ni serializar un diccionario.
+    """
+
+    def __init__(self, index: faiss.Index):
+        self.index = index
+
+    def __getitem__(self, i):
+        return int(i)
+
+    def __len__(self) -> int:
+        return self.index.ntotal
+
+    def __iter__(self):
+        if isinstance(self.index, faiss.IndexIDMap):
+            return iter(faiss.vector_to_array(self.index.id_map).tolist())
+        return iter(range(self.index.ntotal))
+
+
+def read_index(path: str, mmap: bool = True) -> faiss.Index:
+    """
+    Lee un índice FAISS, proyectándolo en memoria si la versión de FAISS lo permite.
+    Con mmap varios procesos comparten las mismas páginas a través de la caché del sistema.
+
+    :param path: Ruta del fichero del índice.
+    :param mmap: Si es True, intenta abrir el índice sin copiarlo a memoria.
+    :return: Índice FAISS.
+    """
+    if mmap:
+        # IO_FLAG_MMAP_IFC evita copiar los vectores de los índices planos (FAISS >= 1.9)
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError:
+            pass
+    return faiss.read_index(path)
+
+
+class RefinedIndex:
+    """
+    Índice comprimido cuyos candidatos se reordenan con los vectores originales. Se
+    recuperan refine·k candidatos del índice comprimido y se calcula su distancia exacta
+    con los vectores en float32, que se leen de disco con mmap: solo ocupan memoria las
+    páginas de los candidatos consultados.
+
+    Tiene la interfaz de faiss.Index que usan LangChain y el recuperador (search, reconstruct,
+    reconstruct_batch, ntotal, d, metric_type).
+    """
+
+    def __init__(self, index: faiss.Index, vectors_path: str, refine: int = 4, ids_path: str = None):
+        """
+        :param index: Índice comprimido.
+        :param vectors_path: Fichero con los vectores originales en float32, fila a fila.
+        :param refine: Candidatos recuperados por cada resultado.
+        :param ids_path: Identificador de cada fila (si el índice no usa posiciones).
+        """
+        self.index = index
+        self.refine = refine
+        self.d = index.d
+        self.metric_type = index.metric_type
+        self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r").reshape(-1, index.d)
+        self.order = self.sorted_ids = None
+        if ids_path is not None and os.path.exists(ids_path):
+            ids = np.load(ids_path)
+            self.order = np.argsort(ids, kind="stable")
+            self.sorted_ids = ids[self.order]
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def _rows(self, ids: np.ndarray) -> np.ndarray:
+        if self.order is None:
+            return ids
+        return self.order[np.searchsorted(self.sorted_ids, ids)]
+
+    def reconstruct_batch(self, ids) -> np.ndarray:
+        """
+        Vectores originales (sin comprimir) de varios identificadores, como faiss.Index.reconstruct_batch.
+
+        :param ids: Identificadores.
+        :return: Matriz len(ids) x d en float32.
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if self.order is None:
+            known = (ids >= 0) & (ids < len(self.vectors))
+        else:
+            positions = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.sorted_ids) - 1)
+            known = self.sorted_ids[positions] == ids
+        if not known.all():
+            raise RuntimeError(f"Identificadores no encontrados en el índice: {ids[~known][:10].tolist()}")
+        return np.array(self.vectors[self._rows(ids)], dtype=np.float32)
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        """
+        Vector original de un identificador, como faiss.Index.reconstruct (lo usa la búsqueda MMR de LangChain).
+        """
+        return self.reconstruct_batch([i])[0]
+
+    def search(self, queries: np.ndarray, k: int) -> tuple:
+        """
+        :param queries: Matriz n x d de consultas.
+        :param k: Resultados por consulta.
+        :return: Tupla (distancias, identificadores) como faiss.Index.search.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        _, candidates = self.index.search(queries, k * self.refine)
+        inner_product = self.metric_type == faiss.METRIC_INNER_PRODUCT
+
+        distances = np.full((len(queries), k), -np.inf if inner_product else np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, found) in enumerate(zip(queries, candidates)):
+            found = found[found != -1]
+            if not len(found):
+                continue
+            # Las filas se leen en orden para que los accesos a disco sean secuenciales
+            rows = self._rows(found)
+            order = np.argsort(rows)
+            found, vectors = found[order], self.vectors[rows[order]]
+            if inner_product:
+                scores = vectors @ query
+                best = np.argsort(-scores, kind="stable")[:k]
+            else:
+                scores = ((vectors - query) ** 2).sum(axis=1)
+                best = np.argsort(scores, kind="stable")[:k]
+            distances[row, :len(best)] = scores[best]
+            ids[row, :len(best)] = found[best]
+        return distances, ids
+
+
+def open_index(persist_dir: str, mmap: bool = True):
+    """
+    Abre el índice de un almacén. Si se construyó con 'refine' y conserva los vectores
+    originales, devuelve un RefinedIndex.
+
+    :param persist_dir: Carpeta del almacén.
+    :param mmap: Si es True, el índice se abre con mmap.
+    :return: Índice FAISS o RefinedIndex.
+    """
+    index = read_index(os.path.join(persist_dir, INDEX_FILE), mmap=mmap)
+    refine = read_config(persist_dir).get("refine")
+    vectors_path = os.path.join(persist_dir, VECTORS_FILE)
+    if refine and os.path.exists(vectors_path):
+        index = RefinedIndex(index, vectors_path, refine, os.path.join(persist_dir, VECTOR_IDS_FILE))
+    return index
+
+
+def store_version(persist_dir: str) -> tuple:
+    """
+    Versión de un almacén en disco: fecha de modificación del índice y del docstore. Cambia
+    al reconstruirlo o al actualizarlo con incremental_index.py.
+
+    :param persist_dir: Carpeta del almacén.
+    :return: Tupla comparable entre llamadas (None para los ficheros que no existen).
+    """
+    version = []
+    for name in (INDEX_FILE, DOCSTORE_FILE):
+        try:
+            version.append(os.stat(os.path.join(persist_dir, name)).st_mtime_ns)
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+
+def read_config(persist_dir: str) -> dict:
+    """
+    Lee la configuración del índice guardada junto al almacén, si existe.
+    """
+    path = os.path.join(persist_dir, CONFIG_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_store(vectorstore: FAISS, persist_dir: str) -> None:
+    """
+    Guarda un vector store de LangChain en el formato sin pickle: índice FAISS y
+    documentos en SQLite con el identificador del vector como clave.
+
+    :param vectorstore: Vector store construido en memoria.
+    :param persist_dir: Carpeta de destino.
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(persist_dir, INDEX_FILE))
+
+    # Se escribe en un fichero temporal para no dejar un docstore a medias
+    docstore_path = os.path.join(persist_dir, DOCSTORE_FILE)
+    tmp_path = docstore_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    docstore = SQLiteDocstore(tmp_path, read_only=False)
+    docstore.add({
+        i: vectorstore.docstore.search(doc_id)
+        for i, doc_id in vectorstore.index_to_docstore_id.items()
+    })
+    docstore.connection.close()
+    os.replace(tmp_path, docstore_path)
+
+
+def load_store(persist_dir: str, embeddings, mmap: bool = True) -> FAISS:
+    """
+    Abre un almacén guardado con save_store. El índice se proyecta en memoria y los
+    documentos se leen de SQLite bajo demanda.
+
+    :param persist_dir: Carpeta del almacén.
+    :param embeddings: Modelo de embeddings para las consultas.
+    :param mmap: Si es True, el índice se abre con mmap.
+    :return: Vector store de LangChain.
+    """
+    docstore_path = os.path.join(persist_dir, DOCSTORE_FILE)
+    if not os.path.exists(docstore_path):
+        raise FileNotFoundError(
+            f"No existe {docstore_path}. Si el almacén se guardó con save_local, conviértalo con migrate_store."
+        )
+
+    index = open_index(persist_dir, mmap=mmap)
+    config = read_config(persist_dir)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=SQLiteDocstore(docstore_path),
+        index_to_docstore_id=IndexToDocstoreId(index.index if isinstance(index, RefinedIndex) else index),
+        distance_strategy=config.get("distance_strategy", "COSINE"),
+    )
+
+
+def migrate_store(persist_dir: str, embeddings) -> None:
+    """
+    Convierte un almacén guardado con FAISS.save_local (index.pkl) al formato sin pickle.
+    Solo debe usarse con almacenes generados localmente, ya que deserializa el pickle.
+
+    :param persist_dir: Carpeta del almacén antiguo.
+    :param embeddings: Modelo de embeddings con el que se construyó.
+    """
+    vectorstore = FAISS.load_local(persist_dir, embeddings=embeddings, allow_dangerous_deserialization=True)
+    save_store(vectorstore, persist_dir)
+    os.remove(os.path.join(persist_dir, "index.pkl"))